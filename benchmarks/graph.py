@@ -0,0 +1,105 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark the task graph on large synthetic graphs.
+
+Builds a layered graph where each task depends on a few tasks in the layer below it, plus a
+single chain deeper than the recursion limit. Reports the time to build the graph, order it, and
+build the tree, status and execute a run.
+
+    PYTHONPATH=. python benchmarks/graph.py --size 50000 --jobs 8
+"""
+
+import argparse
+import random
+import sys
+import time
+from contextlib import contextmanager
+
+from ixian.graph import Graph
+from ixian.task import TASKS, Task, TaskRunner
+
+
+def noop(self, *args):
+    pass
+
+
+def task(name: str, depends: list) -> TaskRunner:
+    """Create and register a task that does nothing"""
+    return type(name, (Task,), {"name": name, "depends": depends, "execute": noop})().__task__
+
+
+def layered_graph(size: int, width: int, fan_out: int, seed: int = 0) -> TaskRunner:
+    """
+    Build a layered graph of `size` tasks. Each layer is `width` tasks and each task depends on
+    `fan_out` random tasks in the layer below. A single root depends on the top layer.
+    """
+    rand = random.Random(seed)
+    below, layer = [], []
+    for i in range(size):
+        if len(layer) == width:
+            below, layer = layer, []
+        depends = rand.sample(below, min(fan_out, len(below)))
+        layer.append(task(f"layered_{i}", depends))
+    return TaskRunner(name="layered", depends=layer)
+
+
+def chain(size: int) -> TaskRunner:
+    """Build a single chain of `size` tasks"""
+    runner = None
+    for i in range(size):
+        runner = task(f"chain_{i}", [runner] if runner else [])
+    return runner
+
+
+@contextmanager
+def timed(label: str):
+    start = time.perf_counter()
+    yield
+    print(f"  {label:<10} {time.perf_counter() - start:8.3f}s")
+
+
+def benchmark(label: str, root: TaskRunner, jobs: int) -> None:
+    print(label)
+    with timed("graph"):
+        graph = Graph([root])
+    with timed("order"):
+        graph.order()
+    with timed("tree"):
+        root.tree()
+    with timed("status"):
+        root.status()
+    with timed("execute"):
+        root.execute([], jobs=jobs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=50000, help="number of tasks")
+    parser.add_argument("--width", type=int, default=500, help="tasks per layer")
+    parser.add_argument("--fan-out", type=int, default=3, help="dependencies per task")
+    parser.add_argument("--jobs", type=int, default=1, help="jobs used for execute")
+    args = parser.parse_args()
+
+    root = layered_graph(args.size, args.width, args.fan_out)
+    benchmark(f"layered: {args.size} tasks", root, args.jobs)
+    TASKS.clear()
+
+    depth = max(args.size // 10, sys.getrecursionlimit() * 2)
+    benchmark(f"chain: {depth} tasks", chain(depth), args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,194 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark directory hashing on large synthetic trees.
+
+Builds a wide tree shaped like node_modules, many packages with a few small files each, and a
+deep tree, a chain of directories deeper than the recursion limit. Each tree is hashed by the
+previous recursive listdir walker and by `hash_dir`. Reports wall time and the filesystem calls
+made, each is one syscall: stat (including os.path.isdir), listdir, scandir, DirEntry.stat and
+open.
+
+The file index is disabled so every file is read, see `FileIndex`.
+
+    PYTHONPATH=. python benchmarks/hash_dir.py --packages 2000 --workers 8
+"""
+
+import argparse
+import builtins
+import hashlib
+import os
+import sys
+import tempfile
+import time
+from collections import Counter
+from contextlib import contextmanager
+from unittest import mock
+
+from ixian.check.checker import hash_object
+from ixian.config import CONFIG
+from ixian.modules.filesystem import file_hash, file_index
+
+
+def write(path: str, size: int) -> None:
+    with open(path, "wb") as file:
+        file.write(os.urandom(size))
+
+
+def wide_tree(root: str, packages: int) -> str:
+    """Build a tree of `packages` packages with a few nested directories and small files each"""
+    path = os.path.join(root, "node_modules")
+    for i in range(packages):
+        package = os.path.join(path, f"package-{i}")
+        os.makedirs(os.path.join(package, "lib", "utils"))
+        write(os.path.join(package, "package.json"), 600)
+        write(os.path.join(package, "README.md"), 3000)
+        write(os.path.join(package, "lib", "index.js"), 1200)
+        write(os.path.join(package, "lib", "utils", "helpers.js"), 800)
+    return path
+
+
+def deep_tree(root: str, depth: int) -> str:
+    """Build a chain of `depth` directories with a small file in each"""
+    path = os.path.join(root, "deep")
+    current = path
+    for _ in range(depth):
+        current = os.path.join(current, "d")
+    os.makedirs(current)
+    current = path
+    for _ in range(depth):
+        current = os.path.join(current, "d")
+        write(os.path.join(current, "file"), 100)
+    return path
+
+
+def recursive_hash_file(path: str) -> str:
+    """`hash_file` before the file index"""
+    hash = hashlib.sha256()
+    hash.update(str(os.stat(path).st_mode).encode("utf-8"))
+    with open(path, "rb", buffering=0) as f:
+        for b in iter(lambda: f.read(128 * 1024), b""):
+            hash.update(b)
+    return hash.hexdigest()
+
+
+def recursive_hash_dir(path: str) -> str:
+    """`hash_dir` before it was rebuilt on scandir"""
+    content_hashes = {"___FLAGS___": str(os.stat(path).st_mode)}
+    for child in sorted(os.listdir(path)):
+        child_path = os.path.join(path, child)
+        if os.path.isdir(child_path):
+            content_hashes[child] = recursive_hash_dir(child_path)
+        else:
+            content_hashes[child] = recursive_hash_file(child_path)
+    return hash_object(content_hashes)
+
+
+class CountedEntry:
+    """DirEntry that counts calls to `stat`, DirEntry can't be patched"""
+
+    def __init__(self, entry, counts: Counter):
+        self.entry = entry
+        self.counts = counts
+
+    def __getattr__(self, name):
+        return getattr(self.entry, name)
+
+    def stat(self, *args, **kwargs):
+        self.counts["DirEntry.stat"] += 1
+        return self.entry.stat(*args, **kwargs)
+
+
+class CountedScandir:
+    def __init__(self, path, counts: Counter):
+        self.iterator = os_scandir(path)
+        self.counts = counts
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.iterator.close()
+
+    def __iter__(self):
+        return (CountedEntry(entry, self.counts) for entry in self.iterator)
+
+
+os_scandir = os.scandir
+
+
+@contextmanager
+def counted() -> Counter:
+    """Count filesystem calls made within the block"""
+    counts = Counter()
+    os_stat, os_listdir, builtins_open = os.stat, os.listdir, builtins.open
+
+    def count(name, func):
+        def wrapper(*args, **kwargs):
+            counts[name] += 1
+            return func(*args, **kwargs)
+
+        return wrapper
+
+    with mock.patch("os.stat", count("stat", os_stat)), mock.patch(
+        "os.listdir", count("listdir", os_listdir)
+    ), mock.patch("builtins.open", count("open", builtins_open)), mock.patch(
+        "os.scandir", count("scandir", lambda path: CountedScandir(path, counts))
+    ):
+        yield counts
+
+
+def benchmark(label: str, path: str, workers: int) -> None:
+    print(label)
+    implementations = [
+        ("recursive", recursive_hash_dir, None),
+        ("scandir", file_hash.hash_dir, 1),
+        (f"scandir x{workers}", file_hash.hash_dir, workers),
+    ]
+    expected = None
+    for name, func, hash_workers in implementations:
+        CONFIG.HASH_WORKERS = hash_workers
+        start = time.perf_counter()
+        digest = func(path)
+        elapsed = time.perf_counter() - start
+        with counted() as counts:
+            func(path)
+        calls = ", ".join(f"{key} {value}" for key, value in sorted(counts.items()))
+        print(f"  {name:<12} {elapsed:8.3f}s  {sum(counts.values()):>8} calls ({calls})")
+
+        expected = expected or digest
+        assert digest == expected, f"{name} returned a different hash"
+    del CONFIG.HASH_WORKERS
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--packages", type=int, default=2000, help="packages in the wide tree")
+    parser.add_argument("--depth", type=int, default=0, help="depth of the deep tree")
+    parser.add_argument("--workers", type=int, default=8, help="threads files are hashed on")
+    args = parser.parse_args()
+    depth = args.depth or sys.getrecursionlimit() // 2
+
+    with tempfile.TemporaryDirectory() as root, mock.patch.object(
+        file_index, "RACY_WINDOW", float("inf")
+    ):
+        path = wide_tree(root, args.packages)
+        benchmark(f"wide: {args.packages} packages", path, args.workers)
+        path = deep_tree(root, depth)
+        benchmark(f"deep: {depth} directories", path, args.workers)
+
+
+if __name__ == "__main__":
+    main()
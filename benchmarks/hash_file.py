@@ -0,0 +1,123 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmark reading and hashing file contents across file size distributions.
+
+Compares the previous chunked reads, a new bytes object per 128 KiB chunk, with
+`hash_contents`, which picks a single os.read or a reusable buffer by size. Files are
+read from the page cache, the benchmark measures the cost of reading and hashing rather than the
+disk. Each distribution is hashed `--repeat` times and the best time is reported.
+
+    PYTHONPATH=. python benchmarks/hash_file.py --total 256
+"""
+
+import argparse
+import hashlib
+import os
+import random
+import tempfile
+import time
+
+from ixian.modules.filesystem.file_hash import hash_contents
+
+
+KB = 1024
+MB = 1024 * KB
+
+# name, (min size, max size) of files in the distribution
+DISTRIBUTIONS = [
+    ("tiny", (0, 2 * KB)),
+    ("small", (2 * KB, 64 * KB)),
+    ("medium", (64 * KB, 4 * MB)),
+    ("large", (8 * MB, 64 * MB)),
+]
+
+# share of files in a source tree by distribution
+SOURCE_TREE = {"tiny": 0.6, "small": 0.35, "medium": 0.049, "large": 0.001}
+
+
+def chunked(hash, path: str, size: int) -> None:
+    """`hash_file` before `hash_contents`"""
+    with open(path, "rb", buffering=0) as f:
+        for b in iter(lambda: f.read(128 * 1024), b""):
+            hash.update(b)
+
+
+def sizes(bounds: tuple, total: int, rand: random.Random) -> list:
+    """Return sizes of files within `bounds` that add up to about `total` bytes, at least one"""
+    low, high = bounds
+    found, remaining = [], total
+    while remaining > 0 or not found:
+        size = rand.randint(low, high)
+        found.append(size)
+        remaining -= max(size, 1)
+    return found
+
+
+def create(directory: str, name: str, file_sizes: list) -> list:
+    paths = []
+    data = os.urandom(max(file_sizes))
+    for i, size in enumerate(file_sizes):
+        path = os.path.join(directory, f"{name}-{i}")
+        with open(path, "wb") as file:
+            file.write(data[:size])
+        paths.append((path, size))
+    return paths
+
+
+def best_of(func, paths: list, repeat: int) -> float:
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for path, size in paths:
+            func(hashlib.sha256(), path, size)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def benchmark(label: str, paths: list, repeat: int) -> None:
+    total = sum(size for _, size in paths)
+    print(f"{label}: {len(paths)} files, {total / MB:.1f} MiB")
+    for name, func in (("chunked", chunked), ("hash_contents", hash_contents)):
+        elapsed = best_of(func, paths, repeat)
+        per_file = elapsed / len(paths) * 1e6
+        print(
+            f"  {name:<14} {elapsed:8.3f}s  {total / MB / elapsed:8.1f} MiB/s  "
+            f"{per_file:10.1f} us/file"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--total", type=int, default=256, help="MiB per distribution")
+    parser.add_argument("--repeat", type=int, default=3, help="runs per distribution")
+    args = parser.parse_args()
+
+    rand = random.Random(0)
+    total = args.total * MB
+    with tempfile.TemporaryDirectory() as directory:
+        mixed = []
+        for name, bounds in DISTRIBUTIONS:
+            paths = create(directory, name, sizes(bounds, total, rand))
+            benchmark(name, paths, args.repeat)
+            count = max(1, int(len(paths) * SOURCE_TREE[name] / SOURCE_TREE["tiny"] * 0.1))
+            mixed.extend(paths[:count])
+        rand.shuffle(mixed)
+        benchmark("source tree", mixed, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
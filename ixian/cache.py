@@ -0,0 +1,319 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import stat
+import threading
+import uuid
+from contextlib import contextmanager
+
+from ixian.config import CONFIG
+from ixian.utils import filesystem
+from ixian.utils.filesystem import FileLock
+
+
+logger = logging.getLogger(__name__)
+
+
+# Types of entries in a manifest
+FILE = "file"
+DIRECTORY = "directory"
+SYMLINK = "symlink"
+
+# Ways to restore files from the cache
+COPY = "copy"
+HARDLINK = "hardlink"
+
+CHUNK_SIZE = 1024 * 1024
+
+# Write permission bits. Objects are stored without them.
+WRITE_BITS = stat.S_IWUSR | stat.S_IWGRP | stat.S_IWOTH
+
+# File in the cache directory with the total size of the objects
+SIZE_FILE = "size"
+
+
+class MissingOutput(Exception):
+    """A task didn't create an output it declared"""
+
+
+def remove(path: str) -> None:
+    """Remove a file, symlink or directory if it exists"""
+    if os.path.isdir(path) and not os.path.islink(path):
+        shutil.rmtree(path)
+    elif os.path.lexists(path):
+        os.unlink(path)
+
+
+class OutputCache:
+    """
+    Content addressed cache of task outputs.
+
+    After a task with `outputs` runs, it's output files are copied into the cache and a manifest
+    listing them is saved under the task's hash, see `TaskRunner.hash`. The hash combines the
+    state of the task's checkers and it's dependencies, so a later run with the same inputs can
+    restore the outputs instead of running the task.
+
+    Files are stored once per unique content in `objects`, manifests in `entries`. Objects are
+    read only. With `restore_mode="hardlink"` read only outputs are linked to their object, other
+    outputs are copied so editing them can't modify the cache. Restoring a manifest marks it as
+    recently used. The total size of the objects is kept in `size`. When it grows beyond
+    `max_size` bytes the least recently used manifests are removed along with files no other
+    manifest uses.
+
+    :param path: directory of the cache, defaults to CONFIG.CACHE_DIR
+    :param max_size: size limit in bytes, defaults to CONFIG.CACHE_SIZE. None is unlimited.
+    :param restore_mode: "copy" or "hardlink", defaults to CONFIG.CACHE_RESTORE
+    """
+
+    def __init__(self, path: str = None, max_size: int = None, restore_mode: str = None):
+        self.path = path or CONFIG.format(CONFIG.CACHE_DIR)
+        self.max_size = max_size if max_size is not None else CONFIG.CACHE_SIZE
+        self.restore_mode = restore_mode or CONFIG.CACHE_RESTORE
+        self.thread_lock = threading.Lock()
+
+    def entry_path(self, key: str) -> str:
+        return os.path.join(self.path, "entries", f"{key}.json")
+
+    def object_path(self, digest: str) -> str:
+        return os.path.join(self.path, "objects", digest[:2], digest[2:])
+
+    def load_manifest(self, key: str):
+        path = self.entry_path(key)
+        if not filesystem.exists(path):
+            return None
+        try:
+            return json.loads(filesystem.read_file(path))
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring invalid cache entry {path}: {e}")
+            return None
+
+    def store_file(self, path: str) -> (str, int, bool):
+        """
+        Copy a file into the objects directory. The object is read only.
+
+        :return: tuple of the file's digest, size and True if the object is new
+        """
+        objects_dir = os.path.join(self.path, "objects")
+        os.makedirs(objects_dir, exist_ok=True)
+        temp_path = os.path.join(objects_dir, f".{uuid.uuid4().hex}.tmp")
+        hash = hashlib.sha256()
+        try:
+            with open(path, "rb") as source, open(temp_path, "xb") as target:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    hash.update(chunk)
+                    target.write(chunk)
+            os.chmod(temp_path, stat.S_IMODE(os.stat(path).st_mode) & ~WRITE_BITS)
+            digest = hash.hexdigest()
+            object_path = self.object_path(digest)
+            created = not os.path.exists(object_path)
+            if created:
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(temp_path, object_path)
+            else:
+                os.unlink(temp_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+            raise
+        return digest, os.path.getsize(object_path), created
+
+    def store_entry(self, path: str) -> (dict, int):
+        """
+        Store a file, directory or symlink.
+
+        :return: tuple of the manifest entry and bytes added to the objects
+        """
+        if os.path.islink(path):
+            return {"path": path, "type": SYMLINK, "target": os.readlink(path)}, 0
+        mode = stat.S_IMODE(os.stat(path).st_mode)
+        if os.path.isdir(path):
+            return {"path": path, "type": DIRECTORY, "mode": mode}, 0
+        digest, size, created = self.store_file(path)
+        entry = {"path": path, "type": FILE, "mode": mode, "digest": digest, "size": size}
+        return entry, size if created else 0
+
+    def store(self, key: str, outputs: list) -> None:
+        """
+        Store a task's outputs.
+
+        :param key: the task's hash
+        :param outputs: paths of files and directories the task created
+        :raises MissingOutput: if an output doesn't exist
+        """
+        entries = []
+        with self.locked():
+            size = self.read_size()
+            try:
+                for output in outputs:
+                    if not os.path.lexists(output):
+                        raise MissingOutput(f"Output doesn't exist: {output}")
+                    paths = [output]
+                    if os.path.isdir(output) and not os.path.islink(output):
+                        for root, dirs, files in os.walk(output):
+                            paths.extend(os.path.join(root, name) for name in sorted(dirs))
+                            paths.extend(os.path.join(root, name) for name in sorted(files))
+                    for path in paths:
+                        entry, added = self.store_entry(path)
+                        entries.append(entry)
+                        size += added
+
+                manifest = {"outputs": list(outputs), "entries": entries}
+                filesystem.write_file(self.entry_path(key), json.dumps(manifest))
+                if self.max_size is not None and size > self.max_size:
+                    size = self.evict()
+            finally:
+                # objects stored before a failure are kept, they're removed by a later eviction.
+                self.write_size(size)
+
+    def restore(self, key: str, outputs: list) -> bool:
+        """
+        Restore a task's outputs, replacing any existing files.
+
+        :param key: the task's hash
+        :param outputs: paths the task declares as outputs
+        :return: True if the outputs were restored, False if they aren't cached
+        """
+        with self.locked():
+            manifest = self.load_manifest(key)
+            if manifest is None or sorted(manifest["outputs"]) != sorted(outputs):
+                return False
+            files = [entry for entry in manifest["entries"] if entry["type"] == FILE]
+            if not all(os.path.exists(self.object_path(entry["digest"])) for entry in files):
+                logger.warning(f"Cache entry {key} is missing files, ignoring it.")
+                return False
+
+            for output in outputs:
+                remove(output)
+            for entry in manifest["entries"]:
+                self.restore_entry(entry)
+            # after their contents, directories may be read only.
+            for entry in reversed(manifest["entries"]):
+                if entry["type"] == DIRECTORY:
+                    os.chmod(entry["path"], entry["mode"])
+            # mark as recently used
+            os.utime(self.entry_path(key))
+        return True
+
+    def restore_entry(self, entry: dict) -> None:
+        path = entry["path"]
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if entry["type"] == SYMLINK:
+            os.symlink(entry["target"], path)
+        elif entry["type"] == DIRECTORY:
+            os.makedirs(path, exist_ok=True)
+        else:
+            object_path = self.object_path(entry["digest"])
+            if self.restore_mode == HARDLINK and not entry["mode"] & WRITE_BITS:
+                # linked files share the object's mode and contents. Only read only outputs are
+                # linked, writing to a linked file would modify the cache. Copy if the mode is
+                # different, e.g. objects stored before they were read only.
+                object_mode = stat.S_IMODE(os.stat(object_path).st_mode)
+                if object_mode == entry["mode"]:
+                    try:
+                        os.link(object_path, path)
+                        return
+                    except OSError:
+                        # e.g. the cache is on another filesystem
+                        pass
+            shutil.copyfile(object_path, path)
+            os.chmod(path, entry["mode"])
+
+    def manifests(self) -> list:
+        """
+        Return all manifests, most recently used first.
+
+        :return: list of (key, manifest) tuples
+        """
+        entries_dir = os.path.join(self.path, "entries")
+        if not os.path.isdir(entries_dir):
+            return []
+        found = []
+        for entry in os.scandir(entries_dir):
+            if entry.name.endswith(".json"):
+                found.append((entry.stat().st_mtime_ns, entry.name[: -len(".json")]))
+        manifests = []
+        for _, key in sorted(found, reverse=True):
+            manifest = self.load_manifest(key)
+            if manifest is not None:
+                manifests.append((key, manifest))
+        return manifests
+
+    def read_size(self) -> int:
+        """
+        Return the total size of the objects. Caches that didn't record it yet are measured.
+
+        :return: size in bytes
+        """
+        path = os.path.join(self.path, SIZE_FILE)
+        try:
+            return int(filesystem.read_file(path))
+        except (OSError, ValueError):
+            pass
+        size = 0
+        objects_dir = os.path.join(self.path, "objects")
+        for root, _, files in os.walk(objects_dir):
+            if root != objects_dir:
+                size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return size
+
+    def write_size(self, size: int) -> None:
+        filesystem.write_file(os.path.join(self.path, SIZE_FILE), str(size))
+
+    def evict(self) -> int:
+        """
+        Remove least recently used entries until the cache fits in `max_size`. Every manifest is
+        read, it's only called once the cache is too large.
+
+        :return: total size of the objects that were kept
+        """
+        size = 0
+        kept = set()
+        for key, manifest in self.manifests():
+            digests = {
+                entry["digest"]: entry["size"]
+                for entry in manifest["entries"]
+                if entry["type"] == FILE and entry["digest"] not in kept
+            }
+            added = sum(digests.values())
+            if size + added > self.max_size:
+                logger.debug(f"Evicting cache entry {key}")
+                os.unlink(self.entry_path(key))
+                continue
+            size += added
+            kept.update(digests)
+
+        objects_dir = os.path.join(self.path, "objects")
+        for root, _, files in os.walk(objects_dir):
+            if root == objects_dir:
+                continue
+            for name in files:
+                if os.path.basename(root) + name not in kept:
+                    os.unlink(os.path.join(root, name))
+        return size
+
+    @contextmanager
+    def locked(self):
+        """Lock the cache, it may be shared by many threads and ix processes"""
+        with self.thread_lock:
+            lock = FileLock(os.path.join(self.path, "lock"))
+            lock.acquire()
+            try:
+                yield
+            finally:
+                lock.release()
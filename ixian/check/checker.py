@@ -14,11 +14,19 @@
 
 import hashlib
 import json
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
 
-from ixian import builder
+from ixian.check.store import get_store
 from ixian.config import CONFIG
 
 
+# Checker state calculated during the current run, see `state_cache`
+STATE_CACHE = None
+STATE_CACHE_LOCK = threading.Lock()
+
+
 def hash_object(obj):
     """deterministically hash a dict."""
     hash = hashlib.sha256()
@@ -26,6 +34,33 @@ def hash_object(obj):
     return hash.hexdigest()
 
 
+@contextmanager
+def state_cache():
+    """
+    Cache checker state within the block. Checkers with the same class and keys calculate their
+    state once, e.g. when `status` and `execute` both check a task, when tasks share a checker, or
+    when a checker is cloned.
+
+    Files may change while the block runs. The scheduler invalidates a task's checkers after the
+    task executes. Nested blocks share the outer block's cache.
+
+    The cache is thread safe. A thread that needs state another thread is calculating waits for
+    it instead of calculating it again.
+
+    :return: the cache
+    """
+    global STATE_CACHE
+    if STATE_CACHE is not None:
+        yield STATE_CACHE
+        return
+
+    STATE_CACHE = {}
+    try:
+        yield STATE_CACHE
+    finally:
+        STATE_CACHE = None
+
+
 class Checker(object):
     """
     Checkers determine whether a task should run or be skipped. Tasks may have
@@ -41,9 +76,8 @@ class Checker(object):
     contribute_to_task_state = True
 
     def check(self):
-        return self.state() == self.saved_state()
+        return self.cached_state() == self.saved_state()
 
-    # TODO optimize to avoid repeated state calculation
     def state(self):
         """
         State being considered as part of this check. State is expected to be
@@ -60,8 +94,55 @@ class Checker(object):
         """
         raise NotImplementedError
 
+    def cache_key(self):
+        """
+        Key that identifies the state this checker calculates. Checkers with the same key share
+        cached state. Returns None if the state shouldn't be cached.
+
+        :return: hashable key or None
+        """
+        return None
+
+    def cached_state(self):
+        """
+        Return the checker's state, from the `state_cache` if one is active.
+
+        :return: state dict
+        """
+        cache = STATE_CACHE
+        key = None if cache is None else self.cache_key()
+        if key is None:
+            return self.state()
+
+        with STATE_CACHE_LOCK:
+            future = cache.get(key)
+            calculate = future is None
+            if calculate:
+                future = cache[key] = Future()
+        if not calculate:
+            return future.result()
+
+        try:
+            state = self.state()
+        except BaseException as e:
+            with STATE_CACHE_LOCK:
+                if cache.get(key) is future:
+                    del cache[key]
+            future.set_exception(e)
+            raise
+        future.set_result(state)
+        return state
+
+    def invalidate(self):
+        """Remove the checker's state from the `state_cache`, e.g. after files it checks changed"""
+        cache = STATE_CACHE
+        key = None if cache is None else self.cache_key()
+        if key is not None:
+            with STATE_CACHE_LOCK:
+                cache.pop(key, None)
+
     def hash(self):
-        return hash_object(self.state())
+        return hash_object(self.cached_state())
 
     def saved_state(self):
         """
@@ -69,14 +150,10 @@ class Checker(object):
         it's state will be None.
         :return: state object
         """
-        file_path = self.file_path()
-        if builder.exists(file_path):
-            return json.loads(builder.read(file_path))
-        else:
-            return None
+        return get_store().get(self.filename())
 
     def file_path(self):
-        """Path where state file can be found.
+        """Path where state file can be found when using the json store.
 
         :return: path
         """
@@ -89,10 +166,16 @@ class Checker(object):
         """
         raise NotImplementedError
 
-    def save(self):
-        state = self.state()
-        data = json.dumps(state)
-        builder.write(self.file_path(), data)
+    def save(self, state=None):
+        """
+        Save state so future checks can compare against it.
+
+        :param state: state to save, defaults to the current state. Tasks run on a worker save
+            the state calculated by the worker.
+        """
+        if state is None:
+            state = self.cached_state()
+        get_store().set(self.filename(), state)
 
     def clone(self):
         raise NotImplementedError
@@ -114,5 +197,8 @@ class MultiValueChecker(Checker):
         """"Generate file path using keys of the data dict."""
         return hash_object(self.keys)
 
+    def cache_key(self):
+        return type(self), tuple(self.keys)
+
     def clone(self):
         return type(self)(*self._keys)
@@ -0,0 +1,250 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from importlib import import_module
+
+from ixian import builder
+from ixian.config import CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+
+# Directory the json store keeps one file per checker in
+CHECKS_DIR = "{BUILDER}/checks"
+
+# Store instance for the current process, see `get_store`
+STORE = None
+STORE_KEY = None
+STORE_LOCK = threading.Lock()
+
+
+class StateStore:
+    """
+    Stores the state checkers saved after their task last succeeded. State is stored by key, the
+    checker's `filename`.
+
+    Writes made inside a `transaction` block are saved together when it exits. Transactions are
+    per thread, so tasks finishing on different threads don't share them.
+    """
+
+    def __init__(self):
+        self.local = threading.local()
+
+    def get(self, key: str):
+        """
+        Return saved state.
+
+        :param key: key the state was saved with
+        :return: state, or None if there isn't any
+        """
+        raise NotImplementedError
+
+    def set_many(self, states: dict) -> None:
+        """
+        Save state for many keys at once.
+
+        :param states: dict of key to state
+        """
+        raise NotImplementedError
+
+    def set(self, key: str, state) -> None:
+        batch = getattr(self.local, "batch", None)
+        if batch is None:
+            self.set_many({key: state})
+        else:
+            batch[key] = state
+
+    @contextmanager
+    def transaction(self):
+        """Save all of the state set within the block at once. Nested blocks join the outer one."""
+        if getattr(self.local, "batch", None) is not None:
+            yield
+            return
+
+        self.local.batch = {}
+        try:
+            yield
+            batch = self.local.batch
+        finally:
+            self.local.batch = None
+        if batch:
+            self.set_many(batch)
+
+    def refresh(self) -> None:
+        """Discard anything read so far, e.g. after another process saved state"""
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class JSONStore(StateStore):
+    """
+    Stores each checker's state in it's own json file in `{BUILDER}/checks`. This is the default
+    store.
+    """
+
+    def file_path(self, key: str) -> str:
+        return CONFIG.format(f"{CHECKS_DIR}/{{file_name}}", file_name=key)
+
+    def get(self, key: str):
+        file_path = self.file_path(key)
+        if builder.exists(file_path):
+            return json.loads(builder.read(file_path))
+        else:
+            return None
+
+    def set_many(self, states: dict) -> None:
+        for key, state in states.items():
+            builder.write(self.file_path(key), json.dumps(state))
+
+
+class SQLiteStore(StateStore):
+    """
+    Stores all state in a single SQLite database, `{BUILDER}/checks.sqlite3`.
+
+    Every saved state is loaded with one query the first time state is read, after that reads
+    don't touch the disk. Each `transaction` is written in one database transaction, the
+    scheduler saves each task's checkers in one as soon as the task finishes.
+
+    The first time the database is created, state saved by the `JSONStore` is imported. The json
+    files are left in place.
+
+    :param path: path of the database
+    """
+
+    def __init__(self, path: str = None):
+        super(SQLiteStore, self).__init__()
+        self.path = path or CONFIG.format("{BUILDER}/checks.sqlite3")
+        self.lock = threading.Lock()
+        self.connection = None
+        self.states = None
+
+    def connect(self) -> sqlite3.Connection:
+        if self.connection is None:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            created = not os.path.exists(self.path)
+            # checks are evaluated on many threads, access is serialized with `lock`.
+            self.connection = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            with self.connection:
+                self.connection.execute(
+                    "CREATE TABLE IF NOT EXISTS checks (key TEXT PRIMARY KEY, state TEXT NOT NULL)"
+                )
+            if created:
+                self.migrate()
+        return self.connection
+
+    def migrate(self) -> None:
+        """Import state saved in json files by `JSONStore`"""
+        checks_dir = CONFIG.format(CHECKS_DIR)
+        if not os.path.isdir(checks_dir):
+            return
+
+        rows = []
+        for entry in os.scandir(checks_dir):
+            if not entry.is_file():
+                continue
+            try:
+                with open(entry.path) as file:
+                    data = file.read()
+                json.loads(data)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Skipping invalid check state {entry.path}: {e}")
+                continue
+            rows.append((entry.name, data))
+
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO checks (key, state) VALUES (?, ?)", rows
+            )
+        logger.info(f"Imported {len(rows)} check states from {checks_dir}")
+
+    def load(self) -> dict:
+        """Load all saved state, the first time it's called"""
+        if self.states is None:
+            cursor = self.connect().execute("SELECT key, state FROM checks")
+            self.states = dict(cursor.fetchall())
+        return self.states
+
+    def get(self, key: str):
+        with self.lock:
+            data = self.load().get(key, None)
+        # state is kept serialized so callers can't modify the stored copy.
+        return None if data is None else json.loads(data)
+
+    def set_many(self, states: dict) -> None:
+        rows = [(key, json.dumps(state)) for key, state in states.items()]
+        with self.lock:
+            loaded = self.load()
+            with self.connection:
+                self.connection.executemany(
+                    "INSERT OR REPLACE INTO checks (key, state) VALUES (?, ?)", rows
+                )
+            loaded.update(rows)
+
+    def refresh(self) -> None:
+        with self.lock:
+            self.states = None
+
+    def close(self) -> None:
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+            self.states = None
+
+
+# Built-in stores for CONFIG.CHECK_STORE
+STORES = {"json": JSONStore, "sqlite": SQLiteStore}
+
+
+def get_store_class(name: str) -> type:
+    """
+    Return a store class by name.
+
+    :param name: name of a built-in store or the import path of a StateStore subclass
+    :return: StateStore subclass
+    """
+    if name in STORES:
+        return STORES[name]
+    module_path, _, class_name = name.rpartition(".")
+    if not module_path:
+        raise ValueError(f"Unknown check store: {name}")
+    return getattr(import_module(module_path), class_name)
+
+
+def get_store() -> StateStore:
+    """
+    Return the store configured by CONFIG.CHECK_STORE. The store is created the first time it's
+    needed and replaced if the setting, BUILDER or process changes.
+
+    :return: StateStore instance
+    """
+    global STORE, STORE_KEY
+    key = (CONFIG.CHECK_STORE, CONFIG.BUILDER, os.getpid())
+    with STORE_LOCK:
+        if STORE_KEY != key:
+            if STORE is not None and STORE_KEY[2] == key[2]:
+                STORE.close()
+            STORE = get_store_class(CONFIG.CHECK_STORE)()
+            STORE_KEY = key
+        return STORE
@@ -42,7 +42,16 @@ CONFIG_VARIABLE_PATTERN = re.compile(r"{(?P<var>[a-zA-Z0-9_.]+)}")
 
 class Config(object):
     root = None
-    reserved = {"add", "format", "reserved", "children", "root", "__dict__"}
+    reserved = {
+        "add",
+        "format",
+        "reserved",
+        "children",
+        "root",
+        "snapshot",
+        "restore",
+        "__dict__",
+    }
 
     def __getattribute__(self, key):
         """
@@ -103,6 +112,36 @@ class Config(object):
         expanded.update(**kwargs)
         return value.format(**expanded)
 
+    def snapshot(self) -> dict:
+        """
+        Return a picklable copy of the settings set on this config and it's children. Class level
+        defaults are not included, they are available wherever the config class is importable.
+
+        :return: snapshot that may be passed to `restore`
+        """
+        settings = {}
+        children = {}
+        for key, value in self.__dict__.items():
+            if key == "root":
+                continue
+            if isinstance(value, Config):
+                children[key] = (type(value), value.snapshot())
+            else:
+                settings[key] = value
+        return {"settings": settings, "children": children}
+
+    def restore(self, snapshot: dict) -> None:
+        """
+        Restore settings from a snapshot. Used to set up config in worker processes.
+
+        :param snapshot: snapshot returned by `snapshot`
+        """
+        for key, (child_class, child_snapshot) in snapshot["children"].items():
+            if not isinstance(self.__dict__.get(key, None), child_class):
+                self.add(key, child_class())
+            self.__dict__[key].restore(child_snapshot)
+        self.__dict__.update(snapshot["settings"])
+
     def resolve(self, path):
         value = self
         for key in path.split("."):
@@ -135,10 +174,29 @@ class Config(object):
     # RUN_CONTEXT - run context, by default this is the cli
     RUN_CONTEXT = "cli"
 
+    # Capacities of named resources tasks may declare, e.g. {"docker": 1}. Tasks only run while
+    # their resources are free. Resources that aren't listed here are unlimited.
+    RESOURCES = {}
+
     # Local store for task runtime data.
     BUILDER_DIR = ".builder"
     BUILDER = "{PWD}/{BUILDER_DIR}"
 
+    # Where checkers save state: "json", "sqlite" or the import path of a StateStore subclass.
+    CHECK_STORE = "json"
+
+    # Threads FileHash hashes files on. None uses the ThreadPoolExecutor default.
+    HASH_WORKERS = None
+
+    # Cache of task outputs, see ixian.cache. Size is in bytes, None is unlimited. Outputs are
+    # restored with "copy" or "hardlink".
+    CACHE_DIR = "{BUILDER}/cache"
+    CACHE_SIZE = 5 * 1024 ** 3
+    CACHE_RESTORE = "copy"
+
+    # Url of a remote cache shared with other machines, e.g. one started with `ix cache-server`.
+    REMOTE_CACHE = None
+
     LOG_LEVEL = "DEBUG"
     FORMATTER = "console"
     LOGGING_CONFIG = {
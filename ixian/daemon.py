@@ -0,0 +1,338 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import array
+import json
+import logging
+import os
+import signal
+import socket
+import struct
+import sys
+
+from ixian.config import CONFIG
+from ixian.exceptions import ExecuteFailed
+
+
+logger = logging.getLogger(__name__)
+
+
+SOCKET_NAME = "ixian.sock"
+
+# stdin, stdout and stderr
+STANDARD_FDS = (0, 1, 2)
+
+INT = struct.Struct("!i")
+
+
+def socket_path() -> str:
+    return f"{CONFIG.BUILDER}/{SOCKET_NAME}"
+
+
+def recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed")
+        data += chunk
+    return data
+
+
+def send_message(sock: socket.socket, message: dict, fds: tuple = ()) -> None:
+    """
+    Send a length prefixed json message. File descriptors are sent along with it as ancillary
+    data.
+    """
+    data = json.dumps(message).encode("utf-8")
+    header = INT.pack(len(data))
+    ancillary = [(socket.SOL_SOCKET, socket.SCM_RIGHTS, array.array("i", fds))] if fds else []
+    sock.sendmsg([header], ancillary)
+    sock.sendall(data)
+
+
+def recv_message(sock: socket.socket) -> (dict, list):
+    """
+    Receive a message sent with `send_message`.
+
+    :return: tuple of message and list of file descriptors
+    """
+    fds = array.array("i")
+    header, ancillary, _, _ = sock.recvmsg(
+        INT.size, socket.CMSG_SPACE(len(STANDARD_FDS) * fds.itemsize)
+    )
+    for level, kind, data in ancillary:
+        if level == socket.SOL_SOCKET and kind == socket.SCM_RIGHTS:
+            fds.frombytes(data[: len(data) - (len(data) % fds.itemsize)])
+    if len(header) < INT.size:
+        header += recv_exactly(sock, INT.size - len(header))
+    (size,) = INT.unpack(header)
+    return json.loads(recv_exactly(sock, size).decode("utf-8")), list(fds)
+
+
+def send_int(sock: socket.socket, value: int) -> None:
+    sock.sendall(INT.pack(value))
+
+
+def recv_int(sock: socket.socket) -> int:
+    return INT.unpack(recv_exactly(sock, INT.size))[0]
+
+
+def forward(argv: list, fds: tuple = STANDARD_FDS):
+    """
+    Forward a command to the daemon, if one is running.
+
+    :param argv: args to run
+    :param fds: stdin, stdout and stderr the command should use
+    :return: exit code of the command, or None if a daemon isn't running
+    """
+    path = socket_path()
+    if not os.path.exists(path):
+        return None
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except OSError:
+        # stale socket from a daemon that didn't shut down cleanly
+        sock.close()
+        return None
+
+    with sock:
+        send_message(sock, {"argv": argv, "cwd": os.getcwd(), "env": dict(os.environ)}, fds)
+        pid = recv_int(sock)
+        try:
+            return recv_int(sock)
+        except KeyboardInterrupt:
+            # the command isn't attached to this terminal, pass the interrupt on.
+            os.kill(pid, signal.SIGINT)
+            return recv_int(sock)
+
+
+class Daemon:
+    """
+    Serves ixian commands from a resident process.
+
+    `ix --daemon` loads ixian.py and it's modules once and then serves commands over a unix
+    socket in BUILDER. While the socket exists `ix` forwards it's argv, environment and working
+    directory to the daemon instead of initializing itself.
+
+    The client's stdin, stdout and stderr are passed to the daemon over the socket. Each command
+    runs in a process forked from the daemon with those file descriptors in place, so output
+    streams straight to the client's terminal. The forked process inherits the loaded modules and
+    tasks. The daemon reloads them when ixian.py or any module loaded by it changes.
+
+    :param path: path of the unix socket
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.sock = None
+        self.modules = set()
+        self.sources = {}
+
+    def load(self):
+        """
+        Initialize ixian and remember the source files it loaded so changes can be detected.
+
+        :return: ExitCode from `runner.init`
+        """
+        from ixian import runner
+
+        before = set(sys.modules)
+        code = runner.init()
+        self.modules = set(sys.modules) - before
+
+        paths = [runner.ixian_path()]
+        for name in self.modules:
+            path = getattr(sys.modules[name], "__file__", None)
+            if path:
+                paths.append(path)
+        self.sources = {path: self.mtime(path) for path in paths}
+        return code
+
+    @staticmethod
+    def mtime(path: str):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    def stale(self) -> bool:
+        """Return True if ixian.py or any module it loaded changed"""
+        return any(self.mtime(path) != mtime for path, mtime in self.sources.items())
+
+    def reload(self):
+        """
+        Unload tasks, modules and any python modules imported by them, then load them again.
+
+        :return: ExitCode from `runner.init`
+        """
+        from ixian.module import MODULES
+        from ixian.task import TASKS
+
+        logger.info("Sources changed, reloading.")
+        for runner in TASKS.values():
+            if runner.task:
+                type(runner.task).__task__ = None
+        TASKS.clear()
+        MODULES.clear()
+        for name in self.modules:
+            sys.modules.pop(name, None)
+        return self.load()
+
+    def listen(self) -> None:
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.bind(self.path)
+        self.sock.listen()
+        # wake up periodically to reap finished commands
+        self.sock.settimeout(1)
+
+    def close(self) -> None:
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+    @staticmethod
+    def reap() -> None:
+        """Collect exit statuses of finished commands"""
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if not pid:
+                return
+
+    def serve(self, count: int = None) -> None:
+        """
+        Accept and run commands.
+
+        :param count: stop after this many commands, forever if None
+        """
+        while count is None or count > 0:
+            self.reap()
+            try:
+                conn, _ = self.sock.accept()
+            except socket.timeout:
+                continue
+
+            with conn:
+                conn.settimeout(None)
+                try:
+                    request, fds = recv_message(conn)
+                except (OSError, ValueError) as e:
+                    logger.error(f"Invalid request: {e}")
+                    continue
+
+                if self.stale():
+                    self.reload()
+                self.fork(conn, request, fds)
+
+            if count is not None:
+                count -= 1
+
+    def fork(self, conn: socket.socket, request: dict, fds: list) -> None:
+        """Run a command in a child process so the daemon's state isn't modified by it"""
+        sys.stdout.flush()
+        sys.stderr.flush()
+        pid = os.fork()
+        if pid:
+            for fd in fds:
+                os.close(fd)
+            return
+
+        code = 1
+        try:
+            self.sock.close()
+            signal.signal(signal.SIGINT, signal.default_int_handler)
+            for fd, target in zip(fds, STANDARD_FDS):
+                os.dup2(fd, target)
+                os.close(fd)
+            # the daemon's own streams may have been redirected, bind them to the client's.
+            sys.stdin = open(0, "r", closefd=False)
+            sys.stdout = open(1, "w", buffering=1, closefd=False)
+            sys.stderr = open(2, "w", buffering=1, closefd=False)
+            os.chdir(request["cwd"])
+            os.environ.clear()
+            os.environ.update(request["env"])
+            sys.argv = ["ix"] + request["argv"]
+            send_int(conn, os.getpid())
+            code = self.run()
+        finally:
+            sys.stdout.flush()
+            sys.stderr.flush()
+            try:
+                send_int(conn, code)
+            finally:
+                os._exit(0)
+
+    @staticmethod
+    def run() -> int:
+        """Run the command in `sys.argv`, the same as the cli would after initializing"""
+        from ixian import runner
+
+        try:
+            runner.init_logging()
+            code = runner.run()
+        except SystemExit as e:
+            return e.code if isinstance(e.code, int) else 1
+        except (KeyboardInterrupt, ExecuteFailed):
+            return runner.ExitCodes.ERROR_TASK.value
+        except Exception:
+            logger.exception("Command failed")
+            return 1
+        return (code or runner.ExitCodes.SUCCESS).value
+
+
+def serve():
+    """
+    Run the daemon until interrupted.
+
+    :return: ExitCode
+    """
+    from ixian.runner import ExitCodes
+
+    path = socket_path()
+    if os.path.exists(path):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except OSError:
+            pass
+        else:
+            logger.error(f"A daemon is already listening on {path}")
+            return ExitCodes.ERROR_TASK
+        finally:
+            sock.close()
+
+    daemon = Daemon(path)
+    code = daemon.load()
+    if code.is_error:
+        return code
+
+    daemon.listen()
+    logger.info(f"Listening on {path}")
+    try:
+        daemon.serve()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        daemon.close()
+    return ExitCodes.SUCCESS
@@ -0,0 +1,283 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import hashlib
+import hmac
+import logging
+import os
+import pickle
+import struct
+
+from ixian.config import CONFIG
+from ixian.exceptions import ExecuteFailed
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7890
+
+LENGTH = struct.Struct("!Q")
+
+# Environment variable with the secret shared by the coordinator and it's workers
+SECRET_ENV = "IXIAN_WORKER_SECRET"
+
+# Bytes of the random nonce each end of a connection sends, see `handshake`
+NONCE_SIZE = 16
+
+DIGEST_SIZE = hashlib.sha256().digest_size
+
+
+class InvalidSignature(Exception):
+    """A message wasn't signed with the shared secret"""
+
+
+def get_secret() -> bytes:
+    """
+    Return the secret messages are signed with, from the IXIAN_WORKER_SECRET environment variable.
+
+    :raises ExecuteFailed: if it isn't set
+    """
+    secret = os.environ.get(SECRET_ENV, "")
+    if not secret:
+        raise ExecuteFailed(f"Set {SECRET_ENV} to a secret shared by the coordinator and workers")
+    return secret.encode("utf-8")
+
+
+def parse_address(value: str) -> tuple:
+    """
+    Parse a `host:port` address. The host may be omitted to use localhost.
+
+    :param value: address to parse
+    :return: tuple of host and port
+    """
+    host, _, port = value.strip().rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise ValueError(f"Invalid address, expected host:port: {value}")
+    return host or DEFAULT_HOST, port
+
+
+def parse_addresses(value: str) -> list:
+    """
+    Parse a comma separated list of `host:port` addresses.
+
+    :param value: addresses to parse
+    :return: list of (host, port) tuples
+    """
+    return [parse_address(address) for address in value.split(",") if address.strip()]
+
+
+def format_address(address: tuple) -> str:
+    return "{}:{}".format(*address)
+
+
+async def handshake(
+    reader: asyncio.StreamReader, writer: asyncio.StreamWriter, secret: bytes
+) -> bytes:
+    """
+    Exchange random nonces with the other end of a connection and derive the key messages on it
+    are signed with. The key is unique to the connection, messages recorded from another
+    connection can't be replayed.
+
+    :param secret: secret shared by both ends
+    :return: key for `send_message` and `recv_message`
+    """
+    nonce = os.urandom(NONCE_SIZE)
+    writer.write(nonce)
+    await writer.drain()
+    other = await reader.readexactly(NONCE_SIZE)
+    return hmac.new(secret, b"".join(sorted([nonce, other])), hashlib.sha256).digest()
+
+
+async def send_message(writer: asyncio.StreamWriter, message, key: bytes) -> None:
+    """Send a length prefixed, pickled message signed with `key`"""
+    data = pickle.dumps(message)
+    signature = hmac.new(key, data, hashlib.sha256).digest()
+    writer.write(LENGTH.pack(len(data)) + signature + data)
+    await writer.drain()
+
+
+async def recv_message(reader: asyncio.StreamReader, key: bytes):
+    """
+    Receive a message sent with `send_message`. Messages are only unpickled if they were signed
+    with `key`, unpickling runs arbitrary code.
+
+    :raises InvalidSignature: if the message wasn't signed with the key
+    """
+    (size,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+    signature = await reader.readexactly(DIGEST_SIZE)
+    data = await reader.readexactly(size)
+    if not hmac.compare_digest(signature, hmac.new(key, data, hashlib.sha256).digest()):
+        raise InvalidSignature(f"Invalid message signature, check {SECRET_ENV}")
+    return pickle.loads(data)
+
+
+class LogCollector(logging.Handler):
+    """Collects log records so they can be sent back to the coordinator"""
+
+    def __init__(self):
+        super(LogCollector, self).__init__()
+        self.records = []
+
+    def emit(self, record):
+        self.records.append((record.levelno, record.getMessage()))
+
+
+def run_task(request: dict) -> dict:
+    """
+    Run a task requested by a coordinator.
+
+    The task is run the same way as a process pool task. Afterwards the state of it's checkers is
+    calculated here, where the task ran, so the coordinator can save it.
+
+    :param request: request sent by `run_remote`
+    :return: response with the task's return value, logs, checker state and error, if any
+    """
+    from ixian.scheduler import execute_in_process
+    from ixian.task import TASKS
+
+    collector = LogCollector()
+    root_logger = logging.getLogger()
+    root_logger.addHandler(collector)
+    try:
+        return_value = execute_in_process(
+            request["config"],
+            request["class_path"],
+            request["name"],
+            request["args"],
+            request["force"],
+        )
+        checkers = TASKS[request["name"]].checkers or []
+        response = {
+            "return_value": return_value,
+            "state": [checker.state() for checker in checkers],
+            "error": None,
+        }
+    except Exception as e:
+        logger.exception(f"[fail] {request['name']}")
+        response = {"return_value": None, "state": None, "error": str(e) or repr(e)}
+    finally:
+        root_logger.removeHandler(collector)
+    response["logs"] = collector.records
+    return response
+
+
+class Worker:
+    """
+    Runs tasks sent by a coordinator, e.g. `ix --workers host:port my_task`.
+
+    Workers must load the same ixian.py as the coordinator and share it's workspace, tasks are
+    looked up by name and read and write the same files they would when run locally. Each request
+    carries a snapshot of the coordinator's CONFIG which is restored before the task runs.
+
+    A worker runs one task at a time. Start more workers to run more tasks at once.
+
+    Messages are pickled. They're signed with the secret in IXIAN_WORKER_SECRET and messages with
+    an invalid signature are rejected before they're unpickled. Messages aren't encrypted.
+
+    :param host: interface to listen on
+    :param port: port to listen on
+    :param secret: secret shared with coordinators, defaults to `get_secret()`
+    """
+
+    def __init__(self, host: str = DEFAULT_HOST, port: int = DEFAULT_PORT, secret: bytes = None):
+        self.host = host
+        self.port = port
+        self.secret = secret
+        self.server = None
+        self.lock = None
+
+    async def serve(self) -> None:
+        """Serve requests until `close` is called"""
+        if self.secret is None:
+            self.secret = get_secret()
+        # CONFIG and TASKS are global, requests from multiple coordinators must take turns.
+        self.lock = asyncio.Lock()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        logger.info(f"Worker listening on {format_address((self.host, self.port))}")
+        await self.server.wait_closed()
+
+    def close(self) -> None:
+        if self.server is not None:
+            self.server.close()
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_event_loop()
+        try:
+            key = await handshake(reader, writer, self.secret)
+            request = await recv_message(reader, key)
+            logger.info(f"[exec] {request['name']}")
+            async with self.lock:
+                response = await loop.run_in_executor(None, run_task, request)
+            try:
+                await send_message(writer, response, key)
+            except (pickle.PicklingError, TypeError, AttributeError) as e:
+                response.update(return_value=None, error=f"Could not send result: {e}")
+                await send_message(writer, response, key)
+        except InvalidSignature as e:
+            peer = writer.get_extra_info("peername")
+            logger.error(f"Rejected request from {peer}: {e}")
+        except (OSError, EOFError) as e:
+            logger.error(f"Lost connection to coordinator: {e}")
+        finally:
+            writer.close()
+
+
+async def run_remote(address: tuple, node) -> (object, list):
+    """
+    Run a node's task on a worker.
+
+    Logs emitted while the task ran are logged here, prefixed with the worker's address.
+
+    :param address: (host, port) of the worker
+    :param node: node to run
+    :raises ExecuteFailed: if the task failed or the worker couldn't be reached
+    :return: tuple of the task's return value and the state of it's checkers
+    """
+    runner = node.runner
+    task_class = type(runner.task)
+    request = {
+        "config": CONFIG.snapshot(),
+        "class_path": f"{task_class.__module__}.{task_class.__name__}",
+        "name": runner.name,
+        "args": list(node.args),
+        "force": node.force,
+    }
+    worker = format_address(address)
+    secret = get_secret()
+
+    try:
+        reader, writer = await asyncio.open_connection(*address)
+    except OSError as e:
+        raise ExecuteFailed(f"Worker {worker} is unavailable: {e}")
+    try:
+        key = await handshake(reader, writer, secret)
+        await send_message(writer, request, key)
+        response = await recv_message(reader, key)
+    except InvalidSignature as e:
+        raise ExecuteFailed(f"Worker {worker} sent an invalid response: {e}")
+    except (OSError, EOFError) as e:
+        raise ExecuteFailed(f"Lost connection to worker {worker}: {e}")
+    finally:
+        writer.close()
+
+    for level, message in response["logs"]:
+        logger.log(level, f"[{worker}] {message}")
+    if response["error"] is not None:
+        raise ExecuteFailed(f"{runner.name} failed on {worker}: {response['error']}")
+    return response["return_value"], response["state"]
@@ -25,6 +25,12 @@ class ExecuteFailed(Exception):
     """
 
 
+class TaskTimeout(ExecuteFailed):
+    """
+    Exception thrown when a task runs longer than it's timeout.
+    """
+
+
 class MockExit(BaseException):
     """Thrown by mock_exit to simulate exiting the process"""
 
@@ -42,3 +48,11 @@ class InvalidClassPath(Exception):
     """Error thrown when a class path is not in the valid format"""
 
     pass
+
+
+class DependencyCycle(Exception):
+    """Error thrown when task dependencies contain a cycle"""
+
+    def __init__(self, cycle):
+        self.cycle = cycle
+        super(DependencyCycle, self).__init__(f"Dependency cycle: {' -> '.join(cycle)}")
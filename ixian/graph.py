@@ -0,0 +1,116 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import heapq
+from collections import defaultdict
+
+from ixian.exceptions import DependencyCycle
+
+
+class Graph:
+    """
+    Adjacency index of one or more tasks and all of their dependencies.
+
+    The index is built once by walking `TaskRunner.depends` without recursion. Tasks are keyed by
+    name. `dependencies` maps each task to the tasks it depends on, `dependents` maps each task to
+    the tasks that depend on it.
+
+    Each task is also numbered in the order the recursive tree walk would finish it (post-order).
+    That number is used to break ties so the topological order matches the tree walk.
+    """
+
+    def __init__(self, roots: list):
+        self.roots = [root.name for root in roots]
+        self.runners = {}
+        self.dependencies = {}
+        self.dependents = defaultdict(list)
+        self.index = {}
+
+        for root in roots:
+            if root.name in self.runners:
+                continue
+            self.add(root)
+            stack = [(root, iter(root.depends))]
+            while stack:
+                runner, depends = stack[-1]
+                for dependency in depends:
+                    self.add_edge(runner.name, dependency.name)
+                    if dependency.name not in self.runners:
+                        self.add(dependency)
+                        stack.append((dependency, iter(dependency.depends)))
+                        break
+                else:
+                    stack.pop()
+                    self.index[runner.name] = len(self.index)
+
+    def __len__(self):
+        return len(self.runners)
+
+    def __contains__(self, name):
+        return name in self.runners
+
+    def add(self, runner) -> None:
+        self.runners[runner.name] = runner
+        self.dependencies[runner.name] = []
+
+    def add_edge(self, name: str, dependency: str) -> None:
+        """Add an edge from a task to one of it's dependencies. Duplicate edges are ignored."""
+        dependencies = self.dependencies[name]
+        if dependency not in dependencies:
+            dependencies.append(dependency)
+            self.dependents[dependency].append(name)
+
+    def order(self) -> list:
+        """
+        Return task names in topological order, dependencies before the tasks that depend on
+        them. Uses Kahn's algorithm, ties are broken by the tree walk order.
+
+        :raises DependencyCycle: if the tasks contain a cycle
+        :return: list of task names
+        """
+        waiting = {name: len(dependencies) for name, dependencies in self.dependencies.items()}
+        ready = [(self.index[name], name) for name, count in waiting.items() if not count]
+        heapq.heapify(ready)
+
+        order = []
+        while ready:
+            _, name = heapq.heappop(ready)
+            order.append(name)
+            for dependent in self.dependents[name]:
+                waiting[dependent] -= 1
+                if not waiting[dependent]:
+                    heapq.heappush(ready, (self.index[dependent], dependent))
+
+        if len(order) != len(waiting):
+            raise DependencyCycle(self.find_cycle(set(waiting).difference(order)))
+        return order
+
+    def find_cycle(self, remaining: set) -> list:
+        """
+        Find a cycle among the tasks Kahn's algorithm could not order. Every remaining task is
+        waiting on at least one other remaining task, so following those edges must loop.
+
+        :param remaining: names of tasks that could not be ordered
+        :return: list of task names in the cycle, the first task is repeated at the end
+        """
+        name = min(remaining, key=self.index.get)
+        path = []
+        positions = {}
+        while name not in positions:
+            positions[name] = len(path)
+            path.append(name)
+            name = next(
+                dependency for dependency in self.dependencies[name] if dependency in remaining
+            )
+        return path[positions[name] :] + [name]  # noqa: E203
@@ -12,8 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import argparse
 import io
 
+from ixian import distributed, remote_cache
+from ixian.config import CONFIG
 from ixian.task import Task, VirtualTarget
 
 
@@ -68,3 +71,66 @@ class Help(Task):
             parser = runner.get_parser()
             parser.print_help()
         return 0
+
+
+class Worker(Task):
+    """
+    Run tasks sent by `ix --workers`. Start workers in the project's workspace, they must load the
+    same ixian.py as the coordinator. Set IXIAN_WORKER_SECRET to the same secret on the workers
+    and the coordinator:
+
+        IXIAN_WORKER_SECRET=... ix worker --listen 0.0.0.0:7890
+
+    Tasks are sent pickled. Messages are signed with the secret but not encrypted, use a trusted
+    network or an SSH tunnel.
+    """
+
+    name = "worker"
+    short_description = "Run tasks for ix --workers."
+
+    async def execute(self, *args):
+        parser = argparse.ArgumentParser(prog="ix worker")
+        parser.add_argument(
+            "--listen",
+            type=distributed.parse_address,
+            default=(distributed.DEFAULT_HOST, distributed.DEFAULT_PORT),
+            metavar="HOST:PORT",
+            help="address to listen on",
+        )
+        options = parser.parse_args(args)
+        await distributed.Worker(*options.listen).serve()
+
+
+class CacheServer(Task):
+    """
+    Serve a remote cache of task outputs. Point other machines at it with CONFIG.REMOTE_CACHE:
+
+        ix cache-server --listen 0.0.0.0:7891
+        JT_REMOTE_CACHE=http://cache-host:7891 ix build
+
+    There is no authentication, only listen on trusted networks.
+    """
+
+    name = "cache-server"
+    short_description = "Serve a remote cache of task outputs."
+
+    async def execute(self, *args):
+        parser = argparse.ArgumentParser(prog="ix cache-server")
+        parser.add_argument(
+            "--listen",
+            type=distributed.parse_address,
+            default=(remote_cache.DEFAULT_HOST, remote_cache.DEFAULT_PORT),
+            metavar="HOST:PORT",
+            help="address to listen on",
+        )
+        parser.add_argument(
+            "--dir",
+            default=CONFIG.format("{BUILDER}/cache-server"),
+            help="directory to store outputs in",
+        )
+        parser.add_argument(
+            "--max-size", type=int, metavar="BYTES", help="remove old outputs beyond this size"
+        )
+        options = parser.parse_args(args)
+        server = remote_cache.CacheServer(options.dir, *options.listen, options.max_size)
+        await server.serve()
@@ -14,11 +14,33 @@
 
 import hashlib
 import os
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
 from glob import glob
 from itertools import chain
-from stat import ST_MODE
+from stat import S_ISDIR, ST_MODE
 
 from ixian.check.checker import MultiValueChecker, hash_object
+from ixian.config import CONFIG
+from ixian.modules.filesystem.file_index import get_index
+from ixian.modules.filesystem.ignore import IgnoreRules, Scope
+
+
+# Files smaller than this are hashed on the thread walking the directory, handing them to the
+# pool costs more than hashing them.
+INLINE_SIZE = 64 * 1024
+
+# Files smaller than this are read with a single os.read, larger files are read in CHUNK_SIZE
+# chunks into a buffer reused by each thread.
+SMALL_FILE_SIZE = 64 * 1024
+CHUNK_SIZE = 256 * 1024
+BUFFERS = threading.local()
+
+# Pool files are hashed on, see `get_pool`
+POOL = None
+POOL_KEY = None
+POOL_LOCK = threading.Lock()
 
 
 def get_flags(path):
@@ -26,19 +48,190 @@ def get_flags(path):
     return str(os.stat(path)[ST_MODE])
 
 
-def hash_file(path):
+def hash_file(path, stat=None, index=None):
     """
     Hash a single file including it's contents, permissions, and flags.
 
+    Hashes are stored in the `FileIndex`. Files that weren't modified since they were indexed
+    aren't read again.
+
     :param path: path to file or directory
+    :param stat: the file's stat if the caller already has it
+    :param index: the `FileIndex`, defaults to `get_index()`
     :return: sha256 hash of path contents
     """
+    if index is None:
+        index = get_index()
+    index_path = os.path.abspath(path)
+    if stat is None:
+        stat = os.stat(path)
+    digest = index.get(index_path, stat)
+    if digest is not None:
+        return digest
+
+    started = time.time()
     hash = hashlib.sha256()
-    hash.update(get_flags(path).encode("utf-8"))
-    with open(path, "rb", buffering=0) as f:
-        for b in iter(lambda: f.read(128 * 1024), b""):
-            hash.update(b)
-    return hash.hexdigest()
+    hash.update(str(stat[ST_MODE]).encode("utf-8"))
+    hash_contents(hash, path, stat.st_size)
+    digest = hash.hexdigest()
+    index.set(index_path, stat, digest, started)
+    return digest
+
+
+def get_buffer() -> memoryview:
+    """Return the calling thread's read buffer"""
+    view = getattr(BUFFERS, "view", None)
+    if view is None:
+        view = BUFFERS.view = memoryview(bytearray(CHUNK_SIZE))
+    return view
+
+
+def hash_contents(hash, path: str, size: int) -> None:
+    """
+    Add a file's contents to a hash. The file is read until it ends, `size` only picks how:
+
+    - Small files are read with a single `os.read`, without creating a file object.
+    - Larger files are read into the thread's reusable buffer, no bytes are allocated per chunk.
+      hashlib releases the GIL while it hashes each chunk.
+
+    Files aren't mapped with mmap, a mapped file truncated while it's hashed, e.g. by a task
+    rewriting it's output, would kill the process with SIGBUS.
+
+    :param hash: hashlib hash to update
+    :param path: path of the file
+    :param size: expected size of the file, from it's stat
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if size < SMALL_FILE_SIZE:
+            # a short read means the file ended, otherwise it grew since it was stat'ed.
+            data = os.read(fd, size + 1)
+            hash.update(data)
+            if len(data) <= size:
+                return
+
+        view = get_buffer()
+        while True:
+            read = os.readv(fd, [view])
+            if not read:
+                return
+            hash.update(view[:read])
+    finally:
+        os.close(fd)
+
+
+def get_pool() -> ThreadPoolExecutor:
+    """
+    Return the pool files are hashed on. The pool is shared by every checker in the process and
+    replaced if CONFIG.HASH_WORKERS or the process changes.
+
+    Hashing mostly waits on I/O and `hashlib` releases the GIL while hashing, so files are hashed
+    concurrently on threads.
+
+    :return: ThreadPoolExecutor
+    """
+    global POOL, POOL_KEY
+    key = (CONFIG.HASH_WORKERS, os.getpid())
+    with POOL_LOCK:
+        if POOL_KEY != key:
+            if POOL is not None and POOL_KEY[1] == key[1]:
+                POOL.shutdown(wait=False)
+            POOL = ThreadPoolExecutor(
+                max_workers=CONFIG.HASH_WORKERS, thread_name_prefix="ixian-hash"
+            )
+            POOL_KEY = key
+        return POOL
+
+
+def submit_dir(
+    pool: ThreadPoolExecutor, path: str, stat: os.stat_result = None, scope: Scope = None
+) -> dict:
+    """
+    Walk a directory and submit each file in it to the pool. Files smaller than `INLINE_SIZE`
+    are hashed right away.
+
+    The walk uses `os.scandir` and a stack instead of recursion, so deep trees don't hit the
+    recursion limit. Each entry is stat'ed once, the stat provides both it's type and the mode
+    that is hashed, and is passed on to `hash_file`. Like `os.stat`, symlinks are followed.
+
+    Paths excluded by `scope` are skipped, excluded directories aren't walked. Once the walk is
+    done index entries for files that weren't found are stale, see `FileIndex`.
+
+    :param pool: pool to hash files on
+    :param path: path of directory
+    :param stat: the directory's stat if the caller already has it
+    :param scope: ignore rules `Scope` for the directory
+    :return: the directory's contents. Files map to their hash or a future of it, directories to
+        a dict of their contents.
+    """
+    if stat is None:
+        stat = os.stat(path)
+    index = get_index()
+    root = {"___FLAGS___": str(stat.st_mode)}
+    stack = [(path, root, scope)]
+    while stack:
+        dir_path, contents, scope = stack.pop()
+        with os.scandir(dir_path) as iterator:
+            entries = list(iterator)
+        if scope is not None:
+            scope = scope.enter(dir_path, {entry.name for entry in entries})
+
+        for entry in entries:
+            # DirEntry.is_dir doesn't need a syscall, excluded entries aren't stat'ed.
+            if scope is not None and scope.ignored(entry.path, entry.name, entry.is_dir()):
+                continue
+            entry_stat = entry.stat()
+            if S_ISDIR(entry_stat.st_mode):
+                child = {"___FLAGS___": str(entry_stat.st_mode)}
+                contents[entry.name] = child
+                stack.append((entry.path, child, scope))
+            elif entry_stat.st_size < INLINE_SIZE:
+                contents[entry.name] = hash_file(entry.path, entry_stat, index)
+            else:
+                contents[entry.name] = pool.submit(hash_file, entry.path, entry_stat, index)
+    index.walked(os.path.abspath(path))
+    return root
+
+
+def walk_contents(contents: dict) -> list:
+    """
+    Return the contents dicts returned by `submit_dir`, parents before their children.
+
+    :param contents: contents dict of the root directory
+    :return: list of contents dicts
+    """
+    found = []
+    stack = [contents]
+    while stack:
+        current = stack.pop()
+        found.append(current)
+        stack.extend(value for value in current.values() if isinstance(value, dict))
+    return found
+
+
+def resolve(contents) -> str:
+    """
+    Wait for the hashes of contents returned by `submit_dir` and combine them.
+
+    :param contents: a future or contents dict
+    :return: sha256 hash
+    """
+    if isinstance(contents, Future):
+        return contents.result()
+
+    # hash children before their parents
+    hashes = {}
+    for current in reversed(walk_contents(contents)):
+        content_hashes = {}
+        for name, value in current.items():
+            if isinstance(value, dict):
+                content_hashes[name] = hashes[id(value)]
+            elif isinstance(value, Future):
+                content_hashes[name] = value.result()
+            else:
+                content_hashes[name] = value
+        hashes[id(current)] = hash_object(content_hashes)
+    return hashes[id(contents)]
 
 
 def hash_dir(path):
@@ -54,15 +247,7 @@ def hash_dir(path):
     :param path: path of directory
     :return: sha256 hash of directory contents
     """
-    content_hashes = {"___FLAGS___": get_flags(path)}
-    contents = sorted(os.listdir(path))
-    for child in contents:
-        child_path = os.path.join(path, child)
-        if os.path.isdir(child_path):
-            content_hashes[child] = hash_dir(child_path)
-        else:
-            content_hashes[child] = hash_file(child_path)
-    return hash_object(content_hashes)
+    return resolve(submit_dir(get_pool(), path))
 
 
 def hash_path(path):
@@ -71,18 +256,53 @@ def hash_path(path):
     :param path: path to hash
     :return: sha256 hash
     """
-    if os.path.isdir(path):
-        return hash_dir(path)
-    else:
-        return hash_file(path)
+    return hash_paths(path)[path]
 
 
-def hash_paths(*paths):
+def hash_paths(*paths, ignore: IgnoreRules = None):
     """ hash directories and files
+
+    Directories are walked on the calling thread while the files found are
+    hashed concurrently on the pool from `get_pool`.
+
     :param paths: list of directories or file paths
+    :param ignore: rules for paths to exclude. Excluded paths are left out of
+        the result and the directories they are in.
     :return: dict mapping path to hash
     """
-    return {path: hash_path(path) for path in paths}
+    pool = get_pool()
+    submitted = {}
+    try:
+        for path in paths:
+            stat = os.stat(path)
+            is_dir = S_ISDIR(stat.st_mode)
+            if ignore is not None:
+                absolute = os.path.abspath(path)
+                if ignore.ignored(absolute, is_dir):
+                    continue
+            if is_dir:
+                # walk the absolute path so it matches the paths of gitignore files.
+                scope = None if ignore is None else ignore.scope(absolute)
+                walk_path = path if ignore is None else absolute
+                submitted[path] = submit_dir(pool, walk_path, stat, scope)
+            else:
+                submitted[path] = pool.submit(hash_file, path, stat, get_index())
+        return {path: resolve(contents) for path, contents in submitted.items()}
+    except BaseException:
+        cancel(submitted.values())
+        raise
+
+
+def cancel(contents) -> None:
+    """Cancel hashes that haven't started"""
+    for value in contents:
+        if isinstance(value, Future):
+            value.cancel()
+        elif isinstance(value, dict):
+            for current in walk_contents(value):
+                for child in current.values():
+                    if isinstance(child, Future):
+                        child.cancel()
 
 
 class FileHash(MultiValueChecker):
@@ -100,8 +320,39 @@ class FileHash(MultiValueChecker):
     )
 
     Directory contents are recursively hashed.
+
+    Paths matching gitignore style `exclude` patterns aren't hashed, excluded
+    directories aren't walked. With `respect_gitignore`, paths ignored by git
+    are excluded too.
+
+    :Example:
+
+    FileHash(
+        '{PWD}/src',
+        exclude=['__pycache__', '*.pyc', 'node_modules/'],
+        respect_gitignore=True,
+    )
+
+    :param keys: paths to hash
+    :param exclude: gitignore style patterns of paths to exclude
+    :param respect_gitignore: exclude paths ignored by .gitignore files
     """
 
+    def __init__(self, *keys, exclude: list = None, respect_gitignore: bool = False):
+        super(FileHash, self).__init__(*keys)
+        self.exclude = list(exclude or [])
+        self.respect_gitignore = respect_gitignore
+        # compiled once, clones share them along with the gitignore files they parsed.
+        if self.exclude or respect_gitignore:
+            self.ignore = IgnoreRules(self.exclude, respect_gitignore)
+        else:
+            self.ignore = None
+
+    @property
+    def patterns(self):
+        """Returns paths without expanding wildcards."""
+        return super(FileHash, self).keys
+
     @property
     def keys(self):
         """Returns paths, expanding any wildcards into matches."""
@@ -109,9 +360,32 @@ class FileHash(MultiValueChecker):
         # files may be removed or created. This would cause a different set of
         # keys and a different filename. The filename should just be raw keys
         # and expand them below.
-        _keys = super(FileHash, self).keys
-        expanded = (glob(pattern) for pattern in _keys)
+        expanded = (glob(pattern) for pattern in self.patterns)
         return list(chain(*expanded))
 
+    def filename(self):
+        if self.ignore is None:
+            return super(FileHash, self).filename()
+        return hash_object(
+            {
+                "keys": self.keys,
+                "exclude": self.exclude,
+                "respect_gitignore": self.respect_gitignore,
+            }
+        )
+
+    def cache_key(self):
+        return super(FileHash, self).cache_key() + (
+            tuple(self.exclude),
+            self.respect_gitignore,
+        )
+
+    def clone(self):
+        clone = type(self)(
+            *self._keys, exclude=self.exclude, respect_gitignore=self.respect_gitignore
+        )
+        clone.ignore = self.ignore
+        return clone
+
     def state(self):
-        return hash_paths(*self.keys)
+        return hash_paths(*self.keys, ignore=self.ignore)
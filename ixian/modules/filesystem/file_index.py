@@ -0,0 +1,203 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import logging
+import os
+import threading
+
+from ixian import builder
+from ixian.config import CONFIG
+from ixian.utils.filesystem import FileLock
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_FILE = "file_index.json"
+
+# Seconds. A file modified this recently may be modified again within the timestamp resolution of
+# the filesystem without it's stat changing. It's hash isn't indexed until it's older.
+RACY_WINDOW = 2.0
+
+# Index for the current process, see `get_index`
+INDEX = None
+INDEX_KEY = None
+INDEX_LOCK = threading.Lock()
+
+
+def stat_key(stat: os.stat_result) -> list:
+    """Return the parts of a stat that change when a file is modified"""
+    return [
+        stat.st_dev,
+        stat.st_ino,
+        stat.st_mtime_ns,
+        stat.st_ctime_ns,
+        stat.st_size,
+        stat.st_mode,
+    ]
+
+
+class FileIndex:
+    """
+    Index of file hashes, similar to git's index. Each file's hash is stored with it's device,
+    inode, mtime, ctime, size and mode. When a file's stat matches the index it's hash is reused
+    instead of reading the file again.
+
+    A file modified within `RACY_WINDOW` seconds of being hashed isn't indexed. It's timestamps
+    may not change if it's modified again right away, it's hashed every time until it's older.
+
+    The index is loaded from `{BUILDER}/file_index.json` the first time it's used and saved by
+    `save`. Entries added by other ix processes in the meantime are kept. Entries for files under
+    a directory that was walked, see `walked`, that weren't looked up are removed. The files were
+    deleted or excluded.
+    """
+
+    def __init__(self):
+        self.entries = None
+        self.updated = {}
+        self.seen = set()
+        self.roots = set()
+        self.lock = threading.Lock()
+
+    def read(self) -> dict:
+        if not builder.exists(INDEX_FILE):
+            return {}
+        try:
+            return json.loads(builder.read(INDEX_FILE))
+        except ValueError:
+            logger.warning(f"Ignoring invalid file index: {builder.get_path(INDEX_FILE)}")
+            return {}
+
+    def load(self) -> dict:
+        """Load the index, the first time it's called"""
+        if self.entries is None:
+            self.entries = self.read()
+        return self.entries
+
+    def get(self, path: str, stat: os.stat_result):
+        """
+        Return a file's indexed hash.
+
+        :param path: absolute path of the file
+        :param stat: current stat of the file
+        :return: hash, or None if the file isn't indexed or it changed
+        """
+        with self.lock:
+            self.seen.add(path)
+            entry = self.load().get(path, None)
+        if entry is not None and entry[:-1] == stat_key(stat):
+            return entry[-1]
+        return None
+
+    def set(self, path: str, stat: os.stat_result, digest: str, started: float) -> None:
+        """
+        Index a file's hash.
+
+        :param path: absolute path of the file
+        :param stat: stat of the file from before it was hashed
+        :param digest: hash of the file
+        :param started: time hashing started, from `time.time()`
+        """
+        modified = max(stat.st_mtime_ns, stat.st_ctime_ns) / 1e9
+        if started - modified < RACY_WINDOW:
+            return
+        try:
+            # the file may have been modified while it was hashed.
+            if stat_key(os.stat(path)) != stat_key(stat):
+                return
+        except OSError:
+            return
+
+        entry = stat_key(stat) + [digest]
+        with self.lock:
+            self.load()[path] = entry
+            self.updated[path] = entry
+
+    def walked(self, directory: str) -> None:
+        """
+        Record that every file in a directory and it's subdirectories was looked up.
+
+        :param directory: absolute path of the directory
+        """
+        with self.lock:
+            self.roots.add(directory)
+
+    def stale(self, entries: dict) -> list:
+        """
+        Return paths of entries in walked directories that weren't looked up since the last save.
+
+        :param entries: entries to check
+        :return: list of paths
+        """
+        if not self.roots:
+            return []
+        found = []
+        for path in entries:
+            if path in self.seen or path in self.updated:
+                continue
+            parent = os.path.dirname(path)
+            while parent not in self.roots:
+                grandparent = os.path.dirname(parent)
+                if grandparent == parent:
+                    break
+                parent = grandparent
+            else:
+                found.append(path)
+        return found
+
+    def save(self) -> None:
+        """Save entries added since the index was last saved and remove stale entries"""
+        with self.lock:
+            if not self.updated and not self.stale(self.entries or {}):
+                return
+            lock = FileLock(builder.get_path(f"{INDEX_FILE}.lock"))
+            lock.acquire()
+            try:
+                # merge with entries other processes saved.
+                entries = self.read()
+                entries.update(self.updated)
+                for path in self.stale(entries):
+                    del entries[path]
+                builder.write(INDEX_FILE, json.dumps(entries))
+            finally:
+                lock.release()
+            self.entries = entries
+            self.updated = {}
+            self.seen = set()
+            self.roots = set()
+
+
+def get_index() -> FileIndex:
+    """
+    Return the index for the current BUILDER. The index is created the first time it's needed and
+    replaced if BUILDER or the process changes.
+
+    :return: FileIndex instance
+    """
+    global INDEX, INDEX_KEY
+    key = (CONFIG.BUILDER, os.getpid())
+    with INDEX_LOCK:
+        if INDEX_KEY != key:
+            INDEX = FileIndex()
+            INDEX_KEY = key
+        return INDEX
+
+
+def save_index() -> None:
+    """Save the index if it was used by this process"""
+    with INDEX_LOCK:
+        index = INDEX if INDEX_KEY is not None and INDEX_KEY[1] == os.getpid() else None
+    if index is not None:
+        index.save()
@@ -0,0 +1,278 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import logging
+import os
+import re
+import threading
+
+
+logger = logging.getLogger(__name__)
+
+
+GITIGNORE = ".gitignore"
+
+
+def translate(pattern: str) -> str:
+    """
+    Translate a gitignore style glob into a regex. `*` and `?` don't match `/`, `**` matches
+    any number of directories.
+
+    :param pattern: glob without leading `!` or trailing `/`
+    :return: regex string
+    """
+    parts = []
+    i, length = 0, len(pattern)
+    while i < length:
+        char = pattern[i]
+        if pattern.startswith("**/", i):
+            parts.append("(?:.*/)?")
+            i += 3
+        elif pattern.startswith("/**", i) and i + 3 == length:
+            parts.append("/.*")
+            i += 3
+        elif pattern.startswith("**", i):
+            parts.append(".*")
+            i += 2
+        elif char == "*":
+            parts.append("[^/]*")
+            i += 1
+        elif char == "?":
+            parts.append("[^/]")
+            i += 1
+        elif char == "[" and pattern.find("]", i + 2) != -1:
+            start, end = i + 1, pattern.find("]", i + 2)
+            chars = pattern[start:end].replace("\\", "\\\\")
+            if chars[0] == "!":
+                chars = "^" + chars[1:]
+            parts.append(f"[{chars}]")
+            i = end + 1
+        elif char == "\\" and i + 1 < length:
+            parts.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            parts.append(re.escape(char))
+            i += 1
+    return "(?s:{})\\Z".format("".join(parts))
+
+
+class Pattern:
+    """
+    A compiled gitignore style pattern.
+
+    Patterns without a `/` match names at any depth, e.g. `__pycache__` or `*.pyc`. Patterns
+    containing a `/` are relative to the directory they apply to, e.g. `docs/_build`. A trailing
+    `/` only matches directories and a leading `!` includes paths an earlier pattern excluded.
+
+    :param pattern: pattern to compile
+    """
+
+    def __init__(self, pattern: str):
+        self.pattern = pattern
+        self.negate = pattern.startswith("!")
+        if self.negate or pattern.startswith("\\"):
+            pattern = pattern[1:]
+        self.dir_only = pattern.endswith("/")
+        pattern = pattern.rstrip("/")
+        self.anchored = "/" in pattern
+        self.regex = re.compile(translate(pattern.lstrip("/")))
+
+    def __repr__(self):
+        return f"<Pattern {self.pattern}>"
+
+    def match(self, name: str, relative: str, is_dir: bool) -> bool:
+        """
+        :param name: name of the file or directory
+        :param relative: path relative to the directory the pattern applies to, None if the path
+            isn't in it
+        :param is_dir: True if the path is a directory
+        """
+        if self.dir_only and not is_dir:
+            return False
+        if self.anchored:
+            return relative is not None and self.regex.match(relative) is not None
+        return self.regex.match(name) is not None
+
+
+def parse(lines: list) -> list:
+    """
+    Compile patterns, skipping blank lines and comments.
+
+    :param lines: lines of a gitignore file or a list of patterns
+    :return: list of Patterns
+    """
+    patterns = []
+    for line in lines:
+        line = line.rstrip()
+        if line and not line.startswith("#"):
+            patterns.append(Pattern(line))
+    return patterns
+
+
+def last_match(patterns: list, path: str, name: str, is_dir: bool, base: str):
+    """
+    Return the last pattern matching a path, it decides whether the path is excluded.
+
+    :return: Pattern or None
+    """
+    if base is not None and path.startswith(base + os.sep):
+        offset = len(base) + 1
+        relative = path[offset:]
+    else:
+        relative = None
+    for pattern in reversed(patterns):
+        if pattern.match(name, relative, is_dir):
+            return pattern
+    return None
+
+
+class Scope:
+    """
+    The rules that apply within a directory while it's walked: the exclude patterns, relative to
+    the path being hashed, and any gitignore files of the directory and it's parents.
+
+    :param rules: IgnoreRules the scope belongs to
+    :param base: path exclude patterns are relative to, None if only names are matched
+    :param gitignores: list of (directory, patterns) of gitignore files, deepest last
+    """
+
+    def __init__(self, rules, base: str, gitignores: list):
+        self.rules = rules
+        self.base = base
+        self.gitignores = gitignores
+
+    def enter(self, directory: str, names) -> "Scope":
+        """
+        Return the scope for the contents of a directory.
+
+        :param directory: path of the directory
+        :param names: names of the directory's contents
+        """
+        if not self.rules.respect_gitignore or GITIGNORE not in names:
+            return self
+        patterns = self.rules.load(os.path.join(directory, GITIGNORE))
+        return Scope(self.rules, self.base, self.gitignores + [(directory, patterns)])
+
+    def ignored(self, path: str, name: str, is_dir: bool) -> bool:
+        """
+        Return True if a path is excluded. Exclude patterns take precedence over gitignore files.
+        Deeper gitignore files take precedence over their parents.
+
+        :param path: path in the directory
+        :param name: the path's name
+        :param is_dir: True if the path is a directory
+        """
+        pattern = last_match(self.rules.exclude, path, name, is_dir, self.base)
+        if pattern is not None and not pattern.negate:
+            return True
+        if not self.rules.respect_gitignore:
+            return False
+        if name == ".git":
+            return True
+        for directory, patterns in reversed(self.gitignores):
+            pattern = last_match(patterns, path, name, is_dir, directory)
+            if pattern is not None:
+                return not pattern.negate
+        return False
+
+
+class IgnoreRules:
+    """
+    Excludes paths while `FileHash` walks directories. Excluded directories are not walked.
+
+    Patterns are compiled once. Gitignore files are parsed the first time they are found and
+    reused until they change.
+
+    :param exclude: gitignore style patterns to exclude
+    :param respect_gitignore: also exclude paths ignored by `.gitignore` files and the
+        repository's `.git/info/exclude`
+    """
+
+    def __init__(self, exclude: list = None, respect_gitignore: bool = False):
+        self.exclude = parse(exclude or [])
+        self.respect_gitignore = respect_gitignore
+        self.gitignore_cache = {}
+        self.lock = threading.Lock()
+
+    def load(self, path: str) -> list:
+        """
+        Return the patterns in a gitignore file.
+
+        :param path: path of the file
+        :return: list of Patterns, empty if the file doesn't exist
+        """
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return []
+        key = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        with self.lock:
+            cached = self.gitignore_cache.get(path, None)
+        if cached is not None and cached[0] == key:
+            return cached[1]
+
+        try:
+            with open(path, encoding="utf-8", errors="replace") as file:
+                patterns = parse(file.read().splitlines())
+        except OSError as e:
+            logger.warning(f"Ignoring unreadable gitignore {path}: {e}")
+            patterns = []
+        with self.lock:
+            self.gitignore_cache[path] = (key, patterns)
+        return patterns
+
+    def parent_gitignores(self, directory: str) -> list:
+        """
+        Return the gitignore files that apply to a directory from it's parents, up to the root of
+        the git repository containing it, and the repository's `.git/info/exclude`. The directory
+        may be the root itself.
+
+        :param directory: absolute path of the directory
+        :return: list of (directory, patterns), deepest last
+        """
+        if not self.respect_gitignore:
+            return []
+        parents = []
+        root = directory
+        while not os.path.exists(os.path.join(root, ".git")):
+            parent = os.path.dirname(root)
+            if parent == root:
+                # not in a repository, only the gitignore files being walked apply.
+                return []
+            root = parent
+            parents.append(root)
+
+        gitignores = [(root, self.load(os.path.join(root, ".git", "info", "exclude")))]
+        for parent in reversed(parents):
+            gitignores.append((parent, self.load(os.path.join(parent, GITIGNORE))))
+        return gitignores
+
+    def scope(self, path: str) -> Scope:
+        """
+        Return the scope for walking a directory that is being hashed.
+
+        :param path: absolute path of the directory, exclude patterns are relative to it
+        """
+        return Scope(self, path, self.parent_gitignores(path))
+
+    def ignored(self, path: str, is_dir: bool) -> bool:
+        """
+        Return True if a path being hashed, e.g. a wildcard match, is excluded. Only patterns
+        without a `/` are matched against it.
+
+        :param path: absolute path
+        :param is_dir: True if the path is a directory
+        """
+        scope = Scope(self, None, self.parent_gitignores(path))
+        return scope.ignored(path, os.path.basename(path), is_dir)
@@ -0,0 +1,419 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import http.client
+import logging
+import os
+import re
+import shutil
+import tarfile
+import tempfile
+import threading
+import uuid
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlsplit
+
+from ixian.cache import remove
+from ixian.config import CONFIG
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 7891
+
+# Seconds to wait for the server before giving up on a request
+TIMEOUT = 30
+
+# Idle connections kept open to the server
+POOL_SIZE = 8
+
+CHUNK_SIZE = 1024 * 1024
+
+KEY_PATTERN = re.compile(r"^/cache/([A-Za-z0-9_-]+)$")
+
+
+class ConnectionPool:
+    """
+    Keep-alive HTTP connections to a server. Connections are reused by later requests, from any
+    thread, instead of connecting for each request.
+
+    :param url: url of the server, http or https
+    :param size: idle connections to keep
+    :param timeout: socket timeout in seconds
+    """
+
+    def __init__(self, url: str, size: int = POOL_SIZE, timeout: float = TIMEOUT):
+        parts = urlsplit(url)
+        if parts.scheme not in ("http", "https"):
+            raise ValueError(f"Unsupported remote cache url: {url}")
+        self.scheme = parts.scheme
+        self.host = parts.hostname
+        self.port = parts.port
+        self.prefix = parts.path.rstrip("/")
+        self.size = size
+        self.timeout = timeout
+        self.idle = []
+        self.lock = threading.Lock()
+
+    def connect(self) -> http.client.HTTPConnection:
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def acquire(self) -> (http.client.HTTPConnection, bool):
+        """
+        :return: tuple of a connection and True if it was reused
+        """
+        with self.lock:
+            if self.idle:
+                return self.idle.pop(), True
+        return self.connect(), False
+
+    def release(self, connection: http.client.HTTPConnection) -> None:
+        with self.lock:
+            if len(self.idle) < self.size:
+                self.idle.append(connection)
+                return
+        connection.close()
+
+    @contextmanager
+    def request(self, method: str, path: str, body=None, headers: dict = None):
+        """
+        Send a request and yield the response. The response is read to the end when the block
+        exits so the connection can be reused.
+
+        :param method: HTTP method
+        :param path: path, relative to the url's path
+        :param body: bytes or file to send
+        :param headers: request headers
+        :raises ConnectionError: if the server couldn't be reached
+        """
+        connection, reused = self.acquire()
+        try:
+            try:
+                connection.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                if not reused:
+                    raise
+                # the server may have closed the idle connection, try once more on a new one.
+                if hasattr(body, "seek"):
+                    body.seek(0)
+                connection = self.connect()
+                connection.request(method, self.prefix + path, body=body, headers=headers or {})
+                response = connection.getresponse()
+
+            yield response
+            response.read()
+        except http.client.HTTPException as e:
+            connection.close()
+            raise ConnectionError(f"Remote cache request failed: {e!r}")
+        except BaseException:
+            connection.close()
+            raise
+
+        if response.will_close:
+            connection.close()
+        else:
+            self.release(connection)
+
+    def close(self) -> None:
+        with self.lock:
+            idle, self.idle = self.idle, []
+        for connection in idle:
+            connection.close()
+
+
+class RemoteCache:
+    """
+    Client for a remote cache of task outputs, shared by many machines.
+
+    Outputs are stored as a gzipped tar archive per key with a simple HTTP protocol:
+
+        HEAD /cache/<key>   200 if the archive exists, 404 if it doesn't
+        GET  /cache/<key>   the archive
+        PUT  /cache/<key>   store the archive
+
+    `ix cache-server` is a reference server. Archive members are relative to `root` so they can
+    be restored in another checkout. Keys include the absolute paths checkers hash, so machines
+    only share outputs if the project is checked out at the same path.
+
+    :param url: url of the server, e.g. http://cache:7891
+    :param root: directory outputs are relative to, defaults to CONFIG.PWD
+    """
+
+    def __init__(self, url: str, root: str = None):
+        self.url = url
+        self.root = os.path.realpath(root or CONFIG.PWD)
+        self.pool = ConnectionPool(url)
+
+    def archive_names(self, outputs: list) -> list:
+        """
+        Return the names of outputs in the archive.
+
+        :raises ValueError: if an output isn't in `root`
+        """
+        names = []
+        for output in outputs:
+            # resolve the directory, not the output itself, it may be a symlink.
+            directory, basename = os.path.split(os.path.abspath(output))
+            name = os.path.relpath(os.path.join(os.path.realpath(directory), basename), self.root)
+            if name == os.curdir or name.startswith(os.pardir):
+                raise ValueError(f"Output isn't in {self.root}: {output}")
+            names.append(name)
+        return names
+
+    def exists(self, key: str) -> bool:
+        with self.pool.request("HEAD", f"/cache/{key}") as response:
+            if response.status not in (200, 404):
+                raise ConnectionError(f"Remote cache responded {response.status} to HEAD")
+            return response.status == 200
+
+    def store(self, key: str, outputs: list) -> bool:
+        """
+        Upload a task's outputs, unless the server already has them.
+
+        :param key: the task's hash
+        :param outputs: paths of files and directories the task created
+        :return: True if they were uploaded
+        """
+        names = self.archive_names(outputs)
+        if self.exists(key):
+            return False
+
+        with tempfile.TemporaryFile() as file:
+            with tarfile.open(fileobj=file, mode="w:gz") as archive:
+                for output, name in zip(outputs, names):
+                    archive.add(output, arcname=name)
+            size = file.tell()
+            file.seek(0)
+            headers = {"Content-Type": "application/gzip", "Content-Length": str(size)}
+            with self.pool.request("PUT", f"/cache/{key}", file, headers) as response:
+                if response.status not in (200, 201, 204):
+                    raise ConnectionError(f"Remote cache responded {response.status} to PUT")
+        return True
+
+    def restore(self, key: str, outputs: list) -> bool:
+        """
+        Download a task's outputs, replacing any existing files.
+
+        :param key: the task's hash
+        :param outputs: paths the task declares as outputs
+        :return: True if the outputs were restored, False if they aren't cached
+        """
+        names = self.archive_names(outputs)
+        with tempfile.TemporaryFile() as file:
+            with self.pool.request("GET", f"/cache/{key}") as response:
+                if response.status == 404:
+                    return False
+                if response.status != 200:
+                    raise ConnectionError(f"Remote cache responded {response.status} to GET")
+                shutil.copyfileobj(response, file, CHUNK_SIZE)
+            file.seek(0)
+
+            with tarfile.open(fileobj=file, mode="r:gz") as archive:
+                members = archive.getmembers()
+                self.validate(members, names)
+                for output in outputs:
+                    remove(output)
+                for member in members:
+                    self.extract(archive, member)
+        return True
+
+    def validate(self, members: list, names: list) -> None:
+        """
+        Check that an archive only contains the outputs.
+
+        :raises ValueError: if a member is outside of the outputs or isn't a regular file,
+            directory or link
+        """
+        found = set()
+        for member in members:
+            name = os.path.normpath(member.name)
+            if os.path.isabs(name) or name.startswith(os.pardir):
+                raise ValueError(f"Invalid path in remote cache archive: {member.name}")
+            if not any(name == output or name.startswith(output + os.sep) for output in names):
+                raise ValueError(f"Unexpected path in remote cache archive: {member.name}")
+            if not (member.isfile() or member.isdir() or member.issym() or member.islnk()):
+                raise ValueError(f"Unsupported file in remote cache archive: {member.name}")
+            if member.islnk():
+                # hard links point at another member
+                self.validate([tarfile.TarInfo(member.linkname)], names)
+            found.add(name)
+        missing = set(names) - found
+        if missing:
+            raise ValueError(f"Remote cache archive is missing {', '.join(sorted(missing))}")
+
+    def extract(self, archive: tarfile.TarFile, member: tarfile.TarInfo) -> None:
+        path = os.path.join(self.root, member.name)
+        # symlinks restored earlier must not redirect files out of root.
+        parent = os.path.realpath(os.path.dirname(path))
+        if parent != self.root and not parent.startswith(self.root + os.sep):
+            raise ValueError(f"Remote cache archive writes outside of {self.root}: {member.name}")
+        if hasattr(tarfile, "tar_filter"):
+            # members were validated, the filter is a second line of defense.
+            archive.extract(member, self.root, filter="tar")
+        else:
+            archive.extract(member, self.root)
+
+    def close(self) -> None:
+        self.pool.close()
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class CacheRequestHandler(BaseHTTPRequestHandler):
+    """Handles the protocol described by `RemoteCache`"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} {format % args}")
+
+    def archive_path(self):
+        match = KEY_PATTERN.match(self.path)
+        if not match:
+            self.respond(400)
+            return None
+        return os.path.join(self.server.cache.directory, f"{match.group(1)}.tar.gz")
+
+    def respond(self, status: int, size: int = 0) -> None:
+        self.send_response(status)
+        self.send_header("Content-Length", str(size))
+        if size:
+            self.send_header("Content-Type", "application/gzip")
+        self.end_headers()
+
+    def do_HEAD(self):
+        path = self.archive_path()
+        if path is None:
+            return
+        if os.path.exists(path):
+            self.respond(200, os.path.getsize(path))
+        else:
+            self.respond(404)
+
+    def do_GET(self):
+        path = self.archive_path()
+        if path is None:
+            return
+        try:
+            file = open(path, "rb")
+        except FileNotFoundError:
+            self.respond(404)
+            return
+        with file:
+            self.respond(200, os.fstat(file.fileno()).st_size)
+            shutil.copyfileobj(file, self.wfile, CHUNK_SIZE)
+        # mark as recently used
+        os.utime(path)
+
+    def do_PUT(self):
+        path = self.archive_path()
+        if path is None:
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.respond(411)
+            return
+
+        remaining = int(length)
+        temp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+        try:
+            with open(temp_path, "xb") as file:
+                while remaining:
+                    chunk = self.rfile.read(min(remaining, CHUNK_SIZE))
+                    if not chunk:
+                        raise ConnectionError("Client disconnected during upload")
+                    file.write(chunk)
+                    remaining -= len(chunk)
+            os.replace(temp_path, path)
+        finally:
+            if os.path.exists(temp_path):
+                os.unlink(temp_path)
+        self.respond(201)
+        self.server.cache.evict()
+
+
+class CacheServer:
+    """
+    Reference server for `RemoteCache`. Archives are stored as files in `directory`. When they
+    exceed `max_size` bytes the least recently used archives are removed.
+
+    There is no authentication, only listen on trusted networks.
+
+    :param directory: directory to store archives in
+    :param host: interface to listen on
+    :param port: port to listen on
+    :param max_size: size limit in bytes, None is unlimited
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        host: str = DEFAULT_HOST,
+        port: int = DEFAULT_PORT,
+        max_size: int = None,
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.evict_lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.server = ThreadingHTTPServer((host, port), CacheRequestHandler)
+        self.server.cache = self
+
+    @property
+    def address(self) -> tuple:
+        return self.server.server_address[:2]
+
+    def evict(self) -> None:
+        if self.max_size is None:
+            return
+        with self.evict_lock:
+            archives = []
+            for entry in os.scandir(self.directory):
+                if entry.name.endswith(".tar.gz"):
+                    stat = entry.stat()
+                    archives.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            size = 0
+            for _, archive_size, path in sorted(archives, reverse=True):
+                size += archive_size
+                if size > self.max_size:
+                    logger.debug(f"Evicting {path}")
+                    os.unlink(path)
+
+    def serve_forever(self) -> None:
+        logger.info("Cache server listening on {}:{}".format(*self.address))
+        self.server.serve_forever()
+
+    async def serve(self) -> None:
+        """Serve requests until cancelled"""
+        loop = asyncio.get_event_loop()
+        serving = loop.run_in_executor(None, self.serve_forever)
+        try:
+            await serving
+        finally:
+            self.close()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
@@ -27,13 +27,15 @@ import types
 import sys
 from collections import defaultdict
 
+from ixian import distributed, scheduler
 from ixian.config import CONFIG
 from ixian.module import load_module
 from ixian.utils import filesystem as file_utils
-from ixian.exceptions import AlreadyComplete, ExecuteFailed
-from ixian.task import TASKS, TaskRunner
-from ixian.utils.color_codes import RED, ENDC
+from ixian.exceptions import AlreadyComplete, DependencyCycle, ExecuteFailed
+from ixian.task import TASKS, TaskRunner, execute, plan
+from ixian.utils.color_codes import RED, ENDC, GRAY, OK_GREEN
 from ixian.utils.decorators import classproperty
+from ixian.utils.output import OUTPUT_MODES, STREAM
 
 
 logger = logging.getLogger(__name__)
@@ -48,6 +50,7 @@ class ExitCodes(Enum):
     ERROR_NO_INIT = -3  # ixian.py does not contain an init flag
     ERROR_NO_IXIAN_PY = -4  # ixian.py does not exist
     ERROR_TASK = -5  # task did not complete
+    ERROR_STALE = -6  # --plan found tasks that would run
 
     @classproperty
     def errors(cls):
@@ -68,6 +71,7 @@ class ExitCodes(Enum):
             cls.ERROR_UNKNOWN_TASK,
             cls.ERROR_COMPLETE,
             cls.ERROR_TASK,
+            cls.ERROR_STALE,
         ]
 
     @property
@@ -154,6 +158,28 @@ def build_epilog() -> str:
     return output.getvalue()
 
 
+def render_plan(nodes: list) -> str:
+    """
+    Render the result of `plan` as a list of tasks in the order they would run.
+
+    Targets without a func are left out, they don't run anything themselves.
+
+    :param nodes: nodes returned by `plan`
+    :return: plan text
+    """
+    nodes = [node for node in nodes if node.runner.func]
+    output = io.StringIO()
+    output.write("PLAN\n")
+    padding = max((len(node.name) for node in nodes), default=0)
+    for node in nodes:
+        if node.outcome == scheduler.COMPLETE:
+            icon = OK_GREEN + "✔" + ENDC
+        else:
+            icon = GRAY + "○" + ENDC
+        output.write(f"  {icon} {node.name.ljust(padding)}    {node.reason}\n")
+    return output.getvalue()
+
+
 def init_logging() -> None:
     """Initialize logging system."""
     args = parse_args()
@@ -189,7 +215,53 @@ def get_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "--clean-all", help="clean all dependencies before running task", action="store_true",
     )
-    parser.add_argument("remainder", nargs=argparse.REMAINDER, help="arguments for task.")
+    parser.add_argument(
+        "--jobs",
+        "-j",
+        type=int,
+        help="number of tasks to run in parallel, 0 for one per cpu",
+        default=1,
+    )
+    parser.add_argument(
+        "--timeout",
+        type=float,
+        metavar="SECONDS",
+        help="seconds a task may run before it fails",
+    )
+    parser.add_argument(
+        "--output",
+        choices=OUTPUT_MODES,
+        default=STREAM,
+        help="prefix: prefix output lines with the task name",
+    )
+    parser.add_argument(
+        "--keep-going",
+        "-k",
+        help="keep running tasks that don't depend on a failed task",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--plan",
+        help="show which tasks would run and why, without running them",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--watch", help="re-run tasks when the files they hash change", action="store_true",
+    )
+    parser.add_argument(
+        "--daemon", help="serve commands from a resident process", action="store_true",
+    )
+    parser.add_argument(
+        "--workers",
+        type=distributed.parse_addresses,
+        metavar="HOST:PORT,...",
+        help="run tasks on workers started with `ix worker`",
+    )
+    parser.add_argument(
+        "remainder",
+        nargs=argparse.REMAINDER,
+        help="tasks to run, then -- and arguments for tasks.",
+    )
     return parser
 
 
@@ -200,8 +272,17 @@ DEFAULT_ARGS = {
     "force_all": False,
     "log": "DEBUG",
     "task": "help",
+    "targets": None,
     "task_args": None,
     "help": False,
+    "jobs": 1,
+    "timeout": None,
+    "output": STREAM,
+    "keep_going": False,
+    "plan": False,
+    "watch": False,
+    "daemon": False,
+    "workers": None,
 }
 
 
@@ -213,12 +294,25 @@ def parse_args(args: List[str] = None) -> dict:
     compiled_args.update(parsed_args.__dict__)
     remainder = compiled_args.pop("remainder")
 
-    if remainder:
-        compiled_args["task"] = remainder[0]
-        compiled_args["task_args"] = remainder[1:]
+    if remainder and remainder[0] == "--":
+        remainder = remainder[1:]
+
+    separator = remainder.index("--") if "--" in remainder else 0
+    before = remainder[:separator]
+    if before and "help" not in before and all(arg in TASKS for arg in before):
+        # tasks before the separator are targets, everything after it is passed to the tasks.
+        # help is only ever run on it's own.
+        targets = before
+        task_args = remainder[separator + 1 :]  # noqa: E203
     else:
-        compiled_args["task"] = "help"
-        compiled_args["task_args"] = []
+        # the first arg is the task and the rest, including any --, are it's args. e.g. a task
+        # proxying another command: ix npm run build -- --watch
+        targets = remainder[:1]
+        task_args = remainder[1:]
+
+    compiled_args["targets"] = targets or ["help"]
+    compiled_args["task"] = compiled_args["targets"][0]
+    compiled_args["task_args"] = task_args
 
     compiled_args["log"] = compiled_args["log"]
 
@@ -231,6 +325,7 @@ def parse_args(args: List[str] = None) -> dict:
         if compiled_args["task"] and compiled_args["task"] != "help":
             compiled_args["task_args"] = [compiled_args["task"]]
         compiled_args["task"] = "help"
+        compiled_args["targets"] = ["help"]
 
     return compiled_args
 
@@ -243,6 +338,17 @@ optional arguments:
   --force-all  force execution including task dependencies
   --clean      clean before running task
   --clean-all  clean all dependencies before running task
+  --jobs N     number of tasks to run in parallel, 0 for one per cpu
+  --timeout N  seconds a task may run before it fails
+  --output     prefix: prefix output lines with the task name
+  --keep-going keep running tasks that don't depend on a failed task
+  --plan       show which tasks would run and why, without running them
+  --watch      re-run tasks when the files they hash change
+  --daemon     serve commands from a resident process
+  --workers    run tasks on workers started with `ix worker`
+
+positional arguments:
+  remainder    tasks to run, then -- and arguments for tasks.
 
 Type ix help <subcommand>' for help on a specific subcommand.
 """
@@ -292,7 +398,9 @@ def run() -> ExitCodes:
 
     # parse args - manually grab from sys.argv so mock_cli can mock it.
     args = parse_args(sys.argv[1:])
-    task_name = args.pop("task")
+    args.pop("task")
+    args.pop("daemon")
+    targets = args.pop("targets")
     task_args = args.pop("task_args")
     formatted_task_args = [CONFIG.format(arg) for arg in task_args]
 
@@ -300,18 +408,41 @@ def run() -> ExitCodes:
     #       as modules load. Dynamic loading like that is more complex
     load_environment()
 
-    task = resolve_task(task_name)
-    if not task:
+    # duplicate targets only run once
+    tasks = [resolve_task(name) for name in dict.fromkeys(targets)]
+    if not all(tasks):
         return ExitCodes.ERROR_UNKNOWN_TASK
 
+    if args.pop("plan"):
+        try:
+            nodes = plan(tasks, **args)
+        except DependencyCycle as e:
+            logger.error(str(e))
+            return ExitCodes.ERROR_TASK
+        print(render_plan(nodes), end="")
+        if any(node.outcome == scheduler.RAN and node.runner.func for node in nodes):
+            return ExitCodes.ERROR_STALE
+        return ExitCodes.SUCCESS
+
     try:
-        task.execute(formatted_task_args, **args)
+        if args.pop("watch"):
+            from ixian.watch import watch
+
+            watch(tasks, formatted_task_args, **args)
+        elif len(tasks) == 1:
+            tasks[0].execute(formatted_task_args, **args)
+        else:
+            # targets share a single graph so common dependencies are only checked and run once.
+            execute(tasks, formatted_task_args, **args)
     except AlreadyComplete:
         logger.warning("Already complete. Override with --force or --force-all")
         return ExitCodes.ERROR_COMPLETE
-    except ExecuteFailed as e:
+    except (ExecuteFailed, DependencyCycle) as e:
         logger.error(str(e))
         return ExitCodes.ERROR_TASK
+    except KeyboardInterrupt:
+        # running tasks were interrupted and have stopped.
+        return ExitCodes.ERROR_TASK
 
     return ExitCodes.SUCCESS
 
@@ -326,6 +457,16 @@ def cli() -> None:
     """
     Main entry point into the command line interface.
     """
+    from ixian import daemon
+
+    if parse_args(sys.argv[1:])["daemon"]:
+        exit_with_code(daemon.serve())
+
+    # forward to a running daemon. It's already initialized.
+    forwarded_code = daemon.forward(sys.argv[1:])
+    if forwarded_code is not None:
+        sys.exit(forwarded_code)
+
     init_code = init()
     if init_code.is_error:
         exit_with_code(init_code)
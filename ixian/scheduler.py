@@ -0,0 +1,1034 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from importlib import import_module
+
+from ixian import builder, distributed, remote_cache
+from ixian.cache import MissingOutput, OutputCache
+from ixian.check.checker import hash_object, state_cache
+from ixian.check.store import get_store
+from ixian.config import CONFIG
+from ixian.exceptions import AlreadyComplete, ExecuteFailed, TaskTimeout
+from ixian.graph import Graph
+from ixian.modules.filesystem.file_index import save_index
+from ixian.utils.output import PREFIX, STREAM, Multiplexer, TaskOutput
+from ixian.utils.filesystem import FileLock
+from ixian.utils.process import ProcessGroup, run_in_group
+
+
+logger = logging.getLogger(__name__)
+
+
+# Outcomes of executing a node
+RAN = "ran"
+COMPLETE = "complete"
+FAILED = "failed"
+BLOCKED = "blocked"
+
+# Executors a task's func may run on
+THREAD = "thread"
+PROCESS = "process"
+EXECUTORS = (THREAD, PROCESS)
+
+# File in BUILDER that records how long each task took the last time it ran
+DURATIONS_FILE = "durations.json"
+
+# Directory in BUILDER with a lock file for each task, see `Scheduler.lock`
+LOCKS_DIR = "locks"
+
+# Seconds between attempts to acquire a task's lock while another process holds it
+LOCK_INTERVAL = 0.1
+
+# Signals that stop a run like SIGINT. They're passed on to running subprocesses.
+TERMINATE_SIGNALS = (signal.SIGTERM, signal.SIGHUP)
+
+
+def get_jobs(jobs: int = None) -> int:
+    """
+    Return the number of tasks that may run at once. A value less than 1 means one task per CPU.
+
+    :param jobs: requested number of jobs
+    :return: number of jobs
+    """
+    if jobs is None:
+        return 1
+    if jobs < 1:
+        return os.cpu_count() or 1
+    return jobs
+
+
+class Node:
+    """
+    A task in the execution graph.
+
+    name - name of the task
+    runner - TaskRunner for the task
+    clean - run the task's clean function before executing
+    force - skip the task's checkers
+    args - args passed to the task's func
+    dependencies - nodes that must finish before this node runs
+    dependents - nodes waiting on this node
+    index - position of the node in the graph's topological order
+    priority - estimated seconds from the start of this node until the graph finishes
+    duration - seconds the node's func took, if it ran
+    error - exception raised by the node, if it failed
+    resources - resources the node holds while it runs
+    reason - why the node would run, set by `plan`
+    processes - subprocesses started by the node's func
+    checks - the node's cloned checkers and futures of their checks, see `submit_checks`
+    """
+
+    def __init__(self, name, runner, clean=False, force=False, args=None):
+        self.name = name
+        self.runner = runner
+        self.clean = clean
+        self.force = force
+        self.args = args or []
+        self.dependencies = []
+        self.dependents = []
+        self.index = 0
+        self.priority = 0
+        self.duration = None
+        self.waiting = 0
+        self.outcome = None
+        self.error = None
+        self.resources = {}
+        self.reason = None
+        self.return_value = None
+        self.processes = ProcessGroup()
+        self.checks = None
+
+    def __repr__(self):
+        return f"<{type(self).__name__} {self.name}>"
+
+    def __lt__(self, other):
+        # ready nodes with the longest critical path start first, ties use the topological order
+        return (-self.priority, self.index) < (-other.priority, other.index)
+
+
+def build_nodes(graph: Graph, clean_root, force_root, clean_all, force_all, args=None) -> list:
+    """
+    Build execution nodes from a task graph.
+
+    Root nodes use the root options, all other nodes use the `_all` options. Each node's index
+    is it's position in the graph's topological order. Ready nodes start in order of priority,
+    see `prioritize`, the index breaks ties.
+
+    :param graph: task graph
+    :return: list of nodes in reverse topological order, roots before their dependencies
+    """
+    from ixian.task import TASKS
+
+    nodes = {}
+    for index, name in enumerate(graph.order()):
+        if name in graph.roots:
+            node = Node(name, TASKS[name], clean_root, force_root, args)
+        else:
+            node = Node(name, TASKS[name], clean_all, force_all)
+        node.index = index
+        for dependency in graph.dependencies[name]:
+            node.dependencies.append(nodes[dependency])
+            nodes[dependency].dependents.append(node)
+        nodes[name] = node
+
+    return list(reversed(list(nodes.values())))
+
+
+def load_durations() -> dict:
+    """
+    Load task durations recorded by previous runs.
+
+    :return: dict of task name to seconds
+    """
+    if not builder.exists(DURATIONS_FILE):
+        return {}
+    try:
+        return json.loads(builder.read(DURATIONS_FILE))
+    except ValueError:
+        logger.warning(f"Ignoring invalid durations file: {builder.get_path(DURATIONS_FILE)}")
+        return {}
+
+
+def save_durations(nodes: list) -> None:
+    """
+    Record the duration of each node that ran. Durations recorded by other ix processes in the
+    meantime are kept.
+
+    :param nodes: nodes from this run
+    """
+    ran = {node.name: node.duration for node in nodes if node.duration is not None}
+    if not ran:
+        return
+    lock = FileLock(builder.get_path(f"{DURATIONS_FILE}.lock"))
+    lock.acquire()
+    try:
+        durations = load_durations()
+        durations.update(ran)
+        builder.write(DURATIONS_FILE, json.dumps(durations, sort_keys=True, indent=2))
+    finally:
+        lock.release()
+
+
+def prioritize(nodes: list, durations: dict) -> None:
+    """
+    Set each node's priority to the length of it's critical path: the node's own estimated
+    duration plus the longest path through the nodes that depend on it.
+
+    The estimate is the duration recorded the last time the task ran, or the task's static
+    `weight` if it has no history.
+
+    :param nodes: nodes in reverse topological order
+    :param durations: dict of task name to seconds
+    """
+    for node in nodes:
+        estimate = durations.get(node.name, node.runner.weight) if node.runner.func else 0
+        remaining = max((dependent.priority for dependent in node.dependents), default=0)
+        node.priority = estimate + remaining
+
+
+def pool_processes(pool: ProcessPoolExecutor) -> list:
+    """Return the worker processes of a process pool, ProcessPoolExecutor doesn't expose them"""
+    return list((getattr(pool, "_processes", None) or {}).values())
+
+
+def execute_in_process(config: dict, class_path: str, name: str, args: list, force: bool):
+    """
+    Run a task's func inside a process pool worker.
+
+    Workers are spawned, they don't inherit the task registry. The task's class is imported and
+    registered before it's run.
+
+    :param config: CONFIG snapshot from the parent process
+    :param class_path: dot path to the task's class
+    :param name: name of the task
+    :param args: args for the task's func
+    :param force: value of force for the task
+    :return: return value of the task's func
+    """
+    from ixian.task import TASKS
+
+    CONFIG.restore(config)
+    if name not in TASKS:
+        module_path, class_name = class_path.rsplit(".", 1)
+        getattr(import_module(module_path), class_name)()
+
+    runner = TASKS[name]
+    runner.task.__task__.force = force
+    return_value = runner.func(*args)
+    if asyncio.iscoroutine(return_value):
+        loop = asyncio.new_event_loop()
+        try:
+            return_value = loop.run_until_complete(return_value)
+        finally:
+            loop.close()
+    return return_value
+
+
+class Scheduler:
+    """
+    Executes a graph of nodes. Nodes are started as soon as all of their dependencies have
+    finished. Up to `jobs` nodes run at once.
+
+    The scheduler runs on a single event loop. Tasks with an `async def execute` run directly on
+    the loop, other tasks are bridged onto it with `run_in_executor`: thread tasks use a thread
+    pool and process tasks use a process pool.
+
+    Checkers of every node are submitted to a separate pool of `check_workers` threads when the
+    run starts, so hashing happens concurrently and ahead of the nodes that need it. A node waits
+    for it's own checks once it's dependencies have finished. Checks may be evaluated before a
+    dependency runs, but a node whose dependency ran runs regardless of it's checks.
+
+    Tasks may declare `resources`. Capacities come from `CONFIG.RESOURCES`, a node only starts
+    when it's resources are free. Ready nodes that don't fit wait while lower priority nodes that
+    do fit are started.
+
+    Tasks named in `complete` are already known to be complete, e.g. from watching their files.
+    They are skipped without evaluating their checks as long as their dependencies are complete.
+
+    Given `workers`, funcs run on remote workers instead, see `ixian.distributed`. Each worker
+    runs one node at a time so `jobs` is the number of workers. Checks and clean functions still
+    run locally.
+
+    A node fails if it runs longer than it's task's `timeout`, or the scheduler's `timeout` if the
+    task doesn't have one. The subprocesses it started are killed and it's checkers aren't saved.
+    Threads can't be stopped, the task's func is left to return on it's own once it's subprocesses
+    are gone. Coroutine tasks are cancelled. Process tasks are stopped by terminating the process
+    pool's workers.
+
+    If a node raises, no new nodes are started. Nodes already running are allowed to finish and
+    then the first error is raised. If the node timed out the running nodes are cancelled instead.
+    With `keep_going` a failure only blocks the nodes that depend on it, every other node still
+    runs. The failures are collected and reported at the end.
+
+    With `output="prefix"` the output of subprocesses started with `process.execute` is captured
+    and written with each line prefixed by the task's name. The output of a task that fails is
+    written again in one block.
+
+    Subprocesses of nodes with a timeout, or run with more than one job or prefixed output, run
+    in their own sessions so they can be killed with their children. They don't receive the
+    terminal's SIGINT, on KeyboardInterrupt the scheduler sends it to them and waits for running
+    nodes to stop. Other subprocesses keep the terminal like commands run outside of ix, e.g. so
+    interactive commands can prompt. SIGTERM and SIGHUP stop the run the same way, the
+    subprocesses are sent the signal ix received.
+
+    Tasks with `outputs` and checkers have their outputs stored in an `OutputCache` after they
+    run. A node that would run restores it's outputs from the cache instead, if they were cached
+    with the same inputs. Forced nodes always run. Given CONFIG.REMOTE_CACHE, outputs are also
+    uploaded to and restored from a `RemoteCache` shared with other machines.
+
+    Many `ix` processes may share a BUILDER. A node holds a lock on it's task from before it's
+    checks are evaluated until it's checkers are saved. If another process holds the lock the node
+    waits for it and then checks again, a task the other process completed is skipped.
+    """
+
+    def __init__(
+        self,
+        nodes: list,
+        jobs: int = 1,
+        keep_going: bool = False,
+        complete: set = None,
+        workers: list = None,
+        timeout: float = None,
+        output: str = STREAM,
+        check_workers: int = None,
+    ):
+        self.nodes = nodes
+        self.jobs = get_jobs(jobs)
+        self.workers = list(workers or [])
+        if self.workers:
+            self.jobs = len(self.workers)
+        self.idle_workers = list(self.workers)
+        self.timeout = timeout
+        self.output = output
+        self.multiplexer = None
+        self.keep_going = keep_going
+        self.complete = complete or set()
+        self.capacity = dict(CONFIG.RESOURCES)
+        self.in_use = defaultdict(int)
+        self.loop = None
+        self.signum = signal.SIGINT
+        self.thread_pool = None
+        self.check_workers = check_workers
+        self.check_pool = None
+        self._process_pool = None
+        self.process_futures = set()
+        self._output_cache = None
+        self._remote_cache = None
+
+    @property
+    def output_cache(self) -> OutputCache:
+        """Cache of task outputs. Created the first time it's used."""
+        if self._output_cache is None:
+            self._output_cache = OutputCache()
+        return self._output_cache
+
+    @property
+    def remote_cache(self):
+        """Client for CONFIG.REMOTE_CACHE, None if it isn't set"""
+        if self._remote_cache is None and CONFIG.REMOTE_CACHE:
+            self._remote_cache = remote_cache.RemoteCache(CONFIG.REMOTE_CACHE)
+        return self._remote_cache
+
+    @property
+    def process_pool(self) -> ProcessPoolExecutor:
+        """
+        Process pool for tasks with `executor = "process"`. Created the first time it's used.
+
+        Workers are spawned rather than forked. Other threads may hold locks while a worker is
+        forked, the worker would deadlock acquiring them. Python 3.6 can't choose how the pool
+        starts workers, they're forked with the platform default.
+        """
+        if self._process_pool is None:
+            kwargs = {}
+            if sys.version_info >= (3, 7):
+                kwargs["mp_context"] = multiprocessing.get_context("spawn")
+            self._process_pool = ProcessPoolExecutor(max_workers=self.jobs, **kwargs)
+        return self._process_pool
+
+    def kill_process_pool(self) -> None:
+        """
+        Terminate the process pool's workers. A process task that timed out can't be stopped
+        otherwise, shutting down the pool would wait for it. Other process tasks running on the
+        pool fail too. A new pool is created the next time one is needed.
+        """
+        pool, self._process_pool = self._process_pool, None
+        if pool is None:
+            return
+        # tasks waiting for a worker fail instead of starting.
+        for future in list(self.process_futures):
+            future.cancel()
+        for process in pool_processes(pool):
+            process.terminate()
+        pool.shutdown(wait=False)
+
+    def requested_resources(self, node: Node) -> dict:
+        """
+        Return the resources a node holds while it runs. Resources without a configured capacity
+        are unlimited and ignored. Requests larger than the capacity are reduced to the capacity,
+        otherwise the node could never start.
+
+        :param node: node to get resources for
+        :return: dict of resource name to amount
+        """
+        resources = {}
+        for name, amount in node.runner.resources.items():
+            if name not in self.capacity:
+                continue
+            if amount > self.capacity[name]:
+                logger.warning(
+                    f"{node.name} requests {amount} {name} but only {self.capacity[name]} is "
+                    f"available, limiting it to {self.capacity[name]}"
+                )
+                amount = self.capacity[name]
+            resources[name] = amount
+        return resources
+
+    def fits(self, node: Node) -> bool:
+        """Return True if all of the node's resources are free"""
+        return all(
+            self.in_use[name] + amount <= self.capacity[name]
+            for name, amount in node.resources.items()
+        )
+
+    def acquire(self, node: Node) -> None:
+        for name, amount in node.resources.items():
+            self.in_use[name] += amount
+
+    def release_resources(self, node: Node) -> None:
+        for name, amount in node.resources.items():
+            self.in_use[name] -= amount
+
+    def run_in_thread(self, func, *args):
+        """Run a blocking function on the thread pool"""
+        return self.loop.run_in_executor(self.thread_pool, partial(func, *args))
+
+    async def call(self, node: Node):
+        """
+        Call the node's func on the executor the task requested. Process tasks are sent to the
+        process pool along with a snapshot of CONFIG.
+
+        :param node: node to call
+        :return: return value of the func
+        """
+        runner = node.runner
+        if runner.executor == PROCESS:
+            task_class = type(runner.task)
+            future = self.process_pool.submit(
+                execute_in_process,
+                CONFIG.snapshot(),
+                f"{task_class.__module__}.{task_class.__name__}",
+                runner.name,
+                list(node.args),
+                node.force,
+            )
+            self.process_futures.add(future)
+            future.add_done_callback(self.process_futures.discard)
+            return await asyncio.wrap_future(future)
+
+        # set tasks force attribute so it's setup the same as if it were run directly.
+        runner.task.__task__.force = node.force
+        if asyncio.iscoroutinefunction(runner.func):
+            return await runner.func(*node.args)
+        return await self.run_in_thread(run_in_group, node.processes, runner.func, *node.args)
+
+    async def call_remote(self, node: Node) -> (object, list):
+        """
+        Call the node's func on an idle worker.
+
+        :param node: node to call
+        :return: tuple of the func's return value and the state of the task's checkers
+        """
+        # a worker is always idle: there are as many jobs as workers.
+        address = self.idle_workers.pop(0)
+        try:
+            return await distributed.run_remote(address, node)
+        finally:
+            self.idle_workers.append(address)
+
+    async def execute_node(self, node: Node) -> str:
+        """
+        Execute a single node once all of it's dependencies have finished.
+
+        Targets without a func are treated as having run. A node with a func is skipped only if
+        all of it's dependencies were complete and it's checkers pass.
+
+        :param node: node to execute
+        :return: RAN or COMPLETE
+        """
+        runner = node.runner
+        if not runner.func:
+            return RAN
+
+        dependencies_complete = all(
+            dependency.outcome == COMPLETE for dependency in node.dependencies
+        )
+        if dependencies_complete and node.name in self.complete and not node.force:
+            logger.debug(f"[skip] {node.name}, unchanged.")
+            return COMPLETE
+
+        lock = await self.lock(node)
+        try:
+            return await self.execute_locked(node, dependencies_complete)
+        finally:
+            lock.release()
+
+    async def lock(self, node: Node) -> FileLock:
+        """
+        Acquire the lock on a node's task, waiting for any other process that holds it.
+
+        If the lock was held the task may have been run by the other process in the meantime, the
+        node's checks are discarded so they're evaluated again with the saved state. Checks taken
+        before an uncontended lock are compared with the saved state in `execute_locked`.
+
+        :param node: node to lock
+        :return: the held lock
+        """
+        lock = FileLock(builder.get_path(f"{LOCKS_DIR}/{node.name}.lock"))
+        try:
+            if lock.acquire(blocking=False):
+                return lock
+            logger.info(f"[wait] {node.name} is running in another process")
+            # poll so waiting can be cancelled
+            while not lock.acquire(blocking=False):
+                await asyncio.sleep(LOCK_INTERVAL)
+        except BaseException:
+            lock.release()
+            raise
+
+        get_store().refresh()
+        invalidate_checkers(node.runner.checkers)
+        node.checks = None
+        return lock
+
+    async def execute_locked(self, node: Node, dependencies_complete: bool) -> str:
+        """
+        Execute a node while holding it's lock. The node is skipped if all of it's dependencies
+        were complete and it's checkers pass.
+
+        :param node: node to execute
+        :param dependencies_complete: True if none of the node's dependencies ran
+        :return: RAN or COMPLETE
+        """
+        runner = node.runner
+        checked_before_lock = node.checks is not None
+        if not checked_before_lock:
+            node.checks = submit_checks(self.check_pool, node)
+        checkers, futures = node.checks
+        results = await asyncio.gather(*(asyncio.wrap_future(future) for future in futures))
+        passes = bool(results) and all(results)
+        if dependencies_complete and futures and not passes and checked_before_lock:
+            # another process may have run the task after it was checked. The current state is
+            # cached, only the saved state is read again.
+            passes = await self.run_in_thread(recheck, checkers)
+        if dependencies_complete and passes:
+            if not outputs_missing(runner):
+                logger.debug(f"[skip] {node.name}, already complete.")
+                return COMPLETE
+            # outputs were deleted, restore or rebuild them.
+            logger.debug(f"[miss] {node.name}, outputs are missing.")
+
+        cache_key = None
+        if runner.outputs and runner.checkers:
+            if not dependencies_complete:
+                # dependencies that ran may have changed this task's inputs.
+                invalidate_checkers(checkers)
+            cache_key = await self.run_in_thread(output_cache_key, node)
+            if not node.force and await self.run_in_thread(self.restore_outputs, node, cache_key):
+                invalidate_checkers(checkers)
+                await self.run_in_thread(save_checkers, checkers)
+                return RAN
+
+        start = time.perf_counter()
+        call = self.call_remote(node) if self.workers else self.call(node)
+        timeout = runner.timeout or self.timeout
+        try:
+            result = await asyncio.wait_for(call, timeout)
+        except asyncio.TimeoutError:
+            node.processes.cancel()
+            if runner.executor == PROCESS and not self.workers:
+                self.kill_process_pool()
+            raise TaskTimeout(f"{node.name} timed out after {timeout}s")
+        finally:
+            # the task may have changed the files it's checkers look at.
+            invalidate_checkers(checkers)
+        node.duration = time.perf_counter() - start
+        node.return_value, state = result if self.workers else (result, None)
+        # save checker only after function has completed successfully. Save should be called even
+        # if force=True
+        if checkers:
+            await self.run_in_thread(save_checkers, checkers, state)
+        if cache_key:
+            await self.run_in_thread(self.store_outputs, node, cache_key)
+        logger.debug(f"[fini] {runner.name}")
+        return RAN
+
+    def restore_outputs(self, node: Node, key: str) -> bool:
+        """
+        Restore a node's outputs from the output cache.
+
+        :return: True if they were restored
+        """
+        outputs = node.runner.outputs
+        try:
+            if self.output_cache.restore(key, outputs):
+                logger.info(f"[cache] {node.name}, restored outputs.")
+                return True
+        except OSError as e:
+            logger.warning(f"Could not restore outputs of {node.name}: {e}")
+
+        if self.remote_cache is None:
+            return False
+        try:
+            if not self.remote_cache.restore(key, outputs):
+                return False
+        except (OSError, ValueError) as e:
+            logger.warning(f"Could not restore outputs of {node.name} from remote cache: {e}")
+            return False
+        logger.info(f"[cache] {node.name}, restored outputs from {self.remote_cache.url}.")
+        # keep a local copy
+        self.store_outputs(node, key, remote=False)
+        return True
+
+    def store_outputs(self, node: Node, key: str, remote: bool = True) -> None:
+        """
+        Store a node's outputs in the output cache, and the remote cache if there is one. Errors
+        are logged, the node still ran.
+
+        :param node: node that ran
+        :param key: key to store outputs under
+        :param remote: upload to the remote cache too
+        """
+        try:
+            self.output_cache.store(key, node.runner.outputs)
+        except (MissingOutput, OSError) as e:
+            logger.warning(f"Could not cache outputs of {node.name}: {e}")
+            return
+
+        if remote and self.remote_cache is not None:
+            try:
+                self.remote_cache.store(key, node.runner.outputs)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Could not upload outputs of {node.name} to remote cache: {e}")
+
+    def clean(self) -> None:
+        """Run clean functions, parents before their dependencies."""
+        for node in self.nodes:
+            runner = node.runner
+            if runner and runner.clean and node.clean:
+                logger.debug(f"Cleaning Task: {runner.clean}")
+                runner.clean()
+                invalidate_checkers(runner.checkers)
+
+    def run(self) -> None:
+        """
+        Run all nodes.
+        """
+        self.clean()
+
+        self.loop = asyncio.new_event_loop()
+        self.thread_pool = ThreadPoolExecutor(max_workers=self.jobs)
+        self.check_pool = ThreadPoolExecutor(max_workers=self.check_workers)
+        # dependencies first, they're needed first.
+        for node in reversed(self.nodes):
+            if node.runner.func and node.name not in self.complete:
+                node.checks = submit_checks(self.check_pool, node)
+        for node in self.nodes:
+            node.processes.isolate = self.isolates(node)
+        if self.output == PREFIX:
+            self.multiplexer = Multiplexer()
+            for node in self.nodes:
+                node.processes.output = TaskOutput(node.name, self.multiplexer)
+        main = self.loop.create_task(self._run())
+        handlers = self.handle_signals()
+        try:
+            self.loop.run_until_complete(main)
+        except KeyboardInterrupt:
+            logger.error("Interrupted, stopping running tasks.")
+            main.cancel()
+            self.loop.run_until_complete(asyncio.gather(main, return_exceptions=True))
+            raise
+        finally:
+            try:
+                # wait for threads to return
+                self.thread_pool.shutdown()
+            except KeyboardInterrupt:
+                # interrupted again, stop waiting for subprocesses to exit.
+                self.send_signal(signal.SIGKILL)
+                raise
+            finally:
+                self.cancel_checks()
+                if self._process_pool is not None:
+                    self._process_pool.shutdown()
+                    self._process_pool = None
+                if self.multiplexer is not None:
+                    self.multiplexer.close()
+                    self.multiplexer = None
+                if self._remote_cache is not None:
+                    self._remote_cache.close()
+                    self._remote_cache = None
+                for signum, handler in handlers.items():
+                    signal.signal(signum, handler)
+                self.loop.close()
+
+    def isolates(self, node: Node) -> bool:
+        """
+        Return True if a node's subprocesses should run in their own sessions. They're isolated
+        when they may have to be killed along with their children, or share the terminal.
+
+        :param node: node to check
+        :return: True if they're isolated
+        """
+        return bool(self.timeout or node.runner.timeout or self.jobs > 1 or self.output == PREFIX)
+
+    def handle_signals(self) -> dict:
+        """
+        Stop the run on SIGTERM or SIGHUP. Subprocesses may run in their own sessions, they'd be
+        left running if ix exited without signalling them. Handlers can only be set on the main
+        thread.
+
+        :return: dict of signal to the handler it replaced
+        """
+        self.signum = signal.SIGINT
+        if threading.current_thread() is not threading.main_thread():
+            return {}
+        return {signum: signal.signal(signum, self.terminate) for signum in TERMINATE_SIGNALS}
+
+    def terminate(self, signum: int, frame) -> None:
+        """Signal handler, interrupts the run. The signal is passed on to running subprocesses."""
+        logger.error(f"Received {signal.Signals(signum).name}.")
+        self.signum = signum
+        raise KeyboardInterrupt
+
+    def cancel_checks(self) -> None:
+        """Cancel checks that haven't started, e.g. for nodes that won't run after a failure"""
+        for node in self.nodes:
+            if node.checks is not None:
+                for future in node.checks[1]:
+                    future.cancel()
+        self.check_pool.shutdown()
+
+    def send_signal(self, signum: int) -> None:
+        """Send a signal to the subprocesses of every node"""
+        for node in self.nodes:
+            node.processes.send_signal(signum)
+
+    @staticmethod
+    async def cancel(running: dict, signum: int = signal.SIGKILL) -> None:
+        """
+        Cancel running nodes. Their subprocesses are sent `signum` and they may not start new ones.
+
+        :param running: dict of futures to running nodes
+        :param signum: signal to send to the subprocesses
+        """
+        for future, node in running.items():
+            node.processes.cancel(signum)
+            future.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+        running.clear()
+
+    async def _run(self) -> None:
+        """Start nodes as they become ready until the graph is finished"""
+        ready = []
+        for node in self.nodes:
+            node.resources = self.requested_resources(node)
+            node.waiting = len(node.dependencies)
+            if not node.waiting:
+                heapq.heappush(ready, node)
+
+        running = {}
+        error = None
+        while ready or running:
+            waiting_for_resources = []
+            while ready and len(running) < self.jobs:
+                node = heapq.heappop(ready)
+                if any(dep.outcome in (FAILED, BLOCKED) for dep in node.dependencies):
+                    # keep going: a dependency failed so this node can't run, nor can it's
+                    # dependents. Pass that on without using up a job.
+                    node.outcome = BLOCKED
+                    self.release(node, ready)
+                    continue
+                if not self.fits(node):
+                    waiting_for_resources.append(node)
+                    continue
+                self.acquire(node)
+                running[self.loop.create_task(self.execute_node(node))] = node
+            for node in waiting_for_resources:
+                heapq.heappush(ready, node)
+
+            if not running:
+                continue
+
+            try:
+                done, _ = await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            except asyncio.CancelledError:
+                # interrupted, pass it on to the subprocesses.
+                await self.cancel(running, self.signum)
+                raise
+            for future in done:
+                node = running.pop(future)
+                self.release_resources(node)
+                try:
+                    node.outcome = future.result()
+                except Exception as e:
+                    if node.processes.output is not None:
+                        node.processes.output.dump()
+                    if not self.keep_going:
+                        if error is None:
+                            error = e
+                        if isinstance(e, TaskTimeout):
+                            # the run is failing because something hung, don't wait for the rest.
+                            await self.cancel(running)
+                        continue
+                    logger.error(f"[fail] {node.name}: {e}")
+                    node.outcome = FAILED
+                    node.error = e
+
+                self.release(node, ready)
+
+            # fail fast: let running nodes finish but don't start anything new.
+            if error is not None:
+                ready.clear()
+
+        if error is not None:
+            raise error
+
+    @staticmethod
+    def release(node: Node, ready: list) -> None:
+        """Add dependents of a finished node to `ready` once they aren't waiting on anything"""
+        for dependent in node.dependents:
+            dependent.waiting -= 1
+            if not dependent.waiting:
+                heapq.heappush(ready, dependent)
+
+
+def summarize(nodes: list) -> str:
+    """
+    Summarize a run that had failures.
+
+    :param nodes: nodes from the run
+    :return: summary listing failed, blocked and skipped tasks
+    """
+    names = {FAILED: [], BLOCKED: [], COMPLETE: []}
+    for node in reversed(nodes):
+        if node.outcome in names:
+            names[node.outcome].append(node.name)
+
+    lines = [
+        f"{len(names[FAILED])} failed, {len(names[BLOCKED])} blocked, "
+        f"{len(names[COMPLETE])} skipped"
+    ]
+    for label, outcome in (("failed", FAILED), ("blocked", BLOCKED), ("skipped", COMPLETE)):
+        if names[outcome]:
+            lines.append(f"  {label}: {', '.join(names[outcome])}")
+    return "\n".join(lines)
+
+
+def invalidate_checkers(checkers: list) -> None:
+    """Remove checkers' cached state"""
+    for checker in checkers or []:
+        checker.invalidate()
+
+
+def outputs_missing(runner) -> bool:
+    """
+    Return True if any of the outputs a task declares doesn't exist.
+
+    :param runner: TaskRunner to check
+    :return: True if an output is missing
+    """
+    return not all(os.path.lexists(path) for path in runner.outputs)
+
+
+def recheck(checkers: list) -> bool:
+    """
+    Compare checkers' current state with freshly read saved state, e.g. after another process
+    saved it. The current state comes from the `state_cache`, it isn't calculated again.
+
+    :param checkers: checkers to compare
+    :return: True if all of them match
+    """
+    get_store().refresh()
+    return all(checker.cached_state() == checker.saved_state() for checker in checkers)
+
+
+def save_checkers(checkers: list, state: list = None) -> None:
+    """
+    Save checkers after their task has completed successfully.
+
+    :param checkers: checkers to save
+    :param state: state for each checker if the task ran on a worker
+    """
+    with get_store().transaction():
+        if state is None:
+            for checker in checkers:
+                checker.save()
+        else:
+            for checker, checker_state in zip(checkers, state):
+                checker.save(checker_state)
+
+
+def execute(runners: list, args=None, clean_root=False, force_root=False, **kwargs) -> list:
+    """
+    Execute tasks and their dependencies.
+
+    Ready tasks are started longest critical path first. How long each task takes is recorded so
+    the next run can use it.
+
+    :param runners: TaskRunners to execute
+    :param args: args for the root tasks
+    :param clean_root: clean the root tasks
+    :param force_root: force the root tasks
+    :param kwargs: `clean_all`, `force_all`, `jobs`, `keep_going`, `complete`, `workers`,
+        `timeout` and `output`
+    :raises ExecuteFailed: with a summary if any task failed in `keep_going` mode
+    :raises AlreadyComplete: if all of the root tasks were already complete
+    :return: return values of the root tasks' funcs
+    """
+    graph = Graph(runners)
+    nodes = build_nodes(
+        graph,
+        clean_root,
+        force_root,
+        kwargs.get("clean_all", False),
+        kwargs.get("force_all", False),
+        args,
+    )
+    prioritize(nodes, load_durations())
+    try:
+        with state_cache():
+            Scheduler(
+                nodes,
+                jobs=kwargs.get("jobs", 1),
+                keep_going=kwargs.get("keep_going", False),
+                complete=kwargs.get("complete", None),
+                workers=kwargs.get("workers", None),
+                timeout=kwargs.get("timeout", None),
+                output=kwargs.get("output", STREAM),
+            ).run()
+    finally:
+        save_durations(nodes)
+        save_index()
+
+    if any(node.outcome == FAILED for node in nodes):
+        raise ExecuteFailed(summarize(nodes))
+
+    nodes_by_name = {node.name: node for node in nodes}
+    roots = [nodes_by_name[runner.name] for runner in runners]
+    if all(root.outcome == COMPLETE for root in roots):
+        raise AlreadyComplete()
+    return [root.return_value for root in roots]
+
+
+def output_cache_key(node: Node) -> str:
+    """
+    Return the key a node's outputs are cached under: the task's hash, which combines the state
+    of it's checkers and dependencies, and the node's args.
+
+    :param node: node to get the key for
+    :return: cache key
+    """
+    return hash_object({"task": node.runner.hash(), "args": list(node.args)})
+
+
+def submit_checks(pool: Executor, node: Node) -> (list, list):
+    """
+    Start evaluating a node's checkers on a pool. Each checker is evaluated separately so a task
+    with many checkers is hashed concurrently too.
+
+    :param pool: pool to submit checks to
+    :param node: node to check
+    :return: tuple of the node's cloned checkers and futures of their checks. There are no
+        futures if the node is forced or it doesn't have checkers, it doesn't pass.
+    """
+    checkers = node.runner.clone_checkers()
+    if not checkers or node.force:
+        return checkers, []
+    return checkers, [pool.submit(checker.check) for checker in checkers]
+
+
+def check_nodes(nodes: list, workers: int = None) -> dict:
+    """
+    Evaluate the checks of every node concurrently on a thread pool. Checks are mostly file I/O
+    and hashing, which release the GIL, so the pool defaults to more threads than there are cpus.
+
+    :param nodes: nodes to check
+    :param workers: number of threads, defaults to the ThreadPoolExecutor default
+    :return: dict of node name to `(passes, checkers)`
+    """
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        submitted = {node.name: submit_checks(pool, node) for node in reversed(nodes)}
+
+    checks = {}
+    for name, (checkers, futures) in submitted.items():
+        results = [future.result() for future in futures]
+        checks[name] = (bool(results) and all(results), checkers)
+    return checks
+
+
+def plan(runners: list, clean_root=False, force_root=False, **kwargs) -> list:
+    """
+    Determine which tasks would run and why, without calling any funcs.
+
+    All checks are evaluated up front, concurrently. Outcomes are then resolved in topological
+    order using the same rules as `Scheduler.execute_node`: targets without a func always run,
+    other tasks run if they are forced, any dependency runs, or their checks fail.
+
+    :param runners: TaskRunners to plan
+    :param clean_root: clean the root tasks
+    :param force_root: force the root tasks
+    :param kwargs: `clean_all` and `force_all`
+    :return: list of nodes in topological order with `outcome` and `reason` set
+    """
+    nodes = build_nodes(
+        Graph(runners),
+        clean_root,
+        force_root,
+        kwargs.get("clean_all", False),
+        kwargs.get("force_all", False),
+    )
+    with state_cache():
+        checks = check_nodes(nodes)
+    save_index()
+
+    ordered = list(reversed(nodes))
+    for node in ordered:
+        ran = [dependency.name for dependency in node.dependencies if dependency.outcome == RAN]
+        node.outcome = RAN
+        if not node.runner.func:
+            node.reason = "virtual target"
+        elif node.force:
+            node.reason = "forced"
+        elif ran:
+            node.reason = f"{', '.join(ran)} will run"
+        elif not checks[node.name][0]:
+            node.reason = "checks failed" if node.runner.checkers else "no checks"
+        elif outputs_missing(node.runner):
+            node.reason = "outputs missing"
+        else:
+            node.outcome = COMPLETE
+            node.reason = "complete"
+    return ordered
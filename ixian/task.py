@@ -12,13 +12,17 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import asyncio
 import logging
+import os
 import typing
 
-from ixian.check.checker import hash_object
+from ixian import scheduler
+from ixian.check.checker import hash_object, state_cache
 from ixian.config import CONFIG
-from ixian.exceptions import AlreadyComplete
+from ixian.modules.filesystem.file_index import save_index
 from ixian.utils.color_codes import BOLD_WHITE, ENDC, GRAY, OK_GREEN
+from ixian.utils.output import STREAM
 
 
 logger = logging.getLogger(__name__)
@@ -40,6 +44,11 @@ class TaskRunner(object):
     description - long description for task
     parent - parent task (this task will be run first if it is run)
     children - tasks this task depends on (They will be run first)
+    executor - where func runs: "thread" (default) or "process"
+    weight - estimated run time in seconds, used for scheduling until a duration is recorded
+    resources - dict of resource name to amount the task holds while it runs
+    timeout - seconds the task may run before it's subprocesses are killed and it fails
+    outputs - files and directories the task creates, cached so they can be restored
     """
 
     checkers = None
@@ -57,9 +66,21 @@ class TaskRunner(object):
         parent=None,
         short_description=None,
         description=None,
+        executor=None,
+        weight=None,
+        resources=None,
+        timeout=None,
+        outputs=None,
     ):
         self.task = task
         self.func = func
+        self.executor = executor or scheduler.THREAD
+        if self.executor not in scheduler.EXECUTORS:
+            raise ValueError(f"Unknown executor for task {name}: {self.executor}")
+        self.weight = weight or 0
+        self.resources = resources or {}
+        self.timeout = timeout
+        self._outputs = outputs or []
         self._depends = depends or []
         self.category = category.upper() if category else None
         self.clean = clean
@@ -153,66 +174,18 @@ class TaskRunner(object):
         Tasks and dependency clean methods may be run by passing `clean=True`
         or `clean-all=False` as kwargs. Clean implies `force=True`.
 
+        Independent dependencies may run in parallel by passing `jobs=N` as
+        kwargs. Pass `keep_going=True` to keep running tasks that don't depend
+        on a failed task. Pass `workers=[(host, port)]` to run tasks on remote
+        workers. Pass `timeout=N` to fail tasks without their own `timeout`
+        that run longer than N seconds. Pass `output="prefix"` to prefix the
+        output of subprocesses with the task's name.
+
         :param args: args to pass through to the task
         :param kwargs: options for task execution
         :return: return value from task function
         """
-        clean_root = kwargs.get("clean", False)
-        clean_all = kwargs.pop("clean_all", False)
-        force_root = kwargs.pop("force", False)
-        force_all = kwargs.pop("force_all", False)
-
-        if clean_root:
-            force_root = True
-        if clean_all:
-            clean_root = True
-            force_all = True
-        if force_all:
-            force_root = True
-
-        # save force to task instance so it may be referenced downstream
-        # TODO: this should be passing in `force`
-        self.force = True
-
-        args_as_str = CONFIG.format(" ".join([str(arg) for arg in args]))
-        logger.debug(f"[exec] {self.name}({args_as_str}) force={force_root} clean={clean_root}")
-
-        def execute_node(node, clean, force, args=None):
-            runner = TASKS[node["name"]]
-
-            if runner and runner.clean and clean:
-                logger.debug(f"Cleaning Task: {runner.clean}")
-                runner.clean()
-
-            complete_dependencies = 0
-            for dependency in node["dependencies"]:
-                try:
-                    execute_node(dependency, clean_all, force_all)
-                except AlreadyComplete:
-                    complete_dependencies += 1
-            dependencies_complete = complete_dependencies == len(node["dependencies"])
-
-            # Execute function if there is one. Targets may not have a function. If any dependency
-            # was run, then this task must run too.
-            if runner and runner.func:
-                passes, checkers = runner.check(force)
-                if dependencies_complete and passes:
-                    logger.debug(f"[skip] {node['name']}, already complete.")
-                    raise AlreadyComplete()
-
-                else:
-                    # set tasks force attribute so it's setup the same as if it were run directly.
-                    runner.task.__task__.force = force
-                    return_value = runner.func(*args or [])
-                    # save checker only after function has completed successfully. Save should be
-                    # called even if force=True
-                    if checkers:
-                        for checker in checkers:
-                            checker.save()
-                    logger.debug(f"[fini] {runner.name}")
-                    return return_value
-
-        return execute_node(self.tree(flatten=False), clean_root, force_root, args)
+        return execute([self], args, **kwargs)[0]
 
     def check(self, force: bool = False) -> (bool, list):
         """Return True if the task is complete based on configured checks.
@@ -222,7 +195,7 @@ class TaskRunner(object):
         :param force: override the check and return True if True.
         :return:
         """
-        checkers = [checker.clone() for checker in self.checkers] if self.checkers else None
+        checkers = self.clone_checkers()
         passes = False
         if self.checkers:
             if force:
@@ -232,6 +205,10 @@ class TaskRunner(object):
                 passes = all(checks)
         return passes, checkers
 
+    def clone_checkers(self) -> typing.Optional[list]:
+        """Return copies of the task's checkers, or None if it doesn't have any"""
+        return [checker.clone() for checker in self.checkers] if self.checkers else None
+
     def state(self, shallow: bool = True) -> typing.Optional[dict]:
         """
         Calculates a dict of state generated from the tasks checkers.
@@ -261,7 +238,7 @@ class TaskRunner(object):
             "checks": [
                 {
                     "class": f"{type(checker).__module__}.{type(checker).__name__}",
-                    "state": checker.state(),
+                    "state": checker.cached_state(),
                 }
                 for checker in checkers
             ],
@@ -270,6 +247,11 @@ class TaskRunner(object):
     def hash(self):
         return hash_object(self.state(shallow=True))
 
+    @property
+    def outputs(self) -> list:
+        """Absolute paths of the task's outputs"""
+        return [os.path.abspath(CONFIG.format(path)) for path in self._outputs]
+
     def add_dependency(self, *tasks):
         self._depends.extend(tasks)
 
@@ -361,56 +343,159 @@ class TaskRunner(object):
         """
         Return tree of tasks, with this task as the root.
 
+        The tree is built with an explicit stack rather than recursion so deep dependency chains
+        don't reach the interpreter's recursion limit.
+
         :param dedupe: remove duplicates from tree
         :param flatten: flatten single item dependcy lists into the parent
         :return:
         """
-        tree = self._build_tree(set([]) if dedupe else None)
+        seen = set([]) if dedupe else None
+        tree = {"name": self.name, "dependencies": []}
+
+        # Each stack frame is a node and an iterator over it's remaining dependencies. A node's
+        # dependency is fully walked before it's next dependency is checked against `seen`.
+        stack = [(tree, iter(self.depends))]
+        while stack:
+            node, depends = stack[-1]
+            for dependency in depends:
+                if seen is not None:
+                    if dependency in seen:
+                        continue
+                    seen.add(dependency)
+                child = {"name": dependency.name, "dependencies": []}
+                node["dependencies"].append(child)
+                stack.append((child, iter(dependency.depends)))
+                break
+            else:
+                stack.pop()
+
         if flatten:
             tree = flatten_tree(tree)
         return tree
 
-    def _build_tree(self, seen=None):
-        """
-        Internal method for recursively building task tree
-        :param seen: should be a Set if deduping.
-        :return: node in tree
-        """
-        dependencies = []
-        for dependency in self.depends:
-            if seen is not None:
-                if dependency in seen:
-                    continue
-                seen.add(dependency)
-            dependencies.append(dependency._build_tree(seen))
-
-        return {"name": self.name, "dependencies": dependencies}
-
     def status(self, dedupe: bool = True, flatten: bool = True) -> dict:
         """
         Return the task tree augmented with status information
         """
+        from ixian.graph import Graph
 
-        def update(node):
-            for dependency in node["dependencies"]:
-                update(dependency)
+        # Run each task's checks once, concurrently. Run checks even if dependencies fail their
+        # checks. That way the checkers (and state) are available.
+        nodes = scheduler.build_nodes(Graph([self]), False, False, False, False)
+        with state_cache():
+            checks = scheduler.check_nodes(nodes)
+        save_index()
 
+        tree = self.tree(dedupe, flatten)
+        for node in walk_tree(tree):
             if node["name"] is not None:
-                # Run self.check even if children fail their checks. That way the
-                # checkers (and state) are available.
                 children_passes = all(
                     (dependency["passes"] for dependency in node["dependencies"])
                 )
-                runner = TASKS[node["name"]]
-                passes, checkers = runner.check()
+                passes, checkers = checks[node["name"]]
                 node["checkers"] = checkers
 
                 # node fails if any children have failed
                 node["passes"] = passes and children_passes
 
-            return node
+        return tree
+
 
-        return update(self.tree(dedupe, flatten))
+def resolve_options(kwargs: dict) -> dict:
+    """
+    Resolve execution options passed as kwargs. Clean implies force and the `_all` options imply
+    the root options.
+
+    :param kwargs: options for task execution
+    :return: dict of options for the scheduler
+    """
+    clean_root = kwargs.get("clean", False)
+    clean_all = kwargs.get("clean_all", False)
+    force_root = kwargs.get("force", False)
+    force_all = kwargs.get("force_all", False)
+
+    if clean_root:
+        force_root = True
+    if clean_all:
+        clean_root = True
+        force_all = True
+    if force_all:
+        force_root = True
+
+    return {
+        "clean_root": clean_root,
+        "force_root": force_root,
+        "clean_all": clean_all,
+        "force_all": force_all,
+        "jobs": kwargs.get("jobs", 1),
+    }
+
+
+def execute(runners: list, args: list, **kwargs) -> list:
+    """
+    Execute one or more tasks in a single run. The tasks and their dependencies are merged into
+    one graph so shared dependencies are checked and executed once.
+
+    `args` are passed to every task in `runners`. Options are the same as `TaskRunner.execute`,
+    root options apply to every task in `runners`.
+
+    :param runners: list of TaskRunners to execute
+    :param args: args to pass through to the tasks
+    :param kwargs: options for task execution
+    :return: list of return values from the task functions
+    """
+    options = resolve_options(kwargs)
+
+    args_as_str = CONFIG.format(" ".join([str(arg) for arg in args]))
+    for runner in runners:
+        # save force to task instance so it may be referenced downstream
+        # TODO: this should be passing in `force`
+        runner.force = True
+        logger.debug(
+            f"[exec] {runner.name}({args_as_str}) "
+            f"force={options['force_root']} clean={options['clean_root']}"
+        )
+
+    return scheduler.execute(
+        runners,
+        args,
+        keep_going=kwargs.get("keep_going", False),
+        complete=kwargs.get("complete", None),
+        workers=kwargs.get("workers", None),
+        timeout=kwargs.get("timeout", None),
+        output=kwargs.get("output", STREAM),
+        **options,
+    )
+
+
+def plan(runners: list, **kwargs) -> list:
+    """
+    Determine which tasks would run without running them. Checks are evaluated the same way as
+    `execute`, but no task functions or clean functions are called.
+
+    :param runners: list of TaskRunners to plan
+    :param kwargs: options for task execution
+    :return: list of nodes in execution order, with `outcome` and `reason` set
+    """
+    return scheduler.plan(runners, **resolve_options(kwargs))
+
+
+def walk_tree(tree: dict):
+    """
+    Iterate through the nodes in a task tree, dependencies before the nodes that contain them.
+
+    :param tree: tree to walk
+    :return: generator of nodes
+    """
+    stack = [(tree, False)]
+    while stack:
+        node, visited = stack.pop()
+        if visited:
+            yield node
+        else:
+            stack.append((node, True))
+            stack.extend((dependency, False) for dependency in reversed(node["dependencies"]))
 
 
 def flatten_tree(tree: dict, full: bool = False) -> dict:
@@ -448,35 +533,27 @@ def flatten_tree(tree: dict, full: bool = False) -> dict:
     :return: flattened task list
     """
 
-    def flatten_node(node: dict) -> list:
-        """
-        Flatten a single node. Always return a list for consistency, even when returning a single
-        node.
-
-        :param node:
-        :param parent: parent task list to collapse into
-        :return: flattened node
-        """
-        node = node.copy()
+    # Nodes are flattened after their dependencies. Each node flattens to a list, even when it is
+    # a single node, for consistency.
+    flattened_nodes = {}
+    for original in walk_tree(tree):
+        node = original.copy()
         num_dependencies = len(node["dependencies"])
         if num_dependencies == 0:
             # no dependencies: nothing to flatten, return as-is
-            return [node]
+            flattened = [node]
 
         elif full or num_dependencies == 1:
             # flatten dependencies: flatten into single list that includes parent & child
             flattened = []
             for dependency in node["dependencies"]:
-                flattened_child = flatten_node(dependency)
-                flattened.extend(flattened_child)
+                flattened.extend(flattened_nodes.pop(id(dependency)))
 
                 # clear dependencies, since they are now siblings
                 # this node is added last since it runs after dependencies
                 node["dependencies"] = []
                 flattened.append(node)
 
-            return flattened
-
         else:
             # multiple dependencies: do not flatten into parent.
             #
@@ -484,13 +561,14 @@ def flatten_tree(tree: dict, full: bool = False) -> dict:
             # Dependency nodes should either be a single node, or a list of nodes
             dependencies = []
             for dependency in node["dependencies"]:
-                flattened = flatten_node(dependency)
-                dependencies.extend(flattened)
+                dependencies.extend(flattened_nodes.pop(id(dependency)))
 
             node["dependencies"] = dependencies
-            return [node]
+            flattened = [node]
 
-    root = flatten_node(tree)
+        flattened_nodes[id(original)] = flattened
+
+    root = flattened_nodes[id(tree)]
     if len(root) > 1:
         # if root's dependencies were flattened into it, then the returned list will have all of
         # those dependencies. Create a new root node to contain them all. This keeps the structure
@@ -506,7 +584,8 @@ class Task(object):
     """
     Super class for defining ixian tasks.
 
-    Task subclasses should define an execute method.
+    Task subclasses should define an execute method. The method may be a coroutine
+    (`async def execute`), these tasks run on the scheduler's event loop.
     """
 
     __task__ = None
@@ -517,9 +596,17 @@ class Task(object):
         if not hasattr(self, "execute"):
             raise NotImplementedError("Task classes must implement execute method")
 
-        # wrap execute method to curry `self`
-        def execute(*args, **kwargs):
-            return self.execute(*args, **kwargs)
+        # wrap execute method to curry `self`. Coroutines are wrapped with a coroutine so the
+        # scheduler can tell they should run on the event loop.
+        if asyncio.iscoroutinefunction(self.execute):
+
+            async def execute(*args, **kwargs):
+                return await self.execute(*args, **kwargs)
+
+        else:
+
+            def execute(*args, **kwargs):
+                return self.execute(*args, **kwargs)
 
         return execute
 
@@ -541,6 +628,11 @@ class Task(object):
                 parent=getattr(instance, "parent", None),
                 short_description=getattr(instance, "short_description", None),
                 description=cls.__doc__,
+                executor=getattr(instance, "executor", None),
+                weight=getattr(instance, "weight", None),
+                resources=getattr(instance, "resources", None),
+                timeout=getattr(instance, "timeout", None),
+                outputs=getattr(instance, "outputs", None),
             )
         else:
             # In practice task classes should never need to be instantiated more than once.
@@ -35,6 +35,7 @@ from ixian.utils.filesystem import (
     rmdir,
     empty_dir,
     leading_slash,
+    open_lock,
 )
 
 
@@ -62,6 +63,7 @@ def mock_environment(temp_builder):
     Initialize ixian with a tests environment
     """
     CONFIG.PROJECT_NAME = "unittests"
+    CONFIG.RESOURCES = {}
     CONFIG.LOGGING_CONFIG = {
         "version": 1,
         "formatters": {
@@ -173,6 +175,7 @@ def temp_builder(caplog, mocker):
     mocker.patch("ixian.utils.filesystem.exists", side_effect=convert_func(exists))
     mocker.patch("ixian.utils.filesystem.mkdir", side_effect=convert_func(mkdir))
     mocker.patch("ixian.utils.filesystem.empty_dir", side_effect=convert_func(empty_dir))
+    mocker.patch("ixian.utils.filesystem.open_lock", side_effect=convert_func(open_lock))
 
     # create a random builder directory so this test doesn't conflict with any other tests
     mkdir(CONFIG.TEMP_BUILDER)
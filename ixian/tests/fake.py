@@ -30,6 +30,8 @@ def build_test_args(**extra):
     args = runner.DEFAULT_ARGS.copy()
     args["task_args"] = []
     args.update(extra)
+    if args["targets"] is None:
+        args["targets"] = [args["task"]]
     return args
 
 
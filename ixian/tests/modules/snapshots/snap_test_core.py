@@ -8,35 +8,49 @@ from pysnap import Snapshot
 snapshots = Snapshot()
 
 snapshots['TestHelp.test_general_help 1'] = '''usage: ixian [--help] [--log LOG] [--force] [--force-all] [--clean]
-             [--clean-all]
+             [--clean-all] [--jobs JOBS] [--timeout SECONDS]
+             [--output {stream,prefix}] [--keep-going] [--plan] [--watch]
+             [--daemon] [--workers HOST:PORT,...]
              ...
 
 Run a ixian task.
 
 positional arguments:
-  remainder    arguments for task.
+  remainder             tasks to run, then -- and arguments for tasks.
 
 optional arguments:
-  --help       show this help message and exit
-  --log LOG    Log level (DEBUG|INFO|WARN|ERROR|NONE)
-  --force      force task execution
-  --force-all  force execution including task dependencies
-  --clean      clean before running task
-  --clean-all  clean all dependencies before running task
+  --help                show this help message and exit
+  --log LOG             Log level (DEBUG|INFO|WARN|ERROR|NONE)
+  --force               force task execution
+  --force-all           force execution including task dependencies
+  --clean               clean before running task
+  --clean-all           clean all dependencies before running task
+  --jobs JOBS, -j JOBS  number of tasks to run in parallel, 0 for one per cpu
+  --timeout SECONDS     seconds a task may run before it fails
+  --output {stream,prefix}
+                        prefix: prefix output lines with the task name
+  --keep-going, -k      keep running tasks that don't depend on a failed task
+  --plan                show which tasks would run and why, without running them
+  --watch               re-run tasks when the files they hash change
+  --daemon              serve commands from a resident process
+  --workers HOST:PORT,...
+                        run tasks on workers started with `ix worker`
 
 Type 'ix help <subcommand>' for help on a specific subcommand.
 
 Available subcommands:
 
 \x1b[91m[ Testing ]\x1b[0m
-  lint     Run all linting tasks.
-  test     Run all testing tasks.
+  lint            Run all linting tasks.
+  test            Run all testing tasks.
 
 \x1b[91m[ Build ]\x1b[0m
-  clean    Run all clean tasks.
+  clean           Run all clean tasks.
 
 \x1b[91m[ Misc ]\x1b[0m
-  help     This help message or help <task> for task help
+  cache-server    Serve a remote cache of task outputs.
+  help            This help message or help <task> for task help
+  worker          Run tasks for ix --workers.
 '''
 
 snapshots['TestHelp.test_task_help 1'] = '''\x1b[1mNAME
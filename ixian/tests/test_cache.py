@@ -0,0 +1,197 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import stat
+import time
+from unittest import mock
+
+import pytest
+
+from ixian.cache import WRITE_BITS, MissingOutput, OutputCache, remove
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return OutputCache(str(tmp_path / "cache"), max_size=None, restore_mode="copy")
+
+
+@pytest.fixture
+def outputs(tmp_path):
+    """A file and a directory of outputs"""
+    workspace = tmp_path / "workspace"
+    workspace.mkdir()
+    (workspace / "out.txt").write_text("out")
+    build = workspace / "build"
+    (build / "nested").mkdir(parents=True)
+    (build / "nested/lib.so").write_text("lib")
+    (build / "empty").mkdir()
+    (build / "run.sh").write_text("#!/bin/sh")
+    (build / "run.sh").chmod(0o755)
+    os.symlink("nested/lib.so", str(build / "link"))
+    return [str(workspace / "out.txt"), str(build)]
+
+
+def read_tree(path):
+    """Return a dict describing the files under a path"""
+    tree = {}
+    for root, dirs, files in os.walk(path):
+        for name in dirs + files:
+            full_path = os.path.join(root, name)
+            relative = os.path.relpath(full_path, path)
+            if os.path.islink(full_path):
+                tree[relative] = ("link", os.readlink(full_path))
+            elif os.path.isdir(full_path):
+                tree[relative] = ("dir",)
+            else:
+                with open(full_path) as file:
+                    tree[relative] = (file.read(), os.stat(full_path).st_mode)
+    return tree
+
+
+def remove_outputs(outputs):
+    for output in outputs:
+        remove(output)
+
+
+class TestOutputCache:
+    def test_miss(self, cache, outputs):
+        assert not cache.restore("key", outputs)
+
+    def test_restore(self, cache, outputs):
+        """Files, directories, symlinks and modes are restored"""
+        expected = read_tree(os.path.dirname(outputs[0]))
+        cache.store("key", outputs)
+        remove_outputs(outputs)
+
+        assert cache.restore("key", outputs)
+        assert read_tree(os.path.dirname(outputs[0])) == expected
+
+    def test_replaces_existing(self, cache, outputs):
+        cache.store("key", outputs)
+        with open(outputs[0], "w") as file:
+            file.write("changed")
+        with open(f"{outputs[1]}/extra", "w") as file:
+            file.write("extra")
+
+        assert cache.restore("key", outputs)
+        with open(outputs[0]) as file:
+            assert file.read() == "out"
+        assert not os.path.exists(f"{outputs[1]}/extra")
+
+    def test_hardlink(self, tmp_path, outputs):
+        """Read only outputs are linked to the cache"""
+        os.chmod(outputs[0], 0o444)
+        cache = OutputCache(str(tmp_path / "cache"), max_size=None, restore_mode="hardlink")
+        cache.store("key", outputs)
+        remove_outputs(outputs)
+        assert cache.restore("key", outputs)
+        assert os.stat(outputs[0]).st_nlink == 2
+        assert stat.S_IMODE(os.stat(outputs[0]).st_mode) == 0o444
+
+    def test_hardlink_writable(self, tmp_path, outputs):
+        """Writable outputs are copied, editing them doesn't modify the cache"""
+        cache = OutputCache(str(tmp_path / "cache"), max_size=None, restore_mode="hardlink")
+        cache.store("key", outputs)
+        remove_outputs(outputs)
+        assert cache.restore("key", outputs)
+        assert os.stat(outputs[0]).st_nlink == 1
+        with open(outputs[0], "w") as file:
+            file.write("changed")
+
+        assert cache.restore("key", outputs)
+        with open(outputs[0]) as file:
+            assert file.read() == "out"
+
+    def test_read_only_objects(self, cache, outputs):
+        cache.store("key", outputs)
+        for root, _, files in os.walk(f"{cache.path}/objects"):
+            for name in files:
+                assert not os.stat(os.path.join(root, name)).st_mode & WRITE_BITS
+
+    def test_content_addressed(self, cache, outputs):
+        """Files with the same content are stored once"""
+        cache.store("a", outputs)
+        cache.store("b", outputs)
+        objects = [files for _, _, files in os.walk(f"{cache.path}/objects") if files]
+        assert sum(len(files) for files in objects) == 3
+
+    def test_different_outputs(self, cache, outputs):
+        """Entries are only restored for the same outputs"""
+        cache.store("key", outputs)
+        assert not cache.restore("key", outputs[:1])
+
+    def test_missing_output(self, cache, outputs):
+        remove_outputs(outputs[:1])
+        with pytest.raises(MissingOutput):
+            cache.store("key", outputs)
+        assert not cache.restore("key", outputs)
+
+    def test_missing_object(self, cache, outputs):
+        """Entries with missing files are ignored and the outputs are left alone"""
+        cache.store("key", outputs)
+        for root, _, files in os.walk(f"{cache.path}/objects"):
+            for name in files:
+                os.unlink(os.path.join(root, name))
+        assert not cache.restore("key", outputs)
+        assert os.path.exists(outputs[0])
+
+    def test_evict(self, tmp_path):
+        """Least recently used entries are evicted once the cache is too large"""
+        cache = OutputCache(str(tmp_path / "cache"), max_size=25, restore_mode="copy")
+        path = str(tmp_path / "out")
+        for key in ("a", "b", "c"):
+            with open(path, "w") as file:
+                file.write(key * 10)
+            cache.store(key, [path])
+            time.sleep(0.01)
+
+        # c and b fit, a was evicted
+        assert not cache.restore("a", [path])
+        assert cache.restore("b", [path])
+        time.sleep(0.01)
+
+        # b was used more recently than c
+        with open(path, "w") as file:
+            file.write("d" * 10)
+        cache.store("d", [path])
+        assert not cache.restore("c", [path])
+        assert cache.restore("b", [path])
+        with open(path) as file:
+            assert file.read() == "b" * 10
+
+        objects = [files for _, _, files in os.walk(f"{cache.path}/objects") if files]
+        assert sum(len(files) for files in objects) == 2
+        assert cache.read_size() == 20
+
+    def test_evict_over_limit(self, tmp_path, outputs):
+        """Manifests are only read once the cache is too large"""
+        cache = OutputCache(str(tmp_path / "cache"), max_size=1024, restore_mode="copy")
+        with mock.patch.object(cache, "evict", wraps=cache.evict) as evict:
+            cache.store("a", outputs)
+            cache.store("b", outputs)
+            evict.assert_not_called()
+        assert cache.read_size() == len("out") + len("lib") + len("#!/bin/sh")
+
+        cache.max_size = 1
+        with mock.patch.object(cache, "evict", wraps=cache.evict) as evict:
+            cache.store("c", outputs)
+            evict.assert_called_once_with()
+        assert cache.read_size() == 0
+
+    def test_size_measured(self, cache, outputs):
+        """Caches without a recorded size are measured"""
+        cache.store("key", outputs)
+        os.unlink(f"{cache.path}/size")
+        assert cache.read_size() == len("out") + len("lib") + len("#!/bin/sh")
@@ -12,14 +12,33 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import hashlib
 import os
 import pytest
+import shutil
+import sys
+import threading
+import time
 import uuid
 
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 from unittest.mock import Mock
 
-from ixian.check.checker import Checker, MultiValueChecker
-from ixian.modules.filesystem.file_hash import FileHash, get_flags
+from ixian.check.checker import Checker, MultiValueChecker, hash_object, state_cache
+from ixian.config import CONFIG
+from ixian.modules.filesystem.file_hash import (
+    FileHash,
+    get_flags,
+    get_pool,
+    hash_dir,
+    hash_contents,
+    hash_file,
+    hash_paths,
+)
+from ixian.modules.filesystem.file_index import FileIndex, get_index, save_index
+from ixian.task import Task, TASKS
+from ixian.tests import fake
 
 
 class MockChecker(Checker):
@@ -128,6 +147,138 @@ class TestMultiValueChecker(TestChecker):
         assert checker.saved_state() == clone.saved_state()
 
 
+class CountingChecker(MockMultiValueChecker):
+    """Counts how many times state is calculated, across clones"""
+
+    counts = {}
+
+    def state(self):
+        key = tuple(self.keys)
+        self.counts[key] = self.counts.get(key, 0) + 1
+        return super(CountingChecker, self).state()
+
+
+class TestStateCache:
+    @property
+    def checker(self):
+        return CountingChecker(str(uuid.uuid4()))
+
+    def count(self, checker):
+        return CountingChecker.counts.get(tuple(checker.keys), 0)
+
+    def test_inactive(self):
+        """State is calculated every time outside of a state_cache block"""
+        checker = self.checker
+        checker.cached_state()
+        checker.cached_state()
+        assert self.count(checker) == 2
+
+    def test_cached(self):
+        """Clones and checkers with the same keys share cached state"""
+        checker = self.checker
+        with state_cache():
+            assert checker.cached_state() == checker.state()
+            checker.cached_state()
+            checker.clone().cached_state()
+            CountingChecker(*checker.keys).hash()
+        assert self.count(checker) == 2
+
+        checker.cached_state()
+        assert self.count(checker) == 3
+
+    def test_different_keys(self):
+        checker_a, checker_b = self.checker, self.checker
+        with state_cache():
+            checker_a.cached_state()
+            checker_b.cached_state()
+        assert self.count(checker_a) == 1
+        assert self.count(checker_b) == 1
+
+    def test_nested(self):
+        """Nested blocks share the outer cache"""
+        checker = self.checker
+        with state_cache() as outer:
+            checker.cached_state()
+            with state_cache() as inner:
+                assert inner is outer
+                checker.cached_state()
+            checker.cached_state()
+        assert self.count(checker) == 1
+
+    def test_invalidate(self):
+        checker = self.checker
+        with state_cache():
+            checker.cached_state()
+            checker.mocked_state += 1
+            checker.invalidate()
+            assert checker.cached_state() == {"mock": 101}
+        assert self.count(checker) == 2
+
+    def test_concurrent(self):
+        """Threads wait for state another thread is calculating"""
+        checker = self.checker
+        started = threading.Event()
+        release = threading.Event()
+
+        def state():
+            started.set()
+            release.wait(5)
+            return {"mock": 1}
+
+        with state_cache():
+            with mock.patch.object(checker, "state", side_effect=state) as mock_state:
+                with ThreadPoolExecutor(max_workers=2) as pool:
+                    first = pool.submit(checker.cached_state)
+                    assert started.wait(5)
+                    second = pool.submit(checker.clone().cached_state)
+                    release.set()
+                assert first.result() == second.result() == {"mock": 1}
+        mock_state.assert_called_once_with()
+
+    def test_error(self):
+        """State isn't cached if it raised"""
+        checker = self.checker
+        with state_cache():
+            with mock.patch.object(checker, "state", side_effect=OSError):
+                with pytest.raises(OSError):
+                    checker.cached_state()
+            assert checker.cached_state() == {"mock": 100}
+
+    def test_not_cached(self, temp_builder):
+        """Checkers without a cache_key always calculate their state"""
+        checker = MockChecker(mock_save=False, mock_check=False)
+        with state_cache():
+            checker.cached_state()
+            checker.mocked_state += 1
+            assert checker.cached_state() == {"mock": 2}
+
+    def test_execute(self, mock_environment):
+        """Checkers are checked once before a task runs and recalculated after it runs"""
+        checker = self.checker
+
+        class Cached(Task):
+            name = "cached"
+            check = [checker]
+
+            def execute(self):
+                pass
+
+        class Root(Task):
+            name = "root"
+            depends = ["cached"]
+            check = [checker]
+
+            def execute(self):
+                pass
+
+        Cached()
+        Root()
+        TASKS["root"]()
+        # checked by both tasks before running, saved after each task ran.
+        assert self.count(checker) == 3
+        assert TASKS["root"].check()
+
+
 def file_hash_mock_path(path):
     import ixian.tests.mocks as mocks_module
 
@@ -328,3 +479,347 @@ class TestFileHash:
         checker_1 = FileHash(file_hash_mock_path(self.MOCK_DIR))
         checker_2 = FileHash(file_hash_mock_path(self.MOCK_NESTED_DIR_MISSING))
         self.assert_paths(checker_1.state(), checker_2.state(), False)
+
+
+@pytest.fixture
+def tree(tmp_path):
+    """A directory with files and a nested directory"""
+    root = tmp_path / "root"
+    (root / "nested").mkdir(parents=True)
+    (root / "a").write_text("a")
+    (root / "nested/b").write_text("b")
+    (root / "nested/c").write_text("c" * 1024 * 1024)
+    return root
+
+
+class TestHashPaths:
+    """Tests for hashing files concurrently"""
+
+    def test_layout(self, tree):
+        """Directory hashes combine their contents the same way they always have"""
+        nested = {
+            "___FLAGS___": get_flags(str(tree / "nested")),
+            "b": hash_file(str(tree / "nested/b")),
+            "c": hash_file(str(tree / "nested/c")),
+        }
+        expected = hash_object(
+            {
+                "___FLAGS___": get_flags(str(tree)),
+                "a": hash_file(str(tree / "a")),
+                "nested": hash_object(nested),
+            }
+        )
+        file_path = str(tree / "a")
+        assert hash_dir(str(tree)) == expected
+        assert hash_paths(str(tree), file_path) == {
+            str(tree): expected,
+            file_path: hash_file(file_path),
+        }
+
+    def test_workers(self, tree):
+        expected = hash_dir(str(tree))
+        CONFIG.HASH_WORKERS = 1
+        try:
+            pool = get_pool()
+            assert pool._max_workers == 1
+            assert hash_dir(str(tree)) == expected
+        finally:
+            del CONFIG.HASH_WORKERS
+        assert get_pool() is not pool
+
+    def test_deep(self, tmp_path):
+        """Trees deeper than the recursion limit are hashed"""
+        path = str(tmp_path / "deep")
+        current = path
+        for _ in range(sys.getrecursionlimit() + 100):
+            os.makedirs(current)
+            current = os.path.join(current, "d")
+        try:
+            hash_dir(path)
+        finally:
+            # shutil.rmtree recurses too, remove the tree deepest first.
+            while current != path:
+                current = os.path.dirname(current)
+                os.rmdir(current)
+
+    def test_error(self, tree):
+        """Errors hashing a file are raised"""
+        os.symlink(str(tree / "missing"), str(tree / "nested/broken"))
+        with pytest.raises(FileNotFoundError):
+            hash_paths(str(tree))
+
+
+class TestHashContents:
+    """Tests for reading files of different sizes"""
+
+    @pytest.mark.parametrize(
+        "size", [0, 1, 64 * 1024 - 1, 64 * 1024, 256 * 1024 + 1, 1024 * 1024, 3 * 1024 * 1024 + 7]
+    )
+    def test_sizes(self, tmp_path, size):
+        path = str(tmp_path / "file")
+        data = os.urandom(size)
+        with open(path, "wb") as file:
+            file.write(data)
+
+        hash = hashlib.sha256()
+        hash_contents(hash, path, size)
+        assert hash.hexdigest() == hashlib.sha256(data).hexdigest()
+
+    @pytest.mark.parametrize("size", [10, 100 * 1024, 2 * 1024 * 1024])
+    def test_size_changed(self, tmp_path, size):
+        """Files are read to the end even if their size changed since they were stat'ed"""
+        path = str(tmp_path / "file")
+        data = os.urandom(size)
+        with open(path, "wb") as file:
+            file.write(data)
+
+        for stat_size in (size // 2, size * 2):
+            hash = hashlib.sha256()
+            hash_contents(hash, path, stat_size)
+            assert hash.hexdigest() == hashlib.sha256(data).hexdigest()
+
+
+@pytest.fixture
+def project(tmp_path):
+    """A source tree with files that should be excluded"""
+    root = tmp_path / "project"
+    for path in ("src/pkg/__pycache__", "src/node_modules/dep", "docs/_build", "src/docs/_build"):
+        (root / path).mkdir(parents=True)
+    for path in (
+        "src/pkg/a.py",
+        "src/pkg/__pycache__/a.cpython-38.pyc",
+        "src/pkg/b.pyc",
+        "src/pkg/.a.py.swp",
+        "src/node_modules/dep/index.js",
+        "docs/index.rst",
+        "docs/_build/index.html",
+        "src/docs/_build/page.html",
+    ):
+        (root / path).write_text(path)
+    return root
+
+
+def remove_paths(root, *paths):
+    for path in paths:
+        full_path = str(root / path)
+        if os.path.isdir(full_path):
+            shutil.rmtree(full_path)
+        else:
+            os.unlink(full_path)
+
+
+class TestFileHashExclude:
+    """Tests for excluding paths from FileHash"""
+
+    def test_exclude(self, project):
+        checker = FileHash(
+            str(project),
+            exclude=["__pycache__", "*.pyc", ".*.swp", "node_modules/", "/docs/_build"],
+        )
+        state = checker.state()
+
+        remove_paths(
+            project,
+            "src/pkg/__pycache__",
+            "src/pkg/b.pyc",
+            "src/pkg/.a.py.swp",
+            "src/node_modules",
+            "docs/_build",
+        )
+        assert state == FileHash(str(project)).state()
+
+    def test_pruned(self, project):
+        """Excluded directories aren't walked"""
+        walked = []
+        scandir = os.scandir
+
+        def mock_scandir(path):
+            walked.append(path)
+            return scandir(path)
+
+        checker = FileHash(str(project), exclude=["node_modules"])
+        with mock.patch("ixian.modules.filesystem.file_hash.os.scandir", mock_scandir):
+            checker.state()
+        assert str(project / "src/pkg") in walked
+        assert not [path for path in walked if "node_modules" in path]
+
+    def test_anchored(self, project):
+        """Patterns with a slash are relative to the key"""
+        state = FileHash(str(project), exclude=["docs/_build"]).state()
+        remove_paths(project, "docs/_build")
+        assert state == FileHash(str(project)).state()
+
+    def test_negate(self, project):
+        state = FileHash(str(project), exclude=["*.pyc", "!b.pyc"]).state()
+        remove_paths(project, "src/pkg/__pycache__/a.cpython-38.pyc")
+        assert state == FileHash(str(project)).state()
+
+    def test_wildcard(self, project):
+        """Wildcard matches are excluded too"""
+        checker = FileHash(str(project / "src/pkg/*"), exclude=["*.pyc", "__pycache__"])
+        assert list(checker.state()) == [str(project / "src/pkg/a.py")]
+
+    def test_respect_gitignore(self, project):
+        (project / ".git/info").mkdir(parents=True)
+        (project / ".git/info/exclude").write_text("*.swp\n")
+        (project / ".gitignore").write_text("# comment\n\n__pycache__/\n*.pyc\n/docs/_build\n")
+        (project / "src/.gitignore").write_text("node_modules\n!b.pyc\n")
+        checker = FileHash(str(project / "src"), respect_gitignore=True)
+        state = checker.state()
+
+        remove_paths(
+            project,
+            "src/pkg/__pycache__",
+            "src/pkg/.a.py.swp",
+            "src/node_modules",
+        )
+        assert state == FileHash(str(project / "src")).state()
+
+        # .git is always excluded
+        root_state = FileHash(str(project), respect_gitignore=True).state()
+        remove_paths(project, ".git", "docs/_build")
+        assert root_state == FileHash(str(project)).state()
+
+    def test_repository_root(self, project):
+        """.git/info/exclude applies when the root of the repository is hashed"""
+        (project / ".git/info").mkdir(parents=True)
+        (project / ".git/info/exclude").write_text("*.swp\n/docs/_build\n")
+        state = FileHash(str(project), respect_gitignore=True).state()
+        remove_paths(project, ".git", "src/pkg/.a.py.swp", "docs/_build")
+        assert state == FileHash(str(project)).state()
+
+    def test_gitignore_changed(self, project):
+        (project / ".git").mkdir()
+        (project / ".gitignore").write_text("*.pyc\n")
+        checker = FileHash(str(project), respect_gitignore=True)
+        state = checker.state()
+
+        (project / ".gitignore").write_text("*.pyc\n*.swp\n")
+        assert checker.state() != state
+
+    def test_excluded_changes(self, project):
+        """Changes to excluded files don't change the state"""
+        checker = FileHash(str(project), exclude=["*.pyc"])
+        state = checker.state()
+        (project / "src/pkg/b.pyc").write_text("changed")
+        assert checker.state() == state
+
+    def test_filename(self, project):
+        """Checkers with different exclusions save state separately"""
+        path = str(project)
+        assert FileHash(path).filename() == MultiValueChecker.filename(FileHash(path))
+        filenames = {
+            FileHash(path).filename(),
+            FileHash(path, exclude=["*.pyc"]).filename(),
+            FileHash(path, exclude=["*.pyc"], respect_gitignore=True).filename(),
+        }
+        assert len(filenames) == 3
+        assert FileHash(path).cache_key() != FileHash(path, exclude=["*.pyc"]).cache_key()
+
+    def test_clone(self, project):
+        """Clones share the compiled rules"""
+        checker = FileHash(str(project), exclude=["*.pyc"], respect_gitignore=True)
+        clone = checker.clone()
+        assert clone.ignore is checker.ignore
+        assert clone.filename() == checker.filename()
+        assert FileHash(str(project)).clone().ignore is None
+
+
+@pytest.fixture
+def file_index(mock_environment):
+    """Index files as soon as they're hashed"""
+    with mock.patch("ixian.modules.filesystem.file_index.RACY_WINDOW", 0):
+        yield get_index()
+
+
+class TestFileIndex:
+    """Tests for the FileIndex used by FileHash"""
+
+    def test_reuses_hash(self, file_index, tmp_path):
+        """Unmodified files aren't read again"""
+        path = str(tmp_path / "file")
+        with open(path, "w") as file:
+            file.write("a")
+        digest = hash_file(path)
+
+        with mock.patch("ixian.modules.filesystem.file_hash.open", create=True) as mock_open:
+            assert hash_file(path) == digest
+        mock_open.assert_not_called()
+
+    def test_modified(self, file_index, tmp_path):
+        path = str(tmp_path / "file")
+        with open(path, "w") as file:
+            file.write("a")
+        stat = os.stat(path)
+        digest = hash_file(path)
+
+        # same size and mtime, the ctime still changes
+        with open(path, "w") as file:
+            file.write("b")
+        os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        assert hash_file(path) != digest
+
+        os.chmod(path, 0o600)
+        modified = hash_file(path)
+        os.chmod(path, 0o644)
+        assert modified != hash_file(path)
+
+    def test_racy(self, mock_environment, tmp_path):
+        """Recently modified files are hashed every time"""
+        path = str(tmp_path / "file")
+        with open(path, "w") as file:
+            file.write("a")
+        hash_file(path)
+        assert path not in get_index().load()
+
+    def test_save(self, file_index, tmp_path):
+        """Saved entries are merged with entries other processes saved"""
+        path_1, path_2 = str(tmp_path / "file_1"), str(tmp_path / "file_2")
+        for path in (path_1, path_2):
+            with open(path, "w") as file:
+                file.write(path)
+        digest_1 = hash_file(path_1)
+
+        other = FileIndex()
+        other.set(path_2, os.stat(path_2), "digest_2", time.time())
+        other.save()
+        save_index()
+
+        entries = FileIndex().load()
+        assert entries[path_1][-1] == digest_1
+        assert entries[path_2][-1] == "digest_2"
+
+    def test_prune(self, file_index, tmp_path):
+        """Entries for files that were removed from a walked directory are dropped on save"""
+        directory = tmp_path / "dir"
+        (directory / "sub").mkdir(parents=True)
+        for name in ("a", "b", "sub/c"):
+            (directory / name).write_text(name)
+        (tmp_path / "other").write_text("other")
+        hash_dir(str(directory))
+        hash_file(str(tmp_path / "other"))
+        save_index()
+        assert len(FileIndex().load()) == 4
+
+        (directory / "b").unlink()
+        shutil.rmtree(str(directory / "sub"))
+        hash_dir(str(directory))
+        save_index()
+        assert sorted(FileIndex().load()) == [str(directory / "a"), str(tmp_path / "other")]
+
+    def test_prune_excluded(self, file_index, tmp_path):
+        (tmp_path / "a.py").write_text("a")
+        (tmp_path / "a.pyc").write_text("a")
+        FileHash(str(tmp_path)).state()
+        save_index()
+        FileHash(str(tmp_path), exclude=["*.pyc"]).state()
+        save_index()
+        assert list(FileIndex().load()) == [str(tmp_path / "a.py")]
+
+    def test_saved_by_execute(self, file_index, tmp_path):
+        path = str(tmp_path / "file")
+        with open(path, "w") as file:
+            file.write("a")
+        task = fake.mock_task(check=[FileHash(path)])
+        task.__task__.execute([])
+        assert path in FileIndex().load()
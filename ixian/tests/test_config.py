@@ -12,6 +12,8 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import pickle
+
 import pytest
 
 from ixian.config import CONFIG, Config, MissingConfiguration
@@ -89,6 +91,20 @@ class TestConfig:
             config.format("{NESTED}")
         assert str(exec_info.value) == str(MissingConfiguration("DOES_NOT_EXIST", "NESTED"))
 
+    def test_snapshot(self, mock_nested_config):
+        """Snapshots include settings set on the config and it's children"""
+        mock_nested_config.RUNTIME = "{FOO}"
+        mock_nested_config.CHILD.GRANDCHILD.RUNTIME = "runtime"
+
+        snapshot = pickle.loads(pickle.dumps(mock_nested_config.snapshot()))
+        restored = Parent()
+        restored.restore(snapshot)
+
+        assert restored.RUNTIME == "foo"
+        assert restored.CHILD.BAR == "bar"
+        assert restored.CHILD.GRANDCHILD.RUNTIME == "runtime"
+        assert restored.format("{CHILD.GRANDCHILD.RUNTIME}") == "runtime"
+
     def test_variables(self):
         """Test default values for config"""
         config = Config()
@@ -0,0 +1,160 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import signal
+import socket
+import time
+
+import pytest
+
+from ixian import daemon
+from ixian.runner import ExitCodes
+from ixian.task import TASKS
+
+
+IXIAN_PY = """
+import os
+from ixian.task import Task
+
+
+class Echo(Task):
+    name = "echo"
+
+    def execute(self, *args):
+        print("{greeting}", *args, os.getcwd(), os.environ.get("IX_TEST"))
+
+
+def init():
+    Echo()
+"""
+
+
+def write_ixian_py(path, greeting):
+    with open(path, "w") as file:
+        file.write(IXIAN_PY.format(greeting=greeting))
+
+
+@pytest.fixture
+def workspace(tmp_path, monkeypatch):
+    """Workspace with an ixian.py and a daemon serving it"""
+    ixian_py = f"{tmp_path}/ixian.py"
+    write_ixian_py(ixian_py, "hello")
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("IXIAN_CONFIG", ixian_py)
+
+    pid = os.fork()
+    if not pid:
+        try:
+            TASKS.clear()
+            server = daemon.Daemon(daemon.socket_path())
+            server.load()
+            server.listen()
+            server.serve()
+        finally:
+            os._exit(0)
+
+    deadline = time.monotonic() + 10
+    while not os.path.exists(daemon.socket_path()):
+        assert time.monotonic() < deadline, "daemon didn't start"
+        time.sleep(0.01)
+
+    yield tmp_path
+
+    os.kill(pid, signal.SIGKILL)
+    os.waitpid(pid, 0)
+
+
+def run(argv, env=None):
+    """Forward a command and return it's exit code and output"""
+    stdin_read, stdin_write = os.pipe()
+    stdout_read, stdout_write = os.pipe()
+    try:
+        code = daemon.forward(argv, fds=(stdin_read, stdout_write, stdout_write))
+    finally:
+        os.close(stdin_read)
+        os.close(stdin_write)
+        os.close(stdout_write)
+    with os.fdopen(stdout_read) as stdout:
+        return code, stdout.read()
+
+
+class TestMessages:
+    def test_message(self):
+        client, server = socket.socketpair()
+        read, write = os.pipe()
+        with client, server:
+            daemon.send_message(client, {"argv": ["foo"]}, (write,))
+            message, fds = daemon.recv_message(server)
+            assert message == {"argv": ["foo"]}
+            assert len(fds) == 1
+
+            # the received fd refers to the same pipe
+            os.write(fds[0], b"data")
+            assert os.read(read, 4) == b"data"
+        for fd in [read, write] + fds:
+            os.close(fd)
+
+
+class TestForward:
+    def test_no_daemon(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        assert daemon.forward(["help"]) is None
+
+    def test_stale_socket(self, tmp_path, monkeypatch):
+        monkeypatch.chdir(tmp_path)
+        os.makedirs(f"{tmp_path}/.builder")
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.bind(daemon.socket_path())
+        sock.close()
+        assert daemon.forward(["help"]) is None
+
+
+class TestDaemon:
+    def test_run(self, workspace):
+        """Output of the command is written to the client's file descriptors"""
+        code, output = run(["--log", "ERROR", "echo", "--", "arg"])
+        assert code == ExitCodes.SUCCESS.value
+        assert output == f"hello arg {workspace} None\n"
+
+    def test_environment(self, workspace, monkeypatch):
+        """Commands run with the client's environment and working directory"""
+        os.mkdir(f"{workspace}/subdir")
+        monkeypatch.setenv("IX_TEST", "forwarded")
+        monkeypatch.chdir(f"{workspace}/subdir")
+        # the socket is in the workspace's builder, forward from there
+        monkeypatch.setattr(daemon, "socket_path", lambda: f"{workspace}/.builder/ixian.sock")
+
+        code, output = run(["--log", "ERROR", "echo"])
+        assert code == ExitCodes.SUCCESS.value
+        assert output == f"hello {workspace}/subdir forwarded\n"
+
+    def test_exit_code(self, workspace):
+        code, _ = run(["--log", "ERROR", "unknown_task"])
+        assert code == ExitCodes.ERROR_UNKNOWN_TASK.value
+
+    def test_reload(self, workspace):
+        """Changes to ixian.py are loaded before the next command"""
+        assert run(["--log", "ERROR", "echo"])[1].startswith("hello ")
+
+        write_ixian_py(f"{workspace}/ixian.py", "goodbye")
+        stat = os.stat(f"{workspace}/ixian.py")
+        os.utime(f"{workspace}/ixian.py", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+        assert run(["--log", "ERROR", "echo"])[1].startswith("goodbye ")
+
+    def test_state_is_not_shared(self, workspace):
+        """Each command runs in it's own process"""
+        assert run(["--log", "ERROR", "echo"])[0] == ExitCodes.SUCCESS.value
+        assert run(["--log", "ERROR", "echo"])[0] == ExitCodes.SUCCESS.value
@@ -0,0 +1,273 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import logging
+import os
+import signal
+import socket
+import time
+from unittest import mock
+
+import pytest
+
+from ixian import distributed
+from ixian.check.checker import Checker
+from ixian.config import CONFIG
+from ixian.exceptions import ExecuteFailed
+from ixian.task import Task, TASKS, execute
+
+
+logger = logging.getLogger(__name__)
+
+
+class PidCheck(Checker):
+    """Checker whose state is the pid of the process that calculated it"""
+
+    def __init__(self, name):
+        self.name = name
+
+    def state(self):
+        return {"pid": os.getpid()}
+
+    def filename(self):
+        return f"pid-{self.name}"
+
+    def clone(self):
+        return type(self)(self.name)
+
+
+class RecordPid(Task):
+    """Writes the pid it ran in to a file in CONFIG.DISTRIBUTED_DIR"""
+
+    name = "record_pid"
+    category = "testing"
+
+    def execute(self, *args):
+        logger.warning(f"running {self.name}")
+        time.sleep(0.2)
+        with open(f"{CONFIG.DISTRIBUTED_DIR}/{self.name}.pid", "w") as file:
+            file.write(str(os.getpid()))
+        return os.getpid()
+
+
+class RecordPidA(RecordPid):
+    name = "record_pid_a"
+    check = [PidCheck("record_pid_a")]
+
+
+class RecordPidB(RecordPid):
+    name = "record_pid_b"
+
+
+class RecordPidRoot(RecordPid):
+    name = "record_pid_root"
+    depends = ["record_pid_a", "record_pid_b"]
+
+
+class Broken(Task):
+    name = "broken"
+    category = "testing"
+
+    def execute(self, *args):
+        raise ExecuteFailed("broke")
+
+
+@pytest.fixture
+def distributed_tasks(mock_environment, tmp_path, monkeypatch):
+    monkeypatch.setenv(distributed.SECRET_ENV, "secret")
+    for task_class in (RecordPidA, RecordPidB, RecordPidRoot, Broken):
+        task_class()
+    CONFIG.DISTRIBUTED_DIR = str(tmp_path)
+    yield
+    del CONFIG.DISTRIBUTED_DIR
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture
+def workers(distributed_tasks):
+    """Two workers on localhost, each in it's own process"""
+    addresses = {}
+    for _ in range(2):
+        address = ("127.0.0.1", free_port())
+        pid = os.fork()
+        if not pid:
+            try:
+                loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(loop)
+                loop.run_until_complete(distributed.Worker(*address).serve())
+            finally:
+                os._exit(0)
+        addresses[address] = pid
+
+    deadline = time.monotonic() + 10
+    for address in addresses:
+        while True:
+            try:
+                socket.create_connection(address).close()
+                break
+            except OSError:
+                assert time.monotonic() < deadline, "worker didn't start"
+                time.sleep(0.01)
+
+    yield addresses
+
+    for pid in addresses.values():
+        os.kill(pid, signal.SIGKILL)
+        os.waitpid(pid, 0)
+
+
+def read_pid(name):
+    with open(f"{CONFIG.DISTRIBUTED_DIR}/{name}.pid") as file:
+        return int(file.read())
+
+
+def read_worker(workers, pid):
+    """Return the address of the worker with the pid"""
+    return next(address for address, worker_pid in workers.items() if worker_pid == pid)
+
+
+class TestParseAddress:
+    def test_parse_address(self):
+        assert distributed.parse_address("example.com:8000") == ("example.com", 8000)
+        assert distributed.parse_address(":8000") == ("127.0.0.1", 8000)
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            distributed.parse_address("example.com")
+
+    def test_parse_addresses(self):
+        assert distributed.parse_addresses("a:1, b:2,") == [("a", 1), ("b", 2)]
+
+
+class TestRunTask:
+    def request(self, name):
+        return {
+            "config": CONFIG.snapshot(),
+            "class_path": f"{__name__}.RecordPidA",
+            "name": name,
+            "args": [],
+            "force": False,
+        }
+
+    def test_run_task(self, distributed_tasks):
+        response = distributed.run_task(self.request("record_pid_a"))
+        assert response["error"] is None
+        assert response["return_value"] == os.getpid()
+        assert response["state"] == [{"pid": os.getpid()}]
+        assert (logging.WARNING, "running record_pid_a") in response["logs"]
+
+    def test_error(self, distributed_tasks):
+        response = distributed.run_task(self.request("broken"))
+        assert response["error"] == "broke"
+        assert response["return_value"] is None
+
+
+class TestWorkers:
+    def test_execute(self, workers):
+        """Tasks run on the workers, independent tasks run on different workers at once"""
+        pids = set(workers.values())
+        root_pid = execute([TASKS["record_pid_root"]], [], workers=list(workers))[0]
+
+        assert root_pid in pids
+        assert {read_pid("record_pid_a"), read_pid("record_pid_b")} == pids
+
+    def test_checker_state(self, workers):
+        """Checker state calculated by the worker is saved"""
+        execute([TASKS["record_pid_a"]], [], workers=list(workers))
+        checker = TASKS["record_pid_a"].checkers[0]
+        assert checker.saved_state() == {"pid": read_pid("record_pid_a")}
+
+    def test_logs(self, workers):
+        """Logs from the worker are logged by the coordinator"""
+        with mock.patch("ixian.distributed.logger") as mock_logger:
+            execute([TASKS["record_pid_a"]], [], workers=list(workers))
+        host, port = read_worker(workers, read_pid("record_pid_a"))
+        mock_logger.log.assert_any_call(
+            logging.WARNING, f"[{host}:{port}] running record_pid_a"
+        )
+
+    def test_failure(self, workers):
+        with pytest.raises(ExecuteFailed, match="broken failed on 127.0.0.1:[0-9]+: broke"):
+            execute([TASKS["broken"]], [], workers=list(workers))
+
+    def test_unavailable(self, distributed_tasks):
+        with pytest.raises(ExecuteFailed, match="is unavailable"):
+            execute([TASKS["record_pid_b"]], [], workers=[("127.0.0.1", free_port())])
+
+    def test_wrong_secret(self, workers, monkeypatch):
+        """Workers reject requests signed with another secret"""
+        monkeypatch.setenv(distributed.SECRET_ENV, "wrong")
+        with pytest.raises(ExecuteFailed, match="Lost connection"):
+            execute([TASKS["record_pid_b"]], [], workers=list(workers))
+        assert not os.path.exists(f"{CONFIG.DISTRIBUTED_DIR}/record_pid_b.pid")
+
+    def test_no_secret(self, distributed_tasks, monkeypatch):
+        monkeypatch.delenv(distributed.SECRET_ENV)
+        with pytest.raises(ExecuteFailed, match=distributed.SECRET_ENV):
+            execute([TASKS["record_pid_b"]], [], workers=[("127.0.0.1", free_port())])
+
+
+class Unpickled:
+    """Records that it was unpickled"""
+
+    instances = []
+
+    def __reduce__(self):
+        return Unpickled.instances.append, ("unpickled",)
+
+
+def run(coroutine):
+    """Run a coroutine on a new loop, asyncio.run needs Python 3.7"""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+class TestMessages:
+    def receive(self, data, key):
+        async def receive():
+            reader = asyncio.StreamReader()
+            reader.feed_data(data)
+            reader.feed_eof()
+            return await distributed.recv_message(reader, key)
+
+        return run(receive())
+
+    def send(self, message, key):
+        writer = mock.Mock()
+
+        async def drain():
+            pass
+
+        writer.drain = drain
+        run(distributed.send_message(writer, message, key))
+        return writer.write.call_args[0][0]
+
+    def test_signed(self):
+        assert self.receive(self.send({"name": "a"}, b"key"), b"key") == {"name": "a"}
+
+    def test_invalid_signature(self):
+        """Messages with an invalid signature aren't unpickled"""
+        data = self.send(Unpickled(), b"other")
+        with pytest.raises(distributed.InvalidSignature):
+            self.receive(data, b"key")
+        assert Unpickled.instances == []
@@ -0,0 +1,88 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import sys
+
+import pytest
+
+from ixian.exceptions import DependencyCycle
+from ixian.graph import Graph
+from ixian.task import TaskRunner
+from ixian.tests import fake
+
+
+def chain(length: int) -> TaskRunner:
+    """Build a single chain of runners `length` tasks deep, return the root"""
+    runner = None
+    for i in range(length):
+        runner = TaskRunner(name=f"chain_{i}", depends=[runner] if runner else [])
+    return runner
+
+
+class TestGraph:
+    def test_order(self, mock_environment):
+        """Tasks are ordered the same as the recursive tree walk"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        graph = Graph([root.__task__])
+        assert len(graph) == 7
+        assert "child_A" in graph
+        assert graph.order() == [
+            "grandchild_A1",
+            "grandchild_A2",
+            "child_A",
+            "grandchild_B1",
+            "grandchild_B2",
+            "child_B",
+            "root",
+        ]
+
+    def test_shared_dependency(self, mock_environment):
+        """Shared dependencies appear once and before every task that depends on them"""
+        root = fake.mock_task(name="root")
+        fake.mock_task(name="child_A", parent="root")
+        fake.mock_task(name="child_B", parent="root")
+        fake.mock_task(name="shared", parent=["child_A", "child_B"])
+        graph = Graph([root.__task__])
+        assert graph.order() == ["shared", "child_A", "child_B", "root"]
+        assert graph.dependents["shared"] == ["child_A", "child_B"]
+
+    def test_multiple_roots(self, mock_environment):
+        root = fake.mock_single_dependency_node_at_end_of_branch_1()
+        other = fake.mock_task(name="other", depends=["child_B"])
+        graph = Graph([root.__task__, other.__task__])
+        assert graph.roots == ["root", "other"]
+        assert graph.order() == ["child_A", "grandchild_B1", "child_B", "root", "other"]
+
+    def test_cycle(self, mock_environment):
+        fake.mock_task(name="root", depends=["child"])
+        fake.mock_task(name="child", depends=["grandchild"])
+        grandchild = fake.mock_task(name="grandchild", depends=["child"])
+        graph = Graph([grandchild.__task__])
+        with pytest.raises(DependencyCycle, match="child -> grandchild -> child") as error:
+            graph.order()
+        assert error.value.cycle == ["child", "grandchild", "child"]
+
+    def test_deep_graph(self, mock_environment):
+        """Deep graphs don't hit the recursion limit"""
+        length = sys.getrecursionlimit() * 2
+        root = chain(length)
+        order = Graph([root]).order()
+        assert len(order) == length
+        assert order[0] == "chain_0"
+        assert order[-1] == root.name
+
+        # tree and status are built from the same walk
+        tree = root.tree(flatten=False)
+        assert tree["name"] == root.name
+        assert len(root.tree()["dependencies"]) == length
@@ -0,0 +1,191 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import shutil
+import tarfile
+import threading
+import time
+import uuid
+from unittest import mock
+
+import pytest
+
+from ixian.check.store import get_store
+from ixian.config import CONFIG
+from ixian.modules.filesystem.file_hash import FileHash
+from ixian.remote_cache import CacheServer, RemoteCache
+from ixian.tests import fake
+from ixian.tests.test_distributed import free_port
+
+
+@pytest.fixture
+def server(tmp_path):
+    server = CacheServer(str(tmp_path / "server"), port=free_port())
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.close()
+    thread.join()
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    workspace = tmp_path / "workspace"
+    (workspace / "build").mkdir(parents=True)
+    (workspace / "build/app").write_text("app")
+    (workspace / "out.txt").write_text("out")
+    return workspace
+
+
+@pytest.fixture
+def remote(server, workspace):
+    remote = RemoteCache("http://{}:{}".format(*server.address), root=str(workspace))
+    yield remote
+    remote.close()
+
+
+def outputs(workspace):
+    return [str(workspace / "build"), str(workspace / "out.txt")]
+
+
+def put_archive(remote, key, files):
+    """Upload an archive with the given {name: content} files"""
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, content in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(content)
+            archive.addfile(info, io.BytesIO(content))
+    with remote.pool.request("PUT", f"/cache/{key}", buffer.getvalue()) as response:
+        assert response.status == 201
+
+
+class TestRemoteCache:
+    def test_store_restore(self, remote, workspace):
+        assert not remote.exists("key")
+        assert remote.store("key", outputs(workspace))
+        assert remote.exists("key")
+
+        shutil.rmtree(str(workspace / "build"))
+        (workspace / "out.txt").write_text("changed")
+        assert remote.restore("key", outputs(workspace))
+        assert (workspace / "build/app").read_text() == "app"
+        assert (workspace / "out.txt").read_text() == "out"
+
+    def test_stored_once(self, remote, workspace):
+        assert remote.store("key", outputs(workspace))
+        assert not remote.store("key", outputs(workspace))
+
+    def test_miss(self, remote, workspace):
+        assert not remote.restore("key", outputs(workspace))
+        assert (workspace / "out.txt").read_text() == "out"
+
+    def test_keep_alive(self, remote, workspace):
+        """Requests reuse the same connection"""
+        remote.exists("key")
+        connection = remote.pool.idle[0]
+        remote.store("key", outputs(workspace))
+        remote.restore("key", outputs(workspace))
+        assert remote.pool.idle == [connection]
+
+    def test_reconnect(self, remote, server, workspace):
+        """Idle connections closed by the server are replaced"""
+        remote.exists("key")
+        remote.pool.idle[0].sock.close()
+        assert not remote.exists("key")
+
+    def test_outside_root(self, remote, tmp_path):
+        with pytest.raises(ValueError, match="Output isn't in"):
+            remote.store("key", [str(tmp_path / "other")])
+
+    def test_unexpected_path(self, remote, workspace):
+        """Archives may only contain the outputs"""
+        put_archive(remote, "key", {"out.txt": b"out", "ixian.py": b"evil"})
+        with pytest.raises(ValueError, match="Unexpected path"):
+            remote.restore("key", [str(workspace / "out.txt")])
+        assert not (workspace / "ixian.py").exists()
+
+        put_archive(remote, "parent", {"../out.txt": b"out"})
+        with pytest.raises(ValueError, match="Invalid path"):
+            remote.restore("parent", [str(workspace / "out.txt")])
+
+    def test_missing_output(self, remote, workspace):
+        put_archive(remote, "key", {"out.txt": b"out"})
+        with pytest.raises(ValueError, match="missing build"):
+            remote.restore("key", outputs(workspace))
+
+    def test_unavailable(self, workspace):
+        remote = RemoteCache(f"http://127.0.0.1:{free_port()}", root=str(workspace))
+        with pytest.raises(ConnectionError):
+            remote.exists("key")
+
+
+class TestCacheServer:
+    def test_invalid_key(self, remote):
+        with remote.pool.request("GET", "/cache/../secret") as response:
+            assert response.status == 400
+
+    def test_evict(self, tmp_path, workspace):
+        server = CacheServer(str(tmp_path / "server"), port=free_port(), max_size=1)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.start()
+        remote = RemoteCache("http://{}:{}".format(*server.address), root=str(workspace))
+        try:
+            remote.store("a", outputs(workspace))
+            time.sleep(0.01)
+            remote.store("b", outputs(workspace))
+            assert not remote.exists("a")
+        finally:
+            remote.close()
+            server.close()
+            thread.join()
+
+
+class TestSharedCache:
+    def test_fresh_checkout(self, mock_environment, remote, workspace, monkeypatch):
+        """Outputs built by another machine are restored instead of running the task"""
+        source, output = workspace / "input", workspace / "output"
+        source.write_text("a")
+
+        def build():
+            output.write_text(source.read_text().upper())
+
+        # outputs are archived relative to the directory ix runs in
+        monkeypatch.chdir(str(workspace))
+        CONFIG.REMOTE_CACHE = remote.url
+        try:
+            # another machine builds the task
+            CONFIG.CACHE_DIR = "{TEMP_BUILDER}/other-cache"
+            checker = FileHash(str(source))
+            task = fake.mock_task(check=[checker], outputs=[str(output)])
+            task.mock.side_effect = build
+            task.__task__.execute([])
+            assert task.mock.call_count == 1
+
+            # fresh checkout: no outputs, saved state or local cache
+            output.unlink()
+            get_store().set(checker.filename(), None)
+            CONFIG.CACHE_DIR = f"{{TEMP_BUILDER}}/{uuid.uuid4()}"
+            with mock.patch("ixian.scheduler.logger") as mock_logger:
+                task.__task__.execute([])
+        finally:
+            del CONFIG.REMOTE_CACHE
+            del CONFIG.CACHE_DIR
+
+        assert task.mock.call_count == 1
+        assert output.read_text() == "A"
+        mock_logger.info.assert_called_with(
+            f"[cache] mock_task, restored outputs from {remote.url}."
+        )
@@ -20,6 +20,7 @@ import pytest
 from ixian import runner
 from ixian.exceptions import MockExit, AlreadyComplete, ExecuteFailed
 from ixian.runner import ExitCodes, ixian_path
+from ixian.tests import fake
 from ixian.tests.fake import build_test_args
 
 
@@ -112,6 +113,36 @@ class TestParser:
     def test_force_all(self):
         self.assertArgs(["--force-all", "foo"], task="foo", **{"force_all": True})
 
+    def test_jobs(self):
+        self.assertArgs(["--jobs", "4", "foo"], task="foo", jobs=4)
+        self.assertArgs(["-j", "4", "foo"], task="foo", jobs=4)
+
+    def test_timeout(self):
+        self.assertArgs(["--timeout", "2.5", "foo"], task="foo", timeout=2.5)
+
+    def test_output(self):
+        self.assertArgs(["--output", "prefix", "foo"], task="foo", output="prefix")
+
+    def test_keep_going(self):
+        self.assertArgs(["--keep-going", "foo"], task="foo", keep_going=True)
+        self.assertArgs(["-k", "foo"], task="foo", keep_going=True)
+
+    def test_plan(self):
+        self.assertArgs(["--plan", "foo"], task="foo", plan=True)
+
+    def test_watch(self):
+        self.assertArgs(["--watch", "foo"], task="foo", watch=True)
+
+    def test_daemon(self):
+        self.assertArgs(["--daemon"], task="help", daemon=True)
+
+    def test_workers(self):
+        self.assertArgs(
+            ["--workers", "host:8000,:8001", "foo"],
+            task="foo",
+            workers=[("host", 8000), ("127.0.0.1", 8001)],
+        )
+
     def test_run(self):
         self.assertArgs(["foo"], task="foo")
 
@@ -148,6 +179,39 @@ class TestParser:
         self.assertArgs(["foo", "bar", "--help"], task="foo", task_args=["bar", "--help"])
         self.assertArgs(["foo", "bar", "-h"], task="foo", task_args=["bar", "-h"])
 
+    def test_separator(self, mock_environment):
+        """Tasks before -- are targets, args after it are passed to the tasks"""
+        fake.mock_task(name="foo")
+        fake.mock_task(name="bar")
+        self.assertArgs(["foo", "--"], task="foo", targets=["foo"])
+        self.assertArgs(["--", "foo"], task="foo", targets=["foo"])
+        self.assertArgs(
+            ["foo", "bar", "--", "xoo", "-h"],
+            task="foo",
+            targets=["foo", "bar"],
+            task_args=["xoo", "-h"],
+        )
+        self.assertArgs(["foo", "--", "bar", "--"], task="foo", task_args=["bar", "--"])
+        self.assertArgs(["help", "foo", "--"], task="help", task_args=["foo", "--"])
+
+    def test_separator_in_task_args(self, mock_environment):
+        """-- after an arg that isn't a task is passed to the task, e.g. proxy tasks"""
+        fake.mock_task(name="npm")
+        self.assertArgs(
+            ["npm", "run", "build", "--", "--watch"],
+            task="npm",
+            task_args=["run", "build", "--", "--watch"],
+        )
+        self.assertArgs(["unknown", "--", "--watch"], task="unknown", task_args=["--", "--watch"])
+
+    def test_targets(self, mock_environment):
+        """Without a separator only the first arg is a task, even if the rest are tasks too"""
+        fake.mock_task(name="npm")
+        fake.mock_task(name="build")
+        self.assertArgs(["npm", "build"], task="npm", task_args=["build"])
+        self.assertArgs(["npm", "build", "xoo"], task="npm", task_args=["build", "xoo"])
+        self.assertArgs(["help", "npm"], task="help", task_args=["npm"])
+
 
 class TestRun:
     """
@@ -178,6 +242,18 @@ class TestRun:
     def test_force_all(self, mock_task, mock_parse_args):
         self.assertRan(mock_task, mock_parse_args, task="mock_task", **{"force_all": True})
 
+    def test_jobs(self, mock_task, mock_parse_args):
+        self.assertRan(mock_task, mock_parse_args, task="mock_task", jobs=4)
+
+    def test_keep_going(self, mock_task, mock_parse_args):
+        self.assertRan(mock_task, mock_parse_args, task="mock_task", keep_going=True)
+
+    def test_timeout(self, mock_task, mock_parse_args):
+        self.assertRan(mock_task, mock_parse_args, task="mock_task", timeout=10)
+
+    def test_output(self, mock_task, mock_parse_args):
+        self.assertRan(mock_task, mock_parse_args, task="mock_task", output="prefix")
+
     def test_run(self, mock_task, mock_parse_args):
         self.assertRan(mock_task, mock_parse_args, task="mock_task")
 
@@ -198,6 +274,62 @@ class TestRun:
         mock_task.mock.side_effect = ExecuteFailed
         assert runner.run() == ExitCodes.ERROR_TASK
 
+    def test_multiple_targets(self, mock_environment, mock_parse_args):
+        mock_parse_args.return_value = build_test_args(
+            task="foo", targets=["foo", "bar", "foo"], task_args=["arg"]
+        )
+        foo = fake.mock_task(name="foo")
+        bar = fake.mock_task(name="bar")
+        assert runner.run() == ExitCodes.SUCCESS
+        foo.mock.assert_called_once_with("arg")
+        bar.mock.assert_called_once_with("arg")
+
+    def test_multiple_targets_unknown_task(self, mock_environment, mock_parse_args):
+        mock_parse_args.return_value = build_test_args(task="foo", targets=["foo", "unknown"])
+        foo = fake.mock_task(name="foo")
+        assert runner.run() == ExitCodes.ERROR_UNKNOWN_TASK
+        foo.mock.assert_not_called()
+
+    def test_plan_stale(self, mock_environment, mock_parse_args, capsys):
+        mock_parse_args.return_value = build_test_args(task="root", plan=True)
+        root = fake.mock_tasks_with_failing_checkers()
+        assert runner.run() == ExitCodes.ERROR_STALE
+        root.assert_no_calls()
+        output = capsys.readouterr().out
+        assert output.startswith("PLAN\n")
+        assert "grandchild    checks failed" in output
+        assert "root          child will run" in output
+
+    def test_plan_complete(self, mock_environment, mock_parse_args, capsys):
+        mock_parse_args.return_value = build_test_args(task="root", plan=True)
+        root = fake.mock_tasks_with_passing_checkers()
+        assert runner.run() == ExitCodes.SUCCESS
+        root.assert_no_calls()
+        assert "root          complete" in capsys.readouterr().out
+
+    def test_watch(self, mock_task, mock_parse_args):
+        args = build_test_args(task="mock_task", watch=True, jobs=2)
+        mock_parse_args.return_value = args
+        with mock.patch("ixian.watch.watch") as watch:
+            assert runner.run() == ExitCodes.SUCCESS
+        # args are passed through after the runner pops the args it handles
+        watch.assert_called_once_with([mock_task.__task__], [], **args)
+        assert args["jobs"] == 2
+        mock_task.mock.assert_not_called()
+
+    def test_dependency_cycle(self, mock_environment, mock_parse_args):
+        mock_parse_args.return_value = build_test_args(task="root")
+        root = fake.mock_task(name="root", depends=["child"])
+        fake.mock_task(name="child", depends=["root"])
+        assert runner.run() == ExitCodes.ERROR_TASK
+        root.mock.assert_not_called()
+
+    def test_interrupted(self, mock_environment, mock_parse_args):
+        mock_parse_args.return_value = build_test_args(task="mock_task")
+        task = fake.mock_task()
+        task.mock.side_effect = KeyboardInterrupt
+        assert runner.run() == ExitCodes.ERROR_TASK
+
 
 class TestCLI:
     def test_init_errors(self, mock_init_exit_errors, mock_exit):
@@ -0,0 +1,970 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+import uuid
+from unittest import mock
+
+import pytest
+
+from ixian import builder, scheduler
+from ixian.check.store import SQLiteStore
+from ixian.config import CONFIG
+from ixian.exceptions import AlreadyComplete, ExecuteFailed, TaskTimeout
+from ixian.graph import Graph
+from ixian.modules.filesystem.file_hash import FileHash
+from ixian.task import TASKS, Task, execute as task_execute, plan as task_plan
+from ixian.tests import fake
+from ixian.tests.mock_checker import FailingCheck, PassingCheck
+from ixian.tests.test_checker import MockMultiValueChecker
+from ixian.utils import process
+from ixian.utils.filesystem import FileLock
+
+
+def record_order(order, name):
+    """Return a side effect that records the order tasks ran in"""
+
+    def side_effect(*args, **kwargs):
+        order.append(name)
+
+    return side_effect
+
+
+class TestGetJobs:
+    def test_default(self):
+        assert scheduler.get_jobs() == 1
+        assert scheduler.get_jobs(None) == 1
+
+    def test_jobs(self):
+        assert scheduler.get_jobs(4) == 4
+
+    def test_cpu_count(self):
+        with mock.patch("ixian.scheduler.os.cpu_count", return_value=16):
+            assert scheduler.get_jobs(0) == 16
+            assert scheduler.get_jobs(-1) == 16
+
+
+class TestBuildNodes:
+    def test_nodes(self, mock_environment):
+        root = fake.mock_nested_multiple_dependency_nodes()
+        nodes = scheduler.build_nodes(Graph([root.__task__]), True, True, False, False)
+
+        # reverse topological order, parents are cleaned before their dependencies
+        assert [node.name for node in nodes] == [
+            "root",
+            "child_B",
+            "grandchild_B2",
+            "grandchild_B1",
+            "child_A",
+            "grandchild_A2",
+            "grandchild_A1",
+        ]
+
+        # topological order, the order a single job runs them in
+        ordered = sorted(nodes, key=lambda node: node.index)
+        assert [node.name for node in ordered] == [
+            "grandchild_A1",
+            "grandchild_A2",
+            "child_A",
+            "grandchild_B1",
+            "grandchild_B2",
+            "child_B",
+            "root",
+        ]
+
+        # root options only apply to the root
+        assert nodes[0].clean and nodes[0].force
+        assert not any(node.clean or node.force for node in nodes[1:])
+
+    def test_shared_dependency(self, mock_environment):
+        """Every task that depends on a shared dependency waits for it"""
+        root = fake.mock_task(name="root")
+        fake.mock_task(name="child_A", parent="root")
+        fake.mock_task(name="child_B", parent="root")
+        fake.mock_task(name="shared", parent=["child_A", "child_B"])
+        nodes = {
+            node.name: node
+            for node in scheduler.build_nodes(Graph([root.__task__]), False, False, False, False)
+        }
+        assert [node.name for node in nodes["shared"].dependents] == ["child_A", "child_B"]
+
+
+class TestParallelExecute:
+    def test_serial_order(self, mock_environment):
+        """A single job runs tasks in the same order as the recursive tree walk"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        order = []
+        for task in root.mock_tests:
+            task.mock.side_effect = record_order(order, task.name)
+
+        root.__task__.execute([], jobs=1)
+        assert order == [
+            "grandchild_A1",
+            "grandchild_A2",
+            "child_A",
+            "grandchild_B1",
+            "grandchild_B2",
+            "child_B",
+            "root",
+        ]
+
+    def test_independent_tasks_run_in_parallel(self, mock_environment):
+        """Independent dependencies run at the same time"""
+        root = fake.mock_single_dependency_node_at_end_of_branch_1()
+
+        # both tasks must reach the barrier at once. If they ran serially it would time out.
+        barrier = threading.Barrier(2, timeout=5)
+        root.child_A.mock.side_effect = lambda: barrier.wait()
+        root.grandchild_B1.mock.side_effect = lambda: barrier.wait()
+
+        root.__task__.execute([], jobs=2)
+        for task in root.mock_tests:
+            task.mock.assert_called_once_with()
+
+    def test_dependencies_run_first(self, mock_environment):
+        """Parents only start after all of their dependencies finish"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        order = []
+        for task in root.mock_tests:
+            task.mock.side_effect = record_order(order, task.name)
+
+        root.__task__.execute([], jobs=4)
+        assert order[-1] == "root"
+        for child, grandchildren in (
+            ("child_A", ["grandchild_A1", "grandchild_A2"]),
+            ("child_B", ["grandchild_B1", "grandchild_B2"]),
+        ):
+            for grandchild in grandchildren:
+                assert order.index(grandchild) < order.index(child)
+
+    def test_parent_runs_if_dependency_ran(self, mock_environment):
+        """Checkers are only saved after success and parents run if any dependency ran"""
+        root = fake.mock_nested_single_dependency_nodes(
+            {"check": [FailingCheck("root")]},
+            {"check": [FailingCheck("child")]},
+            {"check": [FailingCheck("grandchild")]},
+        )
+        root.__task__.execute([], jobs=4)
+        root.assert_all_tasks_ran()
+        root.assert_all_checkers_saved()
+
+    def test_checks_prefetched(self, mock_environment):
+        """Checks for the whole graph are evaluated at once, even with a single job"""
+        barrier = threading.Barrier(3, timeout=5)
+        root = fake.mock_nested_single_dependency_nodes(
+            {"check": [PassingCheck("root")]},
+            {"check": [PassingCheck("child")]},
+            {"check": [PassingCheck("grandchild")]},
+        )
+        for task in root.mock_tasks.values():
+            task.__task__.checkers[0].check.side_effect = lambda: barrier.wait() >= 0
+
+        with pytest.raises(AlreadyComplete):
+            root.__task__.execute([], jobs=1)
+        root.assert_no_calls()
+
+    def test_failure_stops_new_tasks(self, mock_environment):
+        """A failing task stops tasks that haven't started yet"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        root.grandchild_A1.mock.side_effect = ExecuteFailed
+
+        with pytest.raises(ExecuteFailed):
+            root.__task__.execute([], jobs=1)
+        root.grandchild_A1.mock.assert_called_once_with()
+        root.child_A.mock.assert_not_called()
+        root.mock.assert_not_called()
+
+
+class TestKeepGoing:
+    def test_independent_branches_run(self, mock_environment):
+        """A failure only blocks the tasks that depend on it"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        root.grandchild_A1.mock.side_effect = ExecuteFailed("A1 broke")
+
+        with pytest.raises(ExecuteFailed) as error:
+            root.__task__.execute([], jobs=2, keep_going=True)
+        root.grandchild_A2.mock.assert_called_once_with()
+        root.child_B.mock.assert_called_once_with()
+        root.grandchild_B1.mock.assert_called_once_with()
+        root.grandchild_B2.mock.assert_called_once_with()
+        root.child_A.mock.assert_not_called()
+        root.mock.assert_not_called()
+
+        assert str(error.value) == (
+            "1 failed, 2 blocked, 0 skipped\n"
+            "  failed: grandchild_A1\n"
+            "  blocked: child_A, root"
+        )
+
+    def test_summary(self, mock_environment):
+        """Summary lists failed, blocked and skipped tasks"""
+        root = fake.mock_task(name="root")
+        fake.mock_task(name="child_A", parent="root", check=[PassingCheck("child_A")])
+        child_B = fake.mock_task(name="child_B", parent="root")
+        child_C = fake.mock_task(name="child_C", parent="root")
+        child_B.mock.side_effect = ExecuteFailed
+        child_C.mock.side_effect = ValueError("unexpected")
+
+        with pytest.raises(ExecuteFailed) as error:
+            root.__task__.execute([], keep_going=True)
+        assert str(error.value) == (
+            "2 failed, 1 blocked, 1 skipped\n"
+            "  failed: child_B, child_C\n"
+            "  blocked: root\n"
+            "  skipped: child_A"
+        )
+
+    def test_no_failures(self, mock_environment):
+        root = fake.mock_nested_multiple_dependency_nodes()
+        root.__task__.execute([], jobs=2, keep_going=True)
+        root.assert_all_tasks_ran()
+
+
+def plan_reasons(runners, **kwargs):
+    """Return `(name, outcome, reason)` for each task in a plan"""
+    return [
+        (node.name, node.outcome, node.reason)
+        for node in task_plan(runners, **kwargs)
+        if node.runner.func
+    ]
+
+
+class TestPlan:
+    def test_stale(self, mock_environment):
+        root = fake.mock_tasks_with_failing_checkers()
+        assert plan_reasons([root.__task__]) == [
+            ("grandchild", scheduler.RAN, "checks failed"),
+            ("child", scheduler.RAN, "grandchild will run"),
+            ("root", scheduler.RAN, "child will run"),
+        ]
+
+    def test_complete(self, mock_environment):
+        root = fake.mock_tasks_with_passing_checkers()
+        assert plan_reasons([root.__task__]) == [
+            ("grandchild", scheduler.COMPLETE, "complete"),
+            ("child", scheduler.COMPLETE, "complete"),
+            ("root", scheduler.COMPLETE, "complete"),
+        ]
+
+    def test_force(self, mock_environment):
+        root = fake.mock_tasks_with_passing_checkers()
+        assert plan_reasons([root.__task__], force=True) == [
+            ("grandchild", scheduler.COMPLETE, "complete"),
+            ("child", scheduler.COMPLETE, "complete"),
+            ("root", scheduler.RAN, "forced"),
+        ]
+        assert [outcome for _, outcome, _ in plan_reasons([root.__task__], force_all=True)] == [
+            scheduler.RAN
+        ] * 3
+
+    def test_no_checks(self, mock_environment):
+        root = fake.mock_task(name="root", check=[PassingCheck("root")])
+        fake.mock_task(name="child", parent="root")
+        assert plan_reasons([root.__task__]) == [
+            ("child", scheduler.RAN, "no checks"),
+            ("root", scheduler.RAN, "child will run"),
+        ]
+
+    def test_outputs_missing(self, mock_environment, tmp_path):
+        task = fake.mock_task(check=[PassingCheck("task")], outputs=[f"{tmp_path}/out.txt"])
+        assert plan_reasons([task.__task__]) == [
+            ("mock_task", scheduler.RAN, "outputs missing"),
+        ]
+
+    def test_virtual_target(self, mock_environment):
+        """Virtual targets always run, so tasks that depend on them do too"""
+        root = fake.mock_task(name="root", depends=["virtual"], check=[PassingCheck("root")])
+        fake.mock_task(name="child", parent="virtual", check=[PassingCheck("child")])
+        assert plan_reasons([root.__task__]) == [
+            ("child", scheduler.COMPLETE, "complete"),
+            ("root", scheduler.RAN, "virtual will run"),
+        ]
+
+    def test_nothing_runs(self, mock_environment):
+        """Planning doesn't call funcs, clean functions or save checkers"""
+        root = fake.mock_tasks_with_clean_functions()
+        task_plan([root.__task__], clean_all=True)
+        root.assert_no_calls()
+        root.assert_cleaners_ran(default=False)
+
+        root = fake.mock_tasks_with_failing_checkers()
+        task_plan([root.__task__])
+        root.assert_no_calls()
+        root.assert_no_checkers_saved()
+
+    def test_checks_run_concurrently(self, mock_environment):
+        """Checks for the whole graph are evaluated at once"""
+        barrier = threading.Barrier(3, timeout=5)
+        root = fake.mock_nested_single_dependency_nodes(
+            {"check": [PassingCheck("root")]},
+            {"check": [PassingCheck("child")]},
+            {"check": [PassingCheck("grandchild")]},
+        )
+        for task in root.mock_tasks.values():
+            task.__task__.checkers[0].check.side_effect = lambda: barrier.wait() >= 0
+
+        nodes = task_plan([root.__task__])
+        assert all(node.outcome == scheduler.COMPLETE for node in nodes)
+
+    def test_checkers_run_concurrently(self, mock_environment):
+        """Each of a task's checkers is evaluated separately"""
+        barrier = threading.Barrier(2, timeout=5)
+        root = fake.mock_task(name="root", check=[PassingCheck("a"), PassingCheck("b")])
+        for checker in root.__task__.checkers:
+            checker.check.side_effect = lambda: barrier.wait() >= 0
+
+        nodes = task_plan([root.__task__])
+        assert nodes[0].outcome == scheduler.COMPLETE
+
+
+def track_running(running, peak, name):
+    """Return a side effect that records how many tasks run at once"""
+    lock = threading.Lock()
+
+    def side_effect(*args, **kwargs):
+        with lock:
+            running.add(name)
+            peak.append(len(running))
+        time.sleep(0.05)
+        with lock:
+            running.discard(name)
+
+    return side_effect
+
+
+class TestResources:
+    def mock_children(self, count, **kwargs):
+        root = fake.mock_task(name="root")
+        running, peak = set(), []
+        for i in range(count):
+            child = fake.mock_task(name=f"child_{i}", parent="root", **kwargs)
+            child.mock.side_effect = track_running(running, peak, child.name)
+        return root, peak
+
+    def test_capacity(self, mock_environment):
+        """Tasks sharing a resource don't run at the same time"""
+        CONFIG.RESOURCES = {"database": 1}
+        root, peak = self.mock_children(3, resources={"database": 1})
+        root.__task__.execute([], jobs=3)
+        assert len(peak) == 3
+        assert max(peak) == 1
+
+    def test_capacity_shared(self, mock_environment):
+        CONFIG.RESOURCES = {"mem_gb": 8}
+        root, peak = self.mock_children(4, resources={"mem_gb": 4})
+        root.__task__.execute([], jobs=4)
+        assert max(peak) == 2
+
+    def test_unknown_resource(self, mock_environment):
+        """Resources without a capacity are unlimited"""
+        root, peak = self.mock_children(3, resources={"docker": 1})
+        root.__task__.execute([], jobs=3)
+        assert max(peak) == 3
+
+    def test_over_capacity(self, mock_environment):
+        """Requests larger than the capacity are limited to the capacity"""
+        CONFIG.RESOURCES = {"docker": 1}
+        root, peak = self.mock_children(2, resources={"docker": 2})
+        with mock.patch("ixian.scheduler.logger") as logger:
+            root.__task__.execute([], jobs=2)
+        assert max(peak) == 1
+        logger.warning.assert_any_call(
+            "child_0 requests 2 docker but only 1 is available, limiting it to 1"
+        )
+
+    def test_other_tasks_start(self, mock_environment):
+        """Tasks without the resource start while a task waits for it"""
+        CONFIG.RESOURCES = {"docker": 1}
+        barrier = threading.Barrier(2, timeout=5)
+        root = fake.mock_task(name="root")
+        child_A = fake.mock_task(name="child_A", parent="root", resources={"docker": 1})
+        child_B = fake.mock_task(name="child_B", parent="root", resources={"docker": 1})
+        child_C = fake.mock_task(name="child_C", parent="root")
+        child_A.mock.side_effect = lambda: barrier.wait()
+        child_C.mock.side_effect = lambda: barrier.wait()
+
+        root.__task__.execute([], jobs=3)
+        child_B.mock.assert_called_once_with()
+
+
+class TestMultipleTargets:
+    def test_shared_dependency(self, mock_environment):
+        """Targets share a graph, common dependencies run once"""
+        root = fake.mock_single_dependency_node_at_end_of_branch_1()
+        other = fake.mock_task(name="other", depends=["child_B"])
+        return_values = task_execute([root.__task__, other.__task__], ["arg"], jobs=2)
+        assert return_values == [None, None]
+        root.mock.assert_called_once_with("arg")
+        other.mock.assert_called_once_with("arg")
+        root.child_B.mock.assert_called_once_with()
+        root.grandchild_B1.mock.assert_called_once_with()
+
+    def test_target_is_dependency(self, mock_environment):
+        """A target that is also a dependency of another target uses the root options"""
+        root = fake.mock_tasks_with_passing_checkers()
+        task_execute([root.__task__, root.child.__task__], [], force=True)
+        root.mock.assert_called_once_with()
+        root.child.mock.assert_called_once_with()
+        root.grandchild.mock.assert_not_called()
+
+    def test_already_complete(self, mock_environment):
+        """AlreadyComplete is only raised if every target was complete"""
+        root = fake.mock_tasks_with_passing_checkers()
+        other = fake.mock_task(name="other")
+        task_execute([root.__task__, other.__task__], [])
+        other.mock.assert_called_once_with()
+
+        other = fake.mock_task(name="other_complete", check=[PassingCheck("other")])
+        with pytest.raises(AlreadyComplete):
+            task_execute([root.__task__, other.__task__], [])
+
+
+class TestPriority:
+    def test_critical_path(self, mock_environment):
+        """Priority is the longest path of estimated durations from a node to the root"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        nodes = scheduler.build_nodes(Graph([root.__task__]), False, False, False, False)
+        scheduler.prioritize(nodes, {"root": 1, "child_A": 2, "grandchild_A1": 3, "child_B": 10})
+        priorities = {node.name: node.priority for node in nodes}
+        assert priorities == {
+            "root": 1,
+            "child_A": 3,
+            "grandchild_A1": 6,
+            "grandchild_A2": 3,
+            "child_B": 11,
+            "grandchild_B1": 11,
+            "grandchild_B2": 11,
+        }
+
+    def test_longest_path_starts_first(self, mock_environment):
+        """Ready tasks on the longest recorded path start first"""
+        root = fake.mock_nested_multiple_dependency_nodes()
+        builder.write(scheduler.DURATIONS_FILE, json.dumps({"grandchild_B2": 10}))
+        order = []
+        for task in root.mock_tests:
+            task.mock.side_effect = record_order(order, task.name)
+
+        root.__task__.execute([], jobs=1)
+        assert order == [
+            "grandchild_B2",
+            "grandchild_A1",
+            "grandchild_A2",
+            "child_A",
+            "grandchild_B1",
+            "child_B",
+            "root",
+        ]
+
+    def test_weight(self, mock_environment):
+        """Static weights are used for tasks without a recorded duration"""
+        root = fake.mock_task(name="root")
+        fake.mock_task(name="child_A", parent="root")
+        fake.mock_task(name="child_B", parent="root", weight=5)
+        nodes = scheduler.build_nodes(Graph([root.__task__]), False, False, False, False)
+        scheduler.prioritize(nodes, {})
+        assert [node.name for node in sorted(nodes)] == ["child_B", "child_A", "root"]
+
+        # recorded durations replace the weight
+        scheduler.prioritize(nodes, {"child_A": 10})
+        assert [node.name for node in sorted(nodes)] == ["child_A", "child_B", "root"]
+
+    def test_durations_recorded(self, mock_environment):
+        """Each task that runs records it's duration"""
+        root = fake.mock_nested_single_dependency_nodes()
+        root.__task__.execute([])
+        durations = scheduler.load_durations()
+        assert sorted(durations) == ["child", "grandchild", "root"]
+        assert all(duration >= 0 for duration in durations.values())
+
+    def test_durations_not_recorded_for_skipped_tasks(self, mock_environment):
+        root = fake.mock_tasks_with_passing_checkers()
+        root.__task__.execute([], force=True)
+        assert sorted(scheduler.load_durations()) == ["root"]
+
+    def test_durations_merged(self, mock_environment):
+        """Durations saved by other processes during the run are kept"""
+
+        def other_process():
+            builder.write(scheduler.DURATIONS_FILE, json.dumps({"other": 1.0}))
+
+        root = fake.mock_task(name="root")
+        root.mock.side_effect = other_process
+        root.__task__.execute([])
+        assert sorted(scheduler.load_durations()) == ["other", "root"]
+
+    def test_invalid_durations(self, mock_environment):
+        builder.write(scheduler.DURATIONS_FILE, "not json")
+        assert scheduler.load_durations() == {}
+
+
+class ProcessInfo(Task):
+    """Reports where it ran. Spawned workers import it by it's class path."""
+
+    name = "process_info"
+    executor = "process"
+
+    def execute(self, *args):
+        return os.getpid(), CONFIG.PROJECT_NAME, args
+
+
+class ProcessHang(Task):
+    name = "process_hang"
+    executor = "process"
+    timeout = 0.5
+
+    def execute(self, *args):
+        time.sleep(30)
+
+
+class TestProcessExecutor:
+    def test_unknown_executor(self, mock_environment):
+        with pytest.raises(ValueError, match="Unknown executor"):
+            fake.mock_task(executor="unknown")
+
+    def test_process_task(self, mock_environment):
+        """Tasks with executor=process run in a worker process"""
+        task = ProcessInfo()
+        pid, project_name, args = task.__task__.execute(["arg"])
+        assert pid != os.getpid()
+        assert project_name == "unittests"
+        assert args == ("arg",)
+
+    @pytest.mark.skipif(sys.version_info < (3, 7), reason="3.6 pools can't spawn workers")
+    def test_spawned(self, mock_environment):
+        """Workers are spawned, not forked"""
+        pool = scheduler.Scheduler([]).process_pool
+        try:
+            assert pool._mp_context.get_start_method() == "spawn"
+        finally:
+            pool.shutdown()
+
+    def test_mixed_executors(self, mock_environment):
+        """Process tasks run alongside thread tasks"""
+        root = ProcessInfo()
+        child = fake.mock_task(name="child", parent="process_info")
+        pid, _, _ = root.__task__.execute([], jobs=2)
+        assert pid != os.getpid()
+        child.mock.assert_called_once_with()
+
+    def test_process_timeout(self, mock_environment):
+        """Workers running a process task that timed out are terminated, the pool is replaced"""
+        task = ProcessHang()
+        start = time.monotonic()
+        with pytest.raises(TaskTimeout):
+            task.__task__.execute([])
+        assert time.monotonic() - start < 5
+
+        pid, _, _ = ProcessInfo().__task__.execute([])
+        assert pid != os.getpid()
+
+    def test_kill_process_pool(self, mock_environment):
+        """Workers are terminated and tasks waiting for one are cancelled"""
+        instance = scheduler.Scheduler([])
+        pool = instance.process_pool
+        running = pool.submit(time.sleep, 30)
+        instance.process_futures.add(running)
+        waiting = pool.submit(time.sleep, 30)
+        instance.process_futures.add(waiting)
+        workers = scheduler.pool_processes(pool)
+        assert workers
+
+        instance.kill_process_pool()
+        assert waiting.cancelled()
+        for worker in workers:
+            worker.join(5)
+            assert not worker.is_alive()
+        assert instance._process_pool is None
+
+    def test_execute_in_process_imports_task(self, mock_environment):
+        """Workers that don't inherit the registry import and register the task class"""
+        assert "test_task" not in TASKS
+        scheduler.execute_in_process(
+            CONFIG.snapshot(),
+            "ixian.tests.mocks.modules.functional.tasks.TestTask",
+            "test_task",
+            [],
+            False,
+        )
+        assert "test_task" in TASKS
+
+
+class TestAsyncTasks:
+    def test_async_task(self, mock_environment):
+        """Coroutine tasks are awaited on the event loop"""
+
+        async def execute(self, *args):
+            await asyncio.sleep(0)
+            return args
+
+        task = fake.mock_task(execute=execute)
+        assert asyncio.iscoroutinefunction(task.__task__.func)
+        assert task.__task__.execute(["arg"]) == ("arg",)
+
+    def test_async_tasks_overlap(self, mock_environment):
+        """Coroutine tasks overlap on a single thread"""
+        started = []
+        threads = set()
+
+        async def execute(self, *args):
+            started.append(self.name)
+            threads.add(threading.current_thread())
+            # wait for the other task to start. If tasks ran one at a time this would time out.
+            await asyncio.wait_for(wait_for_count(started, 2), timeout=5)
+
+        root = fake.mock_task(name="root")
+        fake.mock_task(name="child_A", parent="root", execute=execute)
+        fake.mock_task(name="child_B", parent="root", execute=execute)
+
+        root.__task__.execute([], jobs=2)
+        assert sorted(started) == ["child_A", "child_B"]
+        assert len(threads) == 1
+        root.mock.assert_called_once_with()
+
+    def test_async_with_sync_dependency(self, mock_environment):
+        """Sync tasks are bridged onto the loop alongside coroutine tasks"""
+
+        async def execute(self, *args):
+            return "async"
+
+        root = fake.mock_task(name="root", execute=execute)
+        child = fake.mock_task(name="child", parent="root")
+        assert root.__task__.execute([], jobs=2) == "async"
+        child.mock.assert_called_once_with()
+
+
+async def wait_for_count(items, count):
+    while len(items) < count:
+        await asyncio.sleep(0.01)
+
+
+def run_script(tmp_path, name, body):
+    """Return a task execute method that runs a shell script"""
+    path = f"{tmp_path}/{name}.sh"
+    with open(path, "w") as file:
+        file.write(body)
+
+    def execute(self, *args):
+        process.raise_for_status(process.execute(f"sh {path}"))
+
+    return execute
+
+
+def wait_for_file(path, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline, f"{path} wasn't created"
+        time.sleep(0.01)
+
+
+class TestTimeouts:
+    def test_task_timeout(self, mock_environment, tmp_path):
+        """A task running longer than it's timeout is killed and fails"""
+        task = fake.mock_task(
+            timeout=0.2,
+            execute=run_script(tmp_path, "hang", "sleep 30"),
+            check=[FailingCheck("mock_task")],
+        )
+        start = time.monotonic()
+        with pytest.raises(TaskTimeout, match="mock_task timed out after 0.2s"):
+            task.__task__.execute([])
+        assert time.monotonic() - start < 5
+        task.__task__.checkers[0].save.assert_not_called()
+
+    def test_global_timeout(self, mock_environment, tmp_path):
+        """The scheduler's timeout applies to tasks without their own"""
+        task = fake.mock_task(execute=run_script(tmp_path, "hang", "sleep 30"))
+        with pytest.raises(TaskTimeout):
+            task.__task__.execute([], timeout=0.2)
+
+    def test_task_timeout_overrides_global(self, mock_environment, tmp_path):
+        task = fake.mock_task(timeout=10, execute=run_script(tmp_path, "slow", "sleep 0.3"))
+        task.__task__.execute([], timeout=0.1)
+
+    def test_async_timeout(self, mock_environment):
+        """Coroutine tasks are cancelled"""
+        cancelled = []
+
+        async def execute(self, *args):
+            try:
+                await asyncio.sleep(30)
+            except asyncio.CancelledError:
+                cancelled.append(self.name)
+                raise
+
+        task = fake.mock_task(timeout=0.1, execute=execute)
+        with pytest.raises(TaskTimeout):
+            task.__task__.execute([])
+        assert cancelled == ["mock_task"]
+
+    def test_cancels_running_siblings(self, mock_environment, tmp_path):
+        """In fail fast mode a timeout kills the other running tasks"""
+        root = fake.mock_task(name="root")
+        hang_a = run_script(tmp_path, "a", "sleep 30")
+        hang_b = run_script(tmp_path, "b", "sleep 30")
+        fake.mock_task(name="child_A", parent="root", timeout=0.2, execute=hang_a)
+        fake.mock_task(name="child_B", parent="root", execute=hang_b)
+
+        start = time.monotonic()
+        with pytest.raises(TaskTimeout):
+            root.__task__.execute([], jobs=2)
+        assert time.monotonic() - start < 5
+        root.mock.assert_not_called()
+
+    def test_keep_going(self, mock_environment, tmp_path):
+        """With keep going a timeout is a failure like any other"""
+        root = fake.mock_task(name="root")
+        hang = run_script(tmp_path, "a", "sleep 30")
+        fake.mock_task(name="child_A", parent="root", timeout=0.2, execute=hang)
+        child_B = fake.mock_task(name="child_B", parent="root")
+
+        with pytest.raises(ExecuteFailed, match="  failed: child_A"):
+            root.__task__.execute([], jobs=2, keep_going=True)
+        child_B.mock.assert_called_once_with()
+
+
+class TestInterrupt:
+    def test_interrupt(self, mock_environment, tmp_path):
+        """KeyboardInterrupt is passed on to running subprocesses as SIGINT"""
+        body = (
+            f"trap 'touch {tmp_path}/interrupted; exit 1' INT\n"
+            f"touch {tmp_path}/started\n"
+            "while true; do sleep 0.05; done\n"
+        )
+        task = fake.mock_task(execute=run_script(tmp_path, "trap", body))
+
+        def interrupt():
+            wait_for_file(f"{tmp_path}/started")
+            signal.pthread_kill(threading.main_thread().ident, signal.SIGINT)
+
+        thread = threading.Thread(target=interrupt)
+        thread.start()
+        with pytest.raises(KeyboardInterrupt):
+            task.__task__.execute([])
+        thread.join()
+        assert os.path.exists(f"{tmp_path}/interrupted")
+
+    @pytest.mark.parametrize("signum", [signal.SIGTERM, signal.SIGHUP])
+    def test_terminate(self, mock_environment, tmp_path, signum):
+        """SIGTERM and SIGHUP are passed on to running subprocesses"""
+        body = (
+            f"trap 'touch {tmp_path}/terminated; exit 1' {signal.Signals(signum).name[3:]}\n"
+            f"touch {tmp_path}/started\n"
+            "while true; do sleep 0.05; done\n"
+        )
+        task = fake.mock_task(execute=run_script(tmp_path, "trap", body))
+
+        def terminate():
+            wait_for_file(f"{tmp_path}/started")
+            signal.pthread_kill(threading.main_thread().ident, signum)
+
+        handler = signal.getsignal(signum)
+        thread = threading.Thread(target=terminate)
+        thread.start()
+        with pytest.raises(KeyboardInterrupt):
+            task.__task__.execute([])
+        thread.join()
+        assert os.path.exists(f"{tmp_path}/terminated")
+        assert signal.getsignal(signum) == handler
+
+
+class TestPrefixedOutput:
+    def test_prefixed(self, mock_environment, tmp_path, capsys):
+        """Output of subprocesses is prefixed with the task's name"""
+        root = fake.mock_task(name="root", execute=run_script(tmp_path, "root", "echo root"))
+        fake.mock_task(
+            name="child", parent="root", execute=run_script(tmp_path, "child", "echo child")
+        )
+        root.__task__.execute([], jobs=2, output="prefix")
+        assert capsys.readouterr().out == "child | child\nroot | root\n"
+
+    def test_failure_dumps_output(self, mock_environment, tmp_path, capsys):
+        """The output of a failed task is written again in one block"""
+        task = fake.mock_task(execute=run_script(tmp_path, "fail", "echo one\necho two\nexit 1"))
+        with pytest.raises(ExecuteFailed):
+            task.__task__.execute([], output="prefix")
+        assert capsys.readouterr().out == (
+            "mock_task | one\n"
+            "mock_task | two\n"
+            "---- output of mock_task ----\n"
+            "one\n"
+            "two\n"
+            "----\n"
+        )
+
+    def test_stream(self, mock_environment, tmp_path, capfd):
+        """By default subprocesses write to the terminal"""
+        task = fake.mock_task(execute=run_script(tmp_path, "echo", "echo hello"))
+        task.__task__.execute([])
+        assert capfd.readouterr().out == "hello\n"
+
+
+class TestLocks:
+    def hold_lock(self, name):
+        """Lock a task as if another process were running it"""
+        lock = FileLock(builder.get_path(f"{scheduler.LOCKS_DIR}/{name}.lock"))
+        assert lock.acquire(blocking=False)
+        return lock
+
+    def release_later(self, lock, before_release=None):
+        def release():
+            time.sleep(0.2)
+            if before_release:
+                before_release()
+            lock.release()
+
+        thread = threading.Thread(target=release)
+        thread.start()
+        return thread
+
+    def test_waits_and_skips(self, mock_environment):
+        """A task completed by the process holding it's lock is skipped"""
+        checker = MockMultiValueChecker(str(uuid.uuid4()))
+        task = fake.mock_task(check=[checker])
+        thread = self.release_later(self.hold_lock("mock_task"), checker.save)
+        with mock.patch("ixian.scheduler.logger") as mock_logger:
+            with pytest.raises(AlreadyComplete):
+                task.__task__.execute([])
+        thread.join()
+        task.mock.assert_not_called()
+        mock_logger.info.assert_called_with("[wait] mock_task is running in another process")
+
+    def test_waits_and_runs(self, mock_environment):
+        """A task is run once the lock is released if it's still incomplete"""
+        task = fake.mock_task(check=[MockMultiValueChecker(str(uuid.uuid4()))])
+        lock = self.hold_lock("mock_task")
+        thread = self.release_later(lock)
+        task.__task__.execute([])
+        thread.join()
+        task.mock.assert_called_once_with()
+
+    def test_saved_after_checks(self, mock_environment):
+        """A task completed by another process after it was checked is skipped"""
+        checker = MockMultiValueChecker(str(uuid.uuid4()))
+        x = fake.mock_task(name="x", check=[MockMultiValueChecker(str(uuid.uuid4()))])
+        y = fake.mock_task(name="y", check=[checker])
+        # the other process finishes y while x runs, it never holds the lock when y is locked.
+        x.mock.side_effect = checker.save
+
+        scheduler.execute([x.__task__, y.__task__])
+        x.mock.assert_called_once_with()
+        y.mock.assert_not_called()
+
+    def test_sqlite_store(self, mock_environment, tmp_path):
+        """State saved by another process is read after waiting"""
+        CONFIG.BUILDER = str(tmp_path)
+        CONFIG.CHECK_STORE = "sqlite"
+        checker = MockMultiValueChecker(str(uuid.uuid4()))
+        task = fake.mock_task(check=[checker])
+        # load the store before the state is saved
+        assert checker.saved_state() is None
+
+        other = SQLiteStore()
+
+        def save():
+            other.set(checker.filename(), checker.state())
+            other.close()
+
+        try:
+            thread = self.release_later(self.hold_lock("mock_task"), save)
+            with pytest.raises(AlreadyComplete):
+                task.__task__.execute([])
+            thread.join()
+            task.mock.assert_not_called()
+        finally:
+            del CONFIG.CHECK_STORE
+            del CONFIG.BUILDER
+
+
+@pytest.fixture
+def output_cache(mock_environment):
+    CONFIG.CACHE_DIR = "{TEMP_BUILDER}/cache"
+    yield
+    del CONFIG.CACHE_DIR
+
+
+class TestOutputCache:
+    def build_task(self, tmp_path):
+        """Task that writes an upper case copy of it's input"""
+        source, output = tmp_path / "input", tmp_path / "output"
+        source.write_text("a")
+
+        def build():
+            output.write_text(source.read_text().upper())
+
+        task = fake.mock_task(check=[FileHash(str(source))], outputs=[str(output)])
+        task.mock.side_effect = build
+        return task, source, output
+
+    def test_restore(self, output_cache, tmp_path):
+        """Outputs built from the same inputs are restored instead of running the task"""
+        task, source, output = self.build_task(tmp_path)
+        task.__task__.execute([])
+        source.write_text("b")
+        task.__task__.execute([])
+        assert output.read_text() == "B"
+        assert task.mock.call_count == 2
+
+        source.write_text("a")
+        with mock.patch("ixian.scheduler.logger") as mock_logger:
+            task.__task__.execute([])
+        assert output.read_text() == "A"
+        assert task.mock.call_count == 2
+        mock_logger.info.assert_called_with("[cache] mock_task, restored outputs.")
+
+        # checkers were saved, the task is complete
+        with pytest.raises(AlreadyComplete):
+            task.__task__.execute([])
+
+    def test_deleted_output(self, output_cache, tmp_path):
+        """Deleted outputs are restored even though the task's checks pass"""
+        task, source, output = self.build_task(tmp_path)
+        task.__task__.execute([])
+        output.unlink()
+        task.__task__.execute([])
+        assert output.read_text() == "A"
+        task.mock.assert_called_once_with()
+
+    def test_deleted_output_not_cached(self, output_cache, tmp_path):
+        """Deleted outputs that aren't cached are built again"""
+        task, source, output = self.build_task(tmp_path)
+        task.__task__.execute([])
+        output.unlink()
+        shutil.rmtree(CONFIG.format(CONFIG.CACHE_DIR))
+        task.__task__.execute([])
+        assert output.read_text() == "A"
+        assert task.mock.call_count == 2
+
+    def test_force(self, output_cache, tmp_path):
+        """Forced tasks run even if their outputs are cached"""
+        task, source, output = self.build_task(tmp_path)
+        task.__task__.execute([])
+        task.__task__.execute([], force=True)
+        assert task.mock.call_count == 2
+
+    def test_missing_output(self, output_cache, tmp_path):
+        """Tasks that don't create their outputs still succeed"""
+        task, source, output = self.build_task(tmp_path)
+        task.mock.side_effect = None
+        with mock.patch("ixian.scheduler.logger") as mock_logger:
+            task.__task__.execute([])
+        mock_logger.warning.assert_called_with(
+            f"Could not cache outputs of mock_task: Output doesn't exist: {output}"
+        )
@@ -0,0 +1,183 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import json
+import os
+import uuid
+
+import pytest
+
+from ixian.check import store
+from ixian.check.store import JSONStore, SQLiteStore, StateStore, get_store
+from ixian.config import CONFIG
+from ixian.tests.test_checker import MockMultiValueChecker
+
+
+class DictStore(StateStore):
+    """Store that keeps state in memory"""
+
+    def __init__(self):
+        super(DictStore, self).__init__()
+        self.states = {}
+        self.writes = []
+
+    def get(self, key):
+        return self.states.get(key, None)
+
+    def set_many(self, states):
+        self.writes.append(states)
+        self.states.update(states)
+
+
+@pytest.fixture
+def builder_dir(tmp_path):
+    """Use a temp dir as BUILDER"""
+    CONFIG.BUILDER = str(tmp_path)
+    yield tmp_path
+    del CONFIG.BUILDER
+
+
+@pytest.fixture
+def sqlite_store(builder_dir):
+    sqlite_store = SQLiteStore()
+    yield sqlite_store
+    sqlite_store.close()
+
+
+class TestStateStore:
+    def test_transaction(self):
+        """State set in a transaction is saved once it exits"""
+        dict_store = DictStore()
+        with dict_store.transaction():
+            dict_store.set("a", {"a": 1})
+            with dict_store.transaction():
+                dict_store.set("b", {"b": 1})
+            assert dict_store.writes == []
+        assert dict_store.writes == [{"a": {"a": 1}, "b": {"b": 1}}]
+
+    def test_transaction_error(self):
+        """Nothing is saved if the block raises"""
+        dict_store = DictStore()
+        with pytest.raises(ValueError):
+            with dict_store.transaction():
+                dict_store.set("a", {"a": 1})
+                raise ValueError
+        dict_store.set("b", {"b": 1})
+        assert dict_store.writes == [{"b": {"b": 1}}]
+
+
+class TestJSONStore:
+    def test_get_set(self, temp_builder):
+        json_store = JSONStore()
+        assert json_store.get("key") is None
+        json_store.set("key", {"a": 1})
+        assert json_store.get("key") == {"a": 1}
+
+
+class TestSQLiteStore:
+    def test_get_set(self, sqlite_store):
+        assert sqlite_store.get("key") is None
+        sqlite_store.set("key", {"a": 1})
+        assert sqlite_store.get("key") == {"a": 1}
+        assert os.path.exists(sqlite_store.path)
+
+        other = SQLiteStore(sqlite_store.path)
+        assert other.get("key") == {"a": 1}
+        other.close()
+
+    def test_loaded_once(self, sqlite_store):
+        """All state is loaded with one query"""
+        sqlite_store.set_many({"a": 1, "b": 2})
+        sqlite_store.close()
+
+        statements = []
+        sqlite_store.connect().set_trace_callback(statements.append)
+        assert sqlite_store.get("a") == 1
+        assert sqlite_store.get("b") == 2
+        assert sqlite_store.get("c") is None
+        assert statements == ["SELECT key, state FROM checks"]
+
+    def test_transaction(self, sqlite_store):
+        other = SQLiteStore(sqlite_store.path)
+        with sqlite_store.transaction():
+            sqlite_store.set("a", 1)
+            sqlite_store.set("b", 2)
+            assert other.get("a") is None
+        other.close()
+
+        other = SQLiteStore(sqlite_store.path)
+        assert other.get("a") == 1
+        assert other.get("b") == 2
+        other.close()
+
+    def test_state_copied(self, sqlite_store):
+        """Modifying returned state doesn't modify the stored state"""
+        sqlite_store.set("key", {"a": 1})
+        sqlite_store.get("key")["a"] = 2
+        assert sqlite_store.get("key") == {"a": 1}
+
+    def test_migrate(self, builder_dir):
+        """State saved by the json store is imported when the database is created"""
+        checks_dir = builder_dir / "checks"
+        checks_dir.mkdir()
+        (checks_dir / "a").write_text(json.dumps({"a": 1}))
+        (checks_dir / "invalid").write_text("{")
+
+        sqlite_store = SQLiteStore()
+        assert sqlite_store.get("a") == {"a": 1}
+        assert sqlite_store.get("invalid") is None
+        sqlite_store.close()
+
+        # only imported once
+        (checks_dir / "a").write_text(json.dumps({"a": 2}))
+        sqlite_store = SQLiteStore()
+        assert sqlite_store.get("a") == {"a": 1}
+        sqlite_store.close()
+
+
+class TestGetStore:
+    @pytest.fixture(autouse=True)
+    def reset_store(self):
+        yield
+        if store.STORE is not None:
+            store.STORE.close()
+        store.STORE = None
+        store.STORE_KEY = None
+        if "CHECK_STORE" in CONFIG.__dict__:
+            del CONFIG.CHECK_STORE
+
+    def test_default(self):
+        assert isinstance(get_store(), JSONStore)
+        assert get_store() is get_store()
+
+    def test_configured(self, builder_dir):
+        CONFIG.CHECK_STORE = "sqlite"
+        assert isinstance(get_store(), SQLiteStore)
+        CONFIG.CHECK_STORE = f"{__name__}.DictStore"
+        assert isinstance(get_store(), DictStore)
+
+    def test_unknown(self):
+        CONFIG.CHECK_STORE = "unknown"
+        with pytest.raises(ValueError, match="Unknown check store: unknown"):
+            get_store()
+
+    def test_checker(self, builder_dir):
+        """Checkers save state to the configured store"""
+        CONFIG.CHECK_STORE = "sqlite"
+        checker = MockMultiValueChecker(str(uuid.uuid4()))
+        assert not checker.check()
+        checker.save()
+        assert checker.check()
+        assert get_store().get(checker.filename()) == checker.state()
+        assert not os.path.exists(checker.file_path())
@@ -0,0 +1,251 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import threading
+
+import pytest
+
+from ixian import watch
+from ixian.exceptions import ExecuteFailed
+from ixian.graph import Graph
+from ixian.modules.filesystem.file_hash import FileHash
+from ixian.tests import fake
+from ixian.tests.mock_checker import FailingCheck
+
+
+def write(path, data="data"):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as file:
+        file.write(data)
+
+
+@pytest.fixture
+def watched_tasks(mock_environment, tmp_path):
+    """
+    Task tree with FileHash checkers:
+        - root        {tmp}/root.txt
+          - child_A   {tmp}/src_a/
+          - child_B   {tmp}/src_b/*.py
+    """
+    write(f"{tmp_path}/root.txt")
+    write(f"{tmp_path}/src_a/a.txt")
+    write(f"{tmp_path}/src_b/b.py")
+    root = fake.mock_task(name="root", check=[FileHash(f"{tmp_path}/root.txt")])
+    root.child_A = fake.mock_task(
+        name="child_A", parent="root", check=[FileHash(f"{tmp_path}/src_a")]
+    )
+    root.child_B = fake.mock_task(
+        name="child_B", parent="root", check=[FileHash(f"{tmp_path}/src_b/*.py")]
+    )
+    root.path = str(tmp_path)
+    return root
+
+
+class TestAffectedTasks:
+    def test_file_patterns(self, watched_tasks):
+        path = watched_tasks.path
+        assert watch.file_patterns(Graph([watched_tasks.__task__])) == {
+            "root": [f"{path}/root.txt"],
+            "child_A": [f"{path}/src_a"],
+            "child_B": [f"{path}/src_b/*.py"],
+        }
+
+    def test_watch_targets(self, tmp_path):
+        write(f"{tmp_path}/src/a.py")
+        os.makedirs(f"{tmp_path}/pkg/sub")
+        assert watch.watch_targets(
+            [f"{tmp_path}/pkg", f"{tmp_path}/src/*.py", f"{tmp_path}/missing/file"]
+        ) == {
+            f"{tmp_path}": False,
+            f"{tmp_path}/pkg": True,
+            f"{tmp_path}/src": False,
+        }
+
+    def test_relative_patterns(self, mock_environment, tmp_path, monkeypatch):
+        """Relative FileHash keys are watched in the working directory, not /"""
+        write(f"{tmp_path}/setup.py")
+        monkeypatch.chdir(str(tmp_path))
+        task = fake.mock_task(name="relative", check=[FileHash("setup.py")])
+        patterns = watch.file_patterns(Graph([task.__task__]))
+        assert patterns == {"relative": [f"{tmp_path}/setup.py"]}
+        assert watch.watch_targets(["setup.py", "missing/*.py"]) == {f"{tmp_path}": False}
+        assert watch.matches(f"{tmp_path}/setup.py", "setup.py")
+
+    def test_matches(self):
+        assert watch.matches("/src/a.py", "/src/a.py")
+        assert watch.matches("/src/dir/a.py", "/src")
+        assert watch.matches("/src/a.py", "/src/*.py")
+        assert watch.matches("/src/pkg/a.txt", "/src/p*")
+        assert not watch.matches("/src2/a.py", "/src")
+        assert not watch.matches("/src/a.txt", "/src/*.py")
+
+    def test_dependents_affected(self, watched_tasks):
+        graph = Graph([watched_tasks.__task__])
+        patterns = watch.file_patterns(graph)
+        changed = {f"{watched_tasks.path}/src_b/new.py"}
+        assert watch.affected_tasks(graph, patterns, changed) == {"child_B", "root"}
+        changed = {f"{watched_tasks.path}/root.txt"}
+        assert watch.affected_tasks(graph, patterns, changed) == {"root"}
+        changed = {f"{watched_tasks.path}/src_b/notes.txt"}
+        assert watch.affected_tasks(graph, patterns, changed) == set()
+
+    def test_everything(self, watched_tasks):
+        graph = Graph([watched_tasks.__task__])
+        affected = watch.affected_tasks(graph, {}, watch.EVERYTHING)
+        assert affected == {"root", "child_A", "child_B"}
+
+
+class WatcherTests:
+    def get_watcher(self):
+        raise NotImplementedError
+
+    def test_changes(self, mock_environment, tmp_path):
+        write(f"{tmp_path}/dir/existing.txt")
+        watcher = self.get_watcher()
+        try:
+            watcher.watch({str(tmp_path): False, f"{tmp_path}/dir": True})
+            assert watcher.read(0) == set()
+
+            write(f"{tmp_path}/dir/existing.txt", "changed")
+            assert f"{tmp_path}/dir/existing.txt" in watcher.wait(debounce=0.1)
+
+            os.remove(f"{tmp_path}/dir/existing.txt")
+            assert f"{tmp_path}/dir/existing.txt" in watcher.wait(debounce=0.1)
+        finally:
+            watcher.close()
+
+    def test_new_directory(self, mock_environment, tmp_path):
+        """New directories in recursive targets are watched"""
+        os.makedirs(f"{tmp_path}/dir")
+        watcher = self.get_watcher()
+        try:
+            watcher.watch({f"{tmp_path}/dir": True})
+            os.makedirs(f"{tmp_path}/dir/sub")
+            watcher.wait(debounce=0.1)
+
+            write(f"{tmp_path}/dir/sub/new.txt")
+            assert f"{tmp_path}/dir/sub/new.txt" in watcher.wait(debounce=0.1)
+        finally:
+            watcher.close()
+
+    def test_debounce(self, mock_environment, tmp_path):
+        """A burst of changes is returned at once"""
+        watcher = self.get_watcher()
+        try:
+            watcher.watch({str(tmp_path): False})
+
+            def burst():
+                for i in range(3):
+                    write(f"{tmp_path}/{i}.txt")
+
+            thread = threading.Thread(target=burst)
+            thread.start()
+            changed = watcher.wait(debounce=0.5)
+            thread.join()
+            assert {f"{tmp_path}/{i}.txt" for i in range(3)} <= changed
+        finally:
+            watcher.close()
+
+
+class TestInotifyWatcher(WatcherTests):
+    def get_watcher(self):
+        try:
+            return watch.InotifyWatcher()
+        except (OSError, AttributeError):
+            pytest.skip("inotify is not available")
+
+
+class TestPollingWatcher(WatcherTests):
+    def get_watcher(self):
+        return watch.PollingWatcher(interval=0.01)
+
+
+class MockWatcher(watch.Watcher):
+    """
+    Watcher that changes a file each time it waits, then interrupts the watch. `edits` are
+    changed when reading after a run, as if they were edited while the run was finishing.
+    """
+
+    def __init__(self, *paths, edits=None):
+        self.paths = list(paths)
+        self.edits = list(edits or [])
+
+    def watch(self, targets):
+        pass
+
+    def read(self, timeout=None):
+        if not self.edits:
+            return set()
+        path = self.edits.pop(0)
+        write(path, "edited")
+        return {path}
+
+    def wait(self, debounce=None):
+        if not self.paths:
+            raise KeyboardInterrupt
+        path = self.paths.pop(0)
+        write(path, "changed")
+        return {path}
+
+
+class TestWatch:
+    def test_affected_subgraph(self, watched_tasks):
+        """Only tasks affected by a change are checked and run again"""
+        path = watched_tasks.path
+        watcher = MockWatcher(f"{path}/src_b/b.py")
+
+        watch.watch([watched_tasks.__task__], [], watcher=watcher)
+        watched_tasks.child_A.mock.assert_called_once_with()
+        assert watched_tasks.child_B.mock.call_count == 2
+        assert watched_tasks.mock.call_count == 2
+
+    def test_unchanged_tasks_not_checked(self, mock_environment, tmp_path):
+        """Tasks known to be complete are skipped without checking them"""
+        root = fake.mock_task(name="root", check=[FileHash(f"{tmp_path}/root.txt")])
+        child = fake.mock_task(name="child", parent="root", check=[FailingCheck("child")])
+        watcher = MockWatcher(f"{tmp_path}/root.txt")
+
+        watch.watch([root.__task__], [], watcher=watcher)
+        assert root.mock.call_count == 2
+        child.mock.assert_called_once_with()
+        child.__task__.checkers[0].check.assert_called_once_with()
+
+    def test_edited_during_run(self, mock_environment, tmp_path):
+        """Files edited after a task saved it's state are checked again"""
+        root = fake.mock_task(name="root", check=[FileHash(f"{tmp_path}/root.txt")])
+        watcher = MockWatcher(edits=[f"{tmp_path}/root.txt"])
+
+        watch.watch([root.__task__], [], watcher=watcher)
+        assert root.mock.call_count == 2
+
+    def test_failure(self, watched_tasks):
+        """Failed tasks are run again after the next change"""
+        path = watched_tasks.path
+        watched_tasks.child_A.mock.side_effect = [ExecuteFailed("broke"), None]
+        watcher = MockWatcher(f"{path}/root.txt")
+
+        watch.watch([watched_tasks.__task__], [], watcher=watcher)
+        assert watched_tasks.child_A.mock.call_count == 2
+        watched_tasks.mock.assert_called_once_with()
+
+    def test_force_first_run(self, watched_tasks):
+        """force only applies to the first run"""
+        watched_tasks.child_A.__task__.checkers[0].save()
+        watcher = MockWatcher(f"{watched_tasks.path}/root.txt")
+
+        watch.watch([watched_tasks.__task__], [], watcher=watcher, force_all=True)
+        watched_tasks.child_A.mock.assert_called_once_with()
+        watched_tasks.child_B.mock.assert_called_once_with()
+        assert watched_tasks.mock.call_count == 2
@@ -15,6 +15,8 @@
 import os
 import shutil
 
+import pytest
+
 from ixian import builder
 
 from ixian.utils import filesystem
@@ -69,3 +71,26 @@ class TestWritePath:
         file = f"{path}/file"
         assert not builder.exists(path)
         self.assert_read_write_file(file, "test_path_doesnt_exist")
+
+    def test_atomic(self, tmp_path, mocker):
+        """A failed write leaves the existing file in place and no temporary files behind"""
+        path = str(tmp_path / "file")
+        filesystem.write_file(path, "old")
+        mocker.patch("os.replace", side_effect=OSError)
+        with pytest.raises(OSError):
+            filesystem.write_file(path, "new")
+        assert filesystem.read_file(path) == "old"
+        assert os.listdir(tmp_path) == ["file"]
+
+
+class TestFileLock:
+    def test_lock(self, tmp_path):
+        path = str(tmp_path / "locks/task.lock")
+        lock = filesystem.FileLock(path)
+        other = filesystem.FileLock(path)
+        assert lock.acquire()
+        assert not other.acquire(blocking=False)
+        lock.release()
+        assert other.acquire(blocking=False)
+        other.release()
+        assert lock.fd is None and other.fd is None
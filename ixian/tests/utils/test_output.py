@@ -0,0 +1,114 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import io
+import os
+from unittest import mock
+
+import pytest
+
+from ixian.utils.output import Multiplexer, TaskOutput
+
+
+@pytest.fixture
+def multiplexer():
+    stream = io.StringIO()
+    multiplexer = Multiplexer(stream=stream, interval=0.01)
+    yield multiplexer
+    multiplexer.close()
+
+
+def add_pipe(multiplexer, name):
+    """Add a pipe to the multiplexer, return the write end, the output and the done event"""
+    read_fd, write_fd = os.pipe()
+    output = TaskOutput(name, multiplexer)
+    done = multiplexer.add(read_fd, output)
+    return write_fd, output, done
+
+
+class TestMultiplexer:
+    def test_prefix(self, multiplexer):
+        write_fd, output, done = add_pipe(multiplexer, "task")
+        os.write(write_fd, b"one\ntw")
+        os.write(write_fd, b"o\nthree")
+        os.close(write_fd)
+        assert done.wait(5)
+
+        assert multiplexer.stream.getvalue() == "task | one\ntask | two\ntask | three\n"
+        assert list(output.lines) == ["one\n", "two\n", "three\n"]
+
+    def test_multiple_pipes(self, multiplexer):
+        """Lines from concurrent pipes are written whole, each with their own prefix"""
+        write_a, _, done_a = add_pipe(multiplexer, "a")
+        write_b, _, done_b = add_pipe(multiplexer, "b")
+        for i in range(100):
+            os.write(write_a, b"aaaa %d\n" % i)
+            os.write(write_b, b"bbbb %d\n" % i)
+        os.close(write_a)
+        os.close(write_b)
+        assert done_a.wait(5) and done_b.wait(5)
+
+        lines = multiplexer.stream.getvalue().splitlines()
+        assert [line for line in lines if line.startswith("a |")] == [
+            f"a | aaaa {i}" for i in range(100)
+        ]
+        assert [line for line in lines if line.startswith("b |")] == [
+            f"b | bbbb {i}" for i in range(100)
+        ]
+        assert len(lines) == 200
+
+    def test_batched(self):
+        """Lines are written in batches rather than one at a time"""
+        stream = mock.Mock()
+        multiplexer = Multiplexer(stream=stream, interval=10)
+        try:
+            write_fd, _, done = add_pipe(multiplexer, "task")
+            for i in range(10):
+                os.write(write_fd, b"line\n")
+            os.close(write_fd)
+            assert done.wait(5)
+        finally:
+            multiplexer.close()
+        stream.write.assert_called_once_with("task | line\n" * 10)
+
+    def test_invalid_utf8(self, multiplexer):
+        write_fd, output, done = add_pipe(multiplexer, "task")
+        os.write(write_fd, b"\xff\n")
+        os.close(write_fd)
+        assert done.wait(5)
+        assert list(output.lines) == ["�\n"]
+
+
+class TestTaskOutput:
+    def test_dump(self, multiplexer):
+        output = TaskOutput("task", multiplexer)
+        output.append("one\n")
+        output.append("two\n")
+        output.dump()
+        assert multiplexer.stream.getvalue() == "---- output of task ----\none\ntwo\n----\n"
+
+    def test_bounded(self, multiplexer):
+        """Only the last lines are kept"""
+        output = TaskOutput("task", multiplexer, max_lines=2)
+        for line in ("one\n", "two\n", "three\n"):
+            output.append(line)
+        assert list(output.lines) == ["two\n", "three\n"]
+        output.dump()
+        assert multiplexer.stream.getvalue() == (
+            "---- output of task, last 2 lines ----\ntwo\nthree\n----\n"
+        )
+
+    def test_dump_empty(self, multiplexer):
+        TaskOutput("task", multiplexer).dump()
+        assert multiplexer.stream.getvalue() == ""
@@ -13,14 +13,20 @@
 # limitations under the License.
 
 import os
+import signal
+import threading
+import time
+
 import pytest
 
 from ixian.exceptions import ExecuteFailed
 from ixian.utils.process import (
+    ProcessGroup,
     raise_for_status,
     get_dev_uid,
     get_dev_gid,
     execute,
+    run_in_group,
 )
 
 
@@ -71,6 +77,70 @@ class TestExecute:
         mock_logger.info.called_with("ls")
 
 
+def wait_for_file(path, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not os.path.exists(path):
+        assert time.monotonic() < deadline, f"{path} wasn't created"
+        time.sleep(0.01)
+
+
+class TestProcessGroup:
+    def test_tracked(self, tmp_path):
+        """Processes started within a group are tracked while they run"""
+        script = write_script(tmp_path, f"touch {tmp_path}/started; sleep 0.2")
+        group = ProcessGroup()
+        thread = threading.Thread(target=run_in_group, args=(group, execute, f"sh {script}"))
+        thread.start()
+        wait_for_file(f"{tmp_path}/started")
+        assert len(group.processes) == 1
+        thread.join(5)
+        assert group.processes == set()
+
+    def test_cancel_kills_children(self, tmp_path):
+        """Cancelling a group kills the process and the processes it started"""
+        script = write_script(tmp_path, f"sleep 30 & echo $! > {tmp_path}/child.pid; wait")
+        group = ProcessGroup()
+        result = []
+        thread = threading.Thread(
+            target=lambda: result.append(run_in_group(group, execute, f"sh {script}"))
+        )
+        thread.start()
+        wait_for_file(f"{tmp_path}/child.pid")
+        group.cancel()
+        thread.join(5)
+
+        assert result == [-signal.SIGKILL]
+        with open(f"{tmp_path}/child.pid") as file:
+            assert not alive(int(file.read()))
+
+    def test_cancelled_group(self, tmp_path):
+        """New processes can't start in a cancelled group"""
+        group = ProcessGroup()
+        group.cancel()
+        with pytest.raises(ExecuteFailed):
+            run_in_group(group, execute, "ls")
+
+    def test_no_group(self):
+        """Processes started outside of a group stay in the runner's process group"""
+        assert execute("ls") == 0
+
+
+def write_script(tmp_path, body):
+    path = f"{tmp_path}/script.sh"
+    with open(path, "w") as file:
+        file.write(body)
+    return path
+
+
+def alive(pid):
+    """Return True if the pid is running. Zombies waiting to be reaped aren't running."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            return file.read().split(") ")[1][0] != "Z"
+    except FileNotFoundError:
+        return False
+
+
 def test_get_dev_uid():
     ix_test_context = os.getenv("IX_TEST_CONTEXT", "UNKNOWN")
     if ix_test_context == "LOCAL":
@@ -12,9 +12,11 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import fcntl
 import logging
 import os
 import shutil
+import uuid
 
 
 logger = logging.getLogger(__name__)
@@ -22,8 +24,8 @@ logger = logging.getLogger(__name__)
 
 def mkdir(path: str) -> None:
     """Make directories in path if they don't exist"""
-    if not os.path.exists(path):
-        os.makedirs(path)
+    # another process may create them at the same time.
+    os.makedirs(path, exist_ok=True)
 
 
 def pwd() -> str:
@@ -50,12 +52,22 @@ def empty_dir(path: str) -> None:
 def write_file(path: str, data: str):
     """
     Write a file to the filesystem, creating any missing directories in the path.
+
+    The data is written to a temporary file that then replaces `path`. Readers, including other
+    processes, see either the old file or the new one and never a partially written file.
     """
     dir = os.path.dirname(path)
     mkdir(dir)
 
-    with open(path, "w") as file:
-        file.write(data)
+    temp_path = os.path.join(dir, f".{os.path.basename(path)}.{uuid.uuid4().hex}.tmp")
+    try:
+        with open(temp_path, "x") as file:
+            file.write(data)
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
 
 
 def read_file(path: str):
@@ -71,6 +83,56 @@ def exists(path: str) -> bool:
     return os.path.exists(path)
 
 
+def open_lock(path: str) -> int:
+    """
+    Open a lock file, creating it and any missing directories in the path.
+
+    :return: file descriptor
+    """
+    mkdir(os.path.dirname(path))
+    return os.open(path, os.O_RDWR | os.O_CREAT, 0o666)
+
+
+class FileLock:
+    """
+    Exclusive advisory lock on a file, held with `fcntl.flock`. Locks are held by this instance
+    until `release` is called. The OS releases them if the process exits.
+
+    :param path: path of the lock file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.fd = None
+        self.locked = False
+
+    def acquire(self, blocking: bool = True) -> bool:
+        """
+        Acquire the lock.
+
+        :param blocking: wait for the lock if it's held by another process
+        :return: True if the lock was acquired
+        """
+        if self.fd is None:
+            self.fd = open_lock(self.path)
+        try:
+            fcntl.flock(self.fd, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return False
+        self.locked = True
+        return True
+
+    def release(self) -> None:
+        if self.fd is None:
+            return
+        if self.locked:
+            # unlock explicitly, forked children may still have the file open.
+            fcntl.flock(self.fd, fcntl.LOCK_UN)
+            self.locked = False
+        os.close(self.fd)
+        self.fd = None
+
+
 def leading_slash(path: str) -> str:
     """
     Simple util for helping to combine paths. It returns a leading slash if the path does not have
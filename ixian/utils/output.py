@@ -0,0 +1,194 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import os
+import selectors
+import sys
+import threading
+import time
+from collections import deque
+
+
+# Output modes: subprocesses write straight to the terminal, or their output is captured and
+# written with each line prefixed by the task's name.
+STREAM = "stream"
+PREFIX = "prefix"
+OUTPUT_MODES = (STREAM, PREFIX)
+
+# Lines of output kept for each task, printed if the task fails
+BUFFER_LINES = 1000
+
+# Seconds between writes to the terminal
+FLUSH_INTERVAL = 0.1
+
+# Seconds to wait for a process's output after it exits. Processes it left running in the
+# background may hold the pipe open.
+DRAIN_TIMEOUT = 1
+
+READ_SIZE = 65536
+
+
+class TaskOutput:
+    """
+    Output captured from a task's subprocesses. The last `max_lines` lines are kept.
+
+    :param name: name of the task
+    :param multiplexer: multiplexer that reads the subprocesses output
+    :param max_lines: number of lines to keep
+    """
+
+    def __init__(self, name: str, multiplexer: "Multiplexer", max_lines: int = BUFFER_LINES):
+        self.name = name
+        self.multiplexer = multiplexer
+        self.lines = deque(maxlen=max_lines)
+        self.dropped = 0
+
+    def append(self, line: str) -> None:
+        if len(self.lines) == self.lines.maxlen:
+            self.dropped += 1
+        self.lines.append(line)
+
+    def dump(self) -> None:
+        """Write all of the kept output in one block"""
+        self.multiplexer.flush()
+        with self.multiplexer.lock:
+            lines = list(self.lines)
+            dropped = self.dropped
+        if not lines:
+            return
+        header = f"---- output of {self.name}"
+        if dropped:
+            header += f", last {len(lines)} lines"
+        self.multiplexer.write([f"{header} ----\n"] + lines + ["----\n"])
+
+
+class Multiplexer:
+    """
+    Reads the output of many subprocesses on a single thread.
+
+    Pipes are non-blocking and watched with a selector. Each line read is added to the task's
+    `TaskOutput` and written to the terminal prefixed with the task's name. Lines are written in
+    batches every `interval` seconds so output from concurrent tasks isn't interleaved mid-line.
+
+    :param stream: stream to write to, defaults to `sys.stdout` at the time of writing
+    :param interval: seconds between writes
+    """
+
+    def __init__(self, stream=None, interval: float = FLUSH_INTERVAL):
+        self.stream = stream
+        self.interval = interval
+        self.selector = selectors.DefaultSelector()
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.added = []
+        self.pending = []
+        self.closing = False
+        self.thread = None
+        self.wakeup_read, self.wakeup_write = os.pipe()
+        os.set_blocking(self.wakeup_read, False)
+        self.selector.register(self.wakeup_read, selectors.EVENT_READ)
+
+    def add(self, fd: int, output: TaskOutput) -> threading.Event:
+        """
+        Read a pipe until it's closed. The multiplexer closes `fd` when it's done.
+
+        :param fd: read end of the pipe
+        :param output: output the lines belong to
+        :return: event that is set once all of the pipe's output was read
+        """
+        os.set_blocking(fd, False)
+        done = threading.Event()
+        with self.lock:
+            self.added.append((fd, output, done))
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name="ixian-output", daemon=True)
+                self.thread.start()
+        os.write(self.wakeup_write, b"\0")
+        return done
+
+    def run(self) -> None:
+        last_write = time.monotonic()
+        while True:
+            with self.lock:
+                for fd, output, done in self.added:
+                    self.selector.register(fd, selectors.EVENT_READ, (output, done, []))
+                self.added.clear()
+                if self.closing and len(self.selector.get_map()) == 1:
+                    break
+
+            for key, _ in self.selector.select(self.interval):
+                if key.fd == self.wakeup_read:
+                    os.read(self.wakeup_read, READ_SIZE)
+                else:
+                    self.read(key)
+
+            if time.monotonic() - last_write >= self.interval:
+                self.flush()
+                last_write = time.monotonic()
+        self.flush()
+
+    def read(self, key: selectors.SelectorKey) -> None:
+        output, done, partial = key.data
+        try:
+            data = os.read(key.fd, READ_SIZE)
+        except BlockingIOError:
+            return
+
+        if data:
+            chunks = (b"".join(partial) + data).split(b"\n")
+            partial[:] = [chunks.pop()]
+            lines = [chunk + b"\n" for chunk in chunks]
+        else:
+            # end of file, the last line may not have a newline.
+            lines = [b"".join(partial) + b"\n"] if any(partial) else []
+            self.selector.unregister(key.fd)
+            os.close(key.fd)
+
+        with self.lock:
+            for line in lines:
+                text = line.decode("utf-8", errors="replace")
+                output.append(text)
+                self.pending.append(f"{output.name} | {text}")
+
+        if not data:
+            self.flush()
+            done.set()
+
+    def flush(self) -> None:
+        """Write pending lines"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if pending:
+            self.write(pending)
+
+    def write(self, lines: list) -> None:
+        stream = self.stream or sys.stdout
+        with self.write_lock:
+            stream.write("".join(lines))
+            stream.flush()
+
+    def close(self) -> None:
+        """Wait for open pipes to close and write any remaining output"""
+        with self.lock:
+            self.closing = True
+            thread = self.thread
+        os.write(self.wakeup_write, b"\0")
+        if thread is not None:
+            thread.join(DRAIN_TIMEOUT)
+            if thread.is_alive():
+                # background processes are holding pipes open, keep writing their output.
+                return
+        self.selector.close()
+        os.close(self.wakeup_read)
+        os.close(self.wakeup_write)
@@ -14,15 +14,105 @@
 
 import logging
 import os
+import signal
 import subprocess
+import threading
 
 from ixian.config import CONFIG
 from ixian.exceptions import ExecuteFailed
+from ixian.utils.output import DRAIN_TIMEOUT
 
 
 logger = logging.getLogger(__name__)
 
 
+# ProcessGroup of the task running on the current thread
+local = threading.local()
+
+
+class ProcessGroup:
+    """
+    Tracks the subprocesses started by `execute` on behalf of a task, so they can be signalled
+    when the task times out or the run is interrupted.
+
+    If `isolate` is set each subprocess is started in it's own session. Signals are sent to the
+    subprocess's process group so any processes it started receive them too. Otherwise
+    subprocesses stay in ix's process group and keep the terminal, e.g. for interactive commands.
+    They receive the terminal's SIGINT themselves, other signals are sent to the subprocess only.
+
+    If `output` is set the subprocesses' stdout and stderr are captured in it instead of being
+    written to the terminal.
+    """
+
+    def __init__(self, isolate: bool = True):
+        self.processes = set()
+        self.cancelled = False
+        self.lock = threading.Lock()
+        self.output = None
+        self.isolate = isolate
+
+    def add(self, process: subprocess.Popen) -> None:
+        """
+        Track a subprocess. Kills it if the group was already cancelled.
+
+        :raises ExecuteFailed: if the group was cancelled
+        """
+        with self.lock:
+            if not self.cancelled:
+                self.processes.add(process)
+                return
+        self.kill(process, signal.SIGKILL)
+        process.wait()
+        raise ExecuteFailed("Task was cancelled")
+
+    def remove(self, process: subprocess.Popen) -> None:
+        with self.lock:
+            self.processes.discard(process)
+
+    def send_signal(self, signum: int) -> None:
+        """Send a signal to every running subprocess and their children"""
+        with self.lock:
+            processes = list(self.processes)
+        for process in processes:
+            self.kill(process, signum)
+
+    def cancel(self, signum: int = signal.SIGKILL) -> None:
+        """
+        Signal running subprocesses and prevent new ones from starting.
+
+        :param signum: signal to send, defaults to killing them
+        """
+        with self.lock:
+            self.cancelled = True
+        self.send_signal(signum)
+
+    def kill(self, process: subprocess.Popen, signum: int) -> None:
+        try:
+            if self.isolate:
+                os.killpg(process.pid, signum)
+            elif signum != signal.SIGINT:
+                process.send_signal(signum)
+        except (ProcessLookupError, PermissionError):
+            # already exited
+            pass
+
+
+def run_in_group(group: ProcessGroup, func, *args):
+    """
+    Call `func`. Subprocesses it starts with `execute` are added to `group`.
+
+    :param group: group to add subprocesses to
+    :param func: function to call
+    :param args: args for the function
+    :return: return value of the function
+    """
+    local.group = group
+    try:
+        return func(*args)
+    finally:
+        local.group = None
+
+
 def raise_for_status(code: int) -> None:
     """
     Raise `ExecuteFailed` if the code is an error code
@@ -60,7 +150,36 @@ def execute(command: str, silent: bool = False, env: dict = None) -> int:
         built_env.update(env)
 
     args = [arg for arg in formatted_command.split(" ") if arg]
-    return subprocess.call(args, env=built_env)
+    group = getattr(local, "group", None)
+    if group is None:
+        return subprocess.call(args, env=built_env)
+
+    # An isolated process gets it's own session so it can be killed along with any children. It
+    # no longer receives the terminal's SIGINT, the scheduler passes that on.
+    if group.output is None:
+        process = subprocess.Popen(args, env=built_env, start_new_session=group.isolate)
+        done = None
+    else:
+        read_fd, write_fd = os.pipe()
+        try:
+            process = subprocess.Popen(
+                args, env=built_env, start_new_session=group.isolate, stdout=write_fd, stderr=write_fd
+            )
+        except BaseException:
+            os.close(read_fd)
+            raise
+        finally:
+            os.close(write_fd)
+        done = group.output.multiplexer.add(read_fd, group.output)
+
+    try:
+        group.add(process)
+        code = process.wait()
+    finally:
+        group.remove(process)
+    if done is not None:
+        done.wait(DRAIN_TIMEOUT)
+    return code
 
 
 def get_dev_uid() -> int:
@@ -0,0 +1,436 @@
+# Copyright [2018-2020] Peter Krenesky
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import time
+from fnmatch import fnmatch
+from glob import glob, has_magic
+
+from ixian.config import CONFIG
+from ixian.exceptions import AlreadyComplete, ExecuteFailed
+from ixian.graph import Graph
+
+
+logger = logging.getLogger(__name__)
+
+
+# Seconds to wait for a burst of changes to settle before running
+DEBOUNCE = 0.2
+
+# Seconds between scans when inotify isn't available
+POLL_INTERVAL = 0.5
+
+# Returned by watchers when changes were missed, every task must be checked.
+EVERYTHING = "*"
+
+
+def file_patterns(graph: Graph) -> dict:
+    """
+    Collect the path patterns of every `FileHash` checker in a graph. Relative patterns are made
+    absolute, watchers report absolute paths.
+
+    :param graph: graph of tasks
+    :return: dict of task name to list of absolute patterns
+    """
+    from ixian.modules.filesystem.file_hash import FileHash
+
+    patterns = {}
+    for name, runner in graph.runners.items():
+        for checker in runner.checkers or []:
+            if isinstance(checker, FileHash):
+                absolute = [os.path.abspath(pattern) for pattern in checker.patterns]
+                patterns.setdefault(name, []).extend(absolute)
+    return patterns
+
+
+def existing_parent(path: str) -> str:
+    """Return the closest directory that exists containing `path`"""
+    path = os.path.dirname(path)
+    while path and not os.path.isdir(path):
+        path = os.path.dirname(path)
+    return path or "/"
+
+
+def watch_targets(patterns: list) -> dict:
+    """
+    Determine which directories must be watched to see changes to paths matching the patterns.
+
+    Directories that match are watched recursively since `FileHash` hashes their contents. The
+    parent of each pattern is watched so new and removed files are seen.
+
+    :param patterns: list of path patterns, relative patterns are relative to the working
+        directory
+    :return: dict of directory to True if it should be watched recursively
+    """
+    targets = {}
+    patterns = [os.path.abspath(pattern) for pattern in patterns]
+
+    def add(path, recursive):
+        targets[path] = targets.get(path, False) or recursive
+
+    for pattern in patterns:
+        if has_magic(pattern):
+            # watch the part of the pattern without wildcards, plus anything it currently matches
+            base = pattern
+            while has_magic(base):
+                base = os.path.dirname(base)
+            add(base if os.path.isdir(base) else existing_parent(base), False)
+            matches = glob(pattern)
+        else:
+            matches = [pattern]
+
+        for path in matches:
+            if os.path.isdir(path):
+                add(path, True)
+            add(existing_parent(path), False)
+    return targets
+
+
+def matches(path: str, pattern: str) -> bool:
+    """Return True if a changed path affects the state of a pattern"""
+    path, pattern = os.path.abspath(path), os.path.abspath(pattern)
+    if path == pattern or path.startswith(pattern.rstrip("/") + "/"):
+        return True
+    if has_magic(pattern):
+        # the path, or a directory containing it, matches the wildcard
+        while path and path != "/":
+            if fnmatch(path, pattern):
+                return True
+            path = os.path.dirname(path)
+    return False
+
+
+def affected_tasks(graph: Graph, patterns: dict, changed: set) -> set:
+    """
+    Find the tasks affected by changed paths: tasks with a pattern matching a changed path and
+    every task that depends on them.
+
+    :param graph: graph of tasks
+    :param patterns: dict of task name to list of patterns
+    :param changed: set of changed paths, or EVERYTHING
+    :return: set of task names
+    """
+    if changed == EVERYTHING:
+        return set(graph.runners)
+
+    affected = {
+        name
+        for name, task_patterns in patterns.items()
+        if any(matches(path, pattern) for path in changed for pattern in task_patterns)
+    }
+
+    stack = list(affected)
+    while stack:
+        for dependent in graph.dependents[stack.pop()]:
+            if dependent not in affected:
+                affected.add(dependent)
+                stack.append(dependent)
+    return affected
+
+
+class Watcher:
+    """
+    Watches directories for changes. Subclasses implement `watch` and `read`.
+    """
+
+    def watch(self, targets: dict) -> None:
+        """
+        Watch directories. May be called again to add new directories.
+
+        :param targets: dict of directory to True if it should be watched recursively
+        """
+        raise NotImplementedError
+
+    def read(self, timeout: float = None):
+        """
+        Return paths that changed since the last read. Blocks up to `timeout` seconds waiting for
+        a change, or forever if `timeout` is None.
+
+        :param timeout: seconds to wait
+        :return: set of changed paths, or EVERYTHING if changes were missed
+        """
+        raise NotImplementedError
+
+    def wait(self, debounce: float = DEBOUNCE):
+        """
+        Wait for changes. Once a change is seen keep collecting changes until none are seen for
+        `debounce` seconds. Editors and builds often write many files at once.
+
+        :param debounce: seconds without changes before returning
+        :return: set of changed paths, or EVERYTHING
+        """
+        changed = self.read()
+        while True:
+            more = self.read(debounce)
+            if not more:
+                return changed
+            changed = EVERYTHING if EVERYTHING in (changed, more) else changed | more
+
+    def close(self) -> None:
+        pass
+
+
+def ignored(path: str) -> bool:
+    """Changes to BUILDER are made by ixian itself and never trigger a run"""
+    builder = CONFIG.BUILDER
+    return path == builder or path.startswith(builder + "/")
+
+
+class InotifyWatcher(Watcher):
+    """
+    Watcher using linux inotify through ctypes.
+
+    inotify watches aren't recursive, every directory in a recursive target is watched. New
+    directories are watched as they are created.
+    """
+
+    IN_MODIFY = 0x00000002
+    IN_ATTRIB = 0x00000004
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = os.O_NONBLOCK
+    IN_CLOEXEC = 0o2000000
+
+    MASK = (
+        IN_MODIFY
+        | IN_ATTRIB
+        | IN_CLOSE_WRITE
+        | IN_MOVED_FROM
+        | IN_MOVED_TO
+        | IN_CREATE
+        | IN_DELETE
+        | IN_DELETE_SELF
+        | IN_MOVE_SELF
+    )
+
+    EVENT = struct.Struct("iIII")
+
+    def __init__(self):
+        self.libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        self.fd = self.libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self.fd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error))
+        self.watches = {}
+        self.recursive = set()
+
+    def add_watch(self, path: str, recursive: bool) -> None:
+        paths = [path]
+        if recursive:
+            self.recursive.add(path)
+            paths.extend(
+                os.path.join(root, name)
+                for root, dirs, _ in os.walk(path)
+                for name in dirs
+                if not ignored(os.path.join(root, name))
+            )
+        for path in paths:
+            wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), self.MASK)
+            if wd < 0:
+                error = ctypes.get_errno()
+                if error in (errno.ENOENT, errno.ENOTDIR):
+                    # removed before it could be watched
+                    continue
+                raise OSError(error, f"{os.strerror(error)}: {path}")
+            self.watches[wd] = path
+
+    def watch(self, targets: dict) -> None:
+        for path, recursive in targets.items():
+            self.add_watch(path, recursive)
+
+    def is_recursive(self, path: str) -> bool:
+        return any(path.startswith(root + "/") for root in self.recursive)
+
+    def read(self, timeout: float = None):
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self.fd, 64 * 1024)
+            except BlockingIOError:
+                break
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = self.EVENT.unpack_from(data, offset)
+                offset += self.EVENT.size
+                name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))  # noqa: E203
+                offset += length
+
+                if mask & self.IN_Q_OVERFLOW:
+                    changed = EVERYTHING
+                    continue
+                if mask & self.IN_IGNORED:
+                    self.watches.pop(wd, None)
+                    continue
+
+                directory = self.watches.get(wd)
+                if directory is None:
+                    continue
+                path = os.path.join(directory, name) if name else directory
+                if ignored(path):
+                    continue
+                if mask & self.IN_ISDIR and mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    if self.is_recursive(path):
+                        self.add_watch(path, True)
+                if changed != EVERYTHING:
+                    changed.add(path)
+        return changed
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class PollingWatcher(Watcher):
+    """
+    Watcher that scans the watched directories for changes to file sizes, modes, and modification
+    times. Used when inotify isn't available.
+    """
+
+    def __init__(self, interval: float = POLL_INTERVAL):
+        self.interval = interval
+        self.targets = {}
+        self.snapshot = {}
+
+    def scan(self) -> dict:
+        snapshot = {}
+        for path, recursive in self.targets.items():
+            if recursive:
+                paths = (
+                    os.path.join(root, name)
+                    for root, dirs, files in os.walk(path)
+                    for name in dirs + files
+                )
+            else:
+                try:
+                    paths = (os.path.join(path, name) for name in os.listdir(path))
+                except OSError:
+                    continue
+            for child in paths:
+                if ignored(child):
+                    continue
+                try:
+                    stat = os.lstat(child)
+                except OSError:
+                    continue
+                snapshot[child] = (stat.st_mtime_ns, stat.st_size, stat.st_mode)
+        return snapshot
+
+    def watch(self, targets: dict) -> None:
+        self.targets.update(targets)
+        self.snapshot = self.scan()
+
+    def read(self, timeout: float = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            snapshot = self.scan()
+            changed = {
+                path
+                for path in set(snapshot) | set(self.snapshot)
+                if snapshot.get(path) != self.snapshot.get(path)
+            }
+            self.snapshot = snapshot
+            if changed:
+                return changed
+
+            if deadline is None:
+                time.sleep(self.interval)
+            else:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return set()
+                time.sleep(min(self.interval, remaining))
+
+
+def get_watcher() -> Watcher:
+    """Return an inotify watcher if it's supported, otherwise a polling watcher"""
+    try:
+        return InotifyWatcher()
+    except (OSError, AttributeError) as e:
+        logger.debug(f"inotify is not available, polling for changes: {e}")
+        return PollingWatcher()
+
+
+def watch(runners: list, args: list, watcher: Watcher = None, debounce=DEBOUNCE, **kwargs):
+    """
+    Run tasks, then re-run them whenever the files their `FileHash` checkers hash change.
+
+    Only tasks affected by a change, and the tasks that depend on them, are checked again. Every
+    other task is known to be complete from the last successful run and is skipped without being
+    hashed. `force` and `clean` options only apply to the first run.
+
+    Runs until interrupted.
+
+    :param runners: TaskRunners to run
+    :param args: args to pass through to the tasks
+    :param watcher: Watcher to use, defaults to `get_watcher()`
+    :param debounce: seconds without changes before running
+    :param kwargs: options for task execution
+    """
+    from ixian.task import execute
+
+    graph = Graph(runners)
+    graph.order()
+    patterns = file_patterns(graph)
+    all_patterns = [pattern for task_patterns in patterns.values() for pattern in task_patterns]
+    watcher = watcher or get_watcher()
+
+    complete = set()
+    options = kwargs
+    try:
+        while True:
+            watcher.watch(watch_targets(all_patterns))
+            try:
+                execute(runners, args, complete=complete, **options)
+            except AlreadyComplete:
+                logger.info("Already complete.")
+                complete = set(graph.runners)
+            except ExecuteFailed as e:
+                logger.error(str(e))
+            else:
+                complete = set(graph.runners)
+            options = {
+                key: kwargs[key]
+                for key in ("jobs", "keep_going", "workers", "timeout", "output")
+                if key in kwargs
+            }
+
+            # Files may have been edited after a task saved it's state. Changes seen during the run
+            # are checked again right away, changes the run made itself pass the check cheaply.
+            affected = affected_tasks(graph, patterns, watcher.read(0))
+            while not affected:
+                logger.info("Watching for changes...")
+                affected = affected_tasks(graph, patterns, watcher.wait(debounce))
+            complete -= affected
+    except KeyboardInterrupt:
+        pass
+    finally:
+        watcher.close()